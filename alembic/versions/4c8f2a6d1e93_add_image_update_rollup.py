@@ -0,0 +1,39 @@
+"""add image_update_rollup
+
+Revision ID: 4c8f2a6d1e93
+Revises: e2a9d4c61f07
+Create Date: 2026-10-18 13:41:09.772046
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '4c8f2a6d1e93'
+down_revision: Union[str, None] = 'e2a9d4c61f07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('image_update_rollup',
+    sa.Column('image_id', sa.Integer(), nullable=False),
+    sa.Column('granularity', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('bucket_start', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['image_id'], ['image_to_scrape.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('image_id', 'granularity', 'bucket_start')
+    )
+
+    op.execute("""INSERT INTO image_update_rollup (image_id, granularity, bucket_start, count)
+                  SELECT image_id, granularity, DATE_TRUNC(granularity, scraped_at), COUNT(*)
+                  FROM image_update
+                           CROSS JOIN (VALUES ('week'), ('month')) AS granularities(granularity)
+                  GROUP BY image_id, granularity, DATE_TRUNC(granularity, scraped_at)""")
+
+
+def downgrade() -> None:
+    op.drop_table('image_update_rollup')
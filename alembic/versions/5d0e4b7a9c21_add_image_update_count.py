@@ -0,0 +1,40 @@
+"""add image_update_count
+
+Revision ID: 5d0e4b7a9c21
+Revises: 83a30e76c2e9
+Create Date: 2026-10-18 10:03:17.221904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '5d0e4b7a9c21'
+down_revision: Union[str, None] = '83a30e76c2e9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('image_to_scrape', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('image_update_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("""UPDATE image_to_scrape
+                  SET image_update_count = counts.image_update_count
+                  FROM (SELECT image_id, COUNT(*) AS image_update_count
+                        FROM image_update
+                        GROUP BY image_id) AS counts
+                  WHERE image_to_scrape.id = counts.image_id""")
+
+    with op.batch_alter_table('image_to_scrape', schema=None) as batch_op:
+        batch_op.create_index('compound_index_image_update_count_id', [sa.text('image_update_count DESC'), 'id'],
+                              unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('image_to_scrape', schema=None) as batch_op:
+        batch_op.drop_index('compound_index_image_update_count_id')
+        batch_op.drop_column('image_update_count')
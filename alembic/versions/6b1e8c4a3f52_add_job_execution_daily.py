@@ -0,0 +1,40 @@
+"""add job_execution_daily
+
+Revision ID: 6b1e8c4a3f52
+Revises: 9a3d5e7f2b18
+Create Date: 2026-10-18 15:12:38.481920
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '6b1e8c4a3f52'
+down_revision: Union[str, None] = '9a3d5e7f2b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('job_execution_daily',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('successful_scans', sa.Integer(), nullable=False),
+    sa.Column('failed_scans', sa.Integer(), nullable=False),
+    sa.Column('total_duration_seconds', sa.Float(), nullable=False),
+    sa.PrimaryKeyConstraint('day')
+    )
+
+    op.execute("""INSERT INTO job_execution_daily (day, successful_scans, failed_scans, total_duration_seconds)
+                  SELECT DATE(started),
+                         COUNT(*) FILTER (WHERE failed_queries = 0 AND successful_queries > 0),
+                         COUNT(*) FILTER (WHERE successful_queries = 0 OR failed_queries > 0),
+                         COALESCE(SUM(EXTRACT(EPOCH FROM (completed - started))), 0)
+                  FROM background_job_execution
+                  GROUP BY DATE(started)""")
+
+
+def downgrade() -> None:
+    op.drop_table('job_execution_daily')
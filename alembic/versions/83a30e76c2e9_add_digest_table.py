@@ -0,0 +1,66 @@
+"""add digest table
+
+Revision ID: 83a30e76c2e9
+Revises: 8f9226e14543
+Create Date: 2026-10-18 09:12:41.503127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '83a30e76c2e9'
+down_revision: Union[str, None] = '8f9226e14543'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('digest',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('algorithm', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('hash', sa.LargeBinary(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('algorithm', 'hash', name='algorithm_hash')
+    )
+
+    # Intern the existing "<algorithm>:<hex>" digest strings
+    op.execute("""INSERT INTO digest (algorithm, hash)
+                  SELECT DISTINCT split_part(digest, ':', 1), decode(split_part(digest, ':', 2), 'hex')
+                  FROM image_update""")
+
+    with op.batch_alter_table('image_update', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('digest_id', sa.Integer(), nullable=True))
+
+    op.execute("""UPDATE image_update
+                  SET digest_id = digest.id
+                  FROM digest
+                  WHERE digest.algorithm = split_part(image_update.digest, ':', 1)
+                    AND digest.hash = decode(split_part(image_update.digest, ':', 2), 'hex')""")
+
+    with op.batch_alter_table('image_update', schema=None) as batch_op:
+        batch_op.alter_column('digest_id', nullable=False)
+        batch_op.create_foreign_key('image_update_digest_id_fkey', 'digest', ['digest_id'], ['id'])
+        batch_op.create_index('compound_index_digest_image', ['digest_id', 'image_id'], unique=False)
+        batch_op.drop_column('digest')
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('image_update', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('digest', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+
+    op.execute("""UPDATE image_update
+                  SET digest = digest.algorithm || ':' || encode(digest.hash, 'hex')
+                  FROM digest
+                  WHERE digest.id = image_update.digest_id""")
+
+    with op.batch_alter_table('image_update', schema=None) as batch_op:
+        batch_op.alter_column('digest', nullable=False)
+        batch_op.drop_index('compound_index_digest_image')
+        batch_op.drop_constraint('image_update_digest_id_fkey', type_='foreignkey')
+        batch_op.drop_column('digest_id')
+
+    op.drop_table('digest')
@@ -0,0 +1,28 @@
+"""add known_tags_updated_at
+
+Revision ID: 9a3d5e7f2b18
+Revises: 4c8f2a6d1e93
+Create Date: 2026-10-18 14:26:53.104587
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = '9a3d5e7f2b18'
+down_revision: Union[str, None] = '4c8f2a6d1e93'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('scraped_image', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('known_tags_updated_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('scraped_image', schema=None) as batch_op:
+        batch_op.drop_column('known_tags_updated_at')
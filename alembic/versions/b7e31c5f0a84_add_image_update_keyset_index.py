@@ -0,0 +1,28 @@
+"""add image_update keyset index
+
+Revision ID: b7e31c5f0a84
+Revises: 5d0e4b7a9c21
+Create Date: 2026-10-18 11:24:52.640318
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7e31c5f0a84'
+down_revision: Union[str, None] = '5d0e4b7a9c21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('image_update', schema=None) as batch_op:
+        batch_op.create_index('compound_index_image_id_scraped_at_id', ['image_id', 'scraped_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('image_update', schema=None) as batch_op:
+        batch_op.drop_index('compound_index_image_id_scraped_at_id')
@@ -0,0 +1,36 @@
+"""add trigram search indexes
+
+Revision ID: e2a9d4c61f07
+Revises: b7e31c5f0a84
+Create Date: 2026-10-18 12:07:35.918264
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = 'e2a9d4c61f07'
+down_revision: Union[str, None] = 'b7e31c5f0a84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    with op.batch_alter_table('image_to_scrape', schema=None) as batch_op:
+        batch_op.create_index('trgm_index_image', ['image'], unique=False, postgresql_using='gin',
+                              postgresql_ops={'image': 'gin_trgm_ops'})
+        batch_op.create_index('trgm_index_tag', ['tag'], unique=False, postgresql_using='gin',
+                              postgresql_ops={'tag': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('image_to_scrape', schema=None) as batch_op:
+        batch_op.drop_index('trgm_index_tag', postgresql_using='gin')
+        batch_op.drop_index('trgm_index_image', postgresql_using='gin')
+
+    # Note: we deliberately keep the pg_trgm extension, because other objects might depend on it
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Optional
+
+logger = logging.getLogger("BatchWriter")
+
+_STOP = object()
+
+
+class BatchWriter:
+    """
+    Decouples producers (e.g. coroutines that fetch digests from registries) from database persistence: producers
+    put() results into a bounded queue, and a single writer coroutine consumes them, coalescing up to max_batch_size
+    results (or whatever arrived within max_batch_delay) into one write_batch() call, i.e., one transaction.
+
+    Producers are only slowed down (backpressure) when the queue is full, i.e. when the database cannot keep up.
+    """
+
+    def __init__(self, write_batch: Callable[[list[Any]], Awaitable[None]], max_queue_size: int,
+                 max_batch_size: int, max_batch_delay: timedelta):
+        self._write_batch = write_batch
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._max_batch_size = max_batch_size
+        self._max_batch_delay_seconds = max_batch_delay.total_seconds()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, item: Any):
+        await self._queue.put(item)
+
+    async def close(self):
+        """
+        Writes all remaining items, then stops the writer coroutine.
+        """
+        await self._queue.put(_STOP)
+        await self._task
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopped = False
+        while not stopped:
+            item = await self._queue.get()
+            if item is _STOP:
+                break
+
+            batch = [item]
+            deadline = loop.time() + self._max_batch_delay_seconds
+            while len(batch) < self._max_batch_size:
+                timeout = deadline - loop.time()
+                try:
+                    item = self._queue.get_nowait() if timeout <= 0 else \
+                        await asyncio.wait_for(self._queue.get(), timeout)
+                except (asyncio.QueueEmpty, TimeoutError):
+                    break
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.append(item)
+
+            try:
+                await self._write_batch(batch)
+            except Exception as e:
+                # We must not let the writer die, otherwise the producers would block forever once the queue is full
+                logger.warning(f"Failed to write a batch of {len(batch)} items: {e}")
@@ -0,0 +1,73 @@
+"""
+Async database access for the scraper.
+
+The scraper does all of its HTTP requests with asyncio. Using synchronous (rx.session()) database sessions from within
+coroutines would block the event loop during every query/commit, freezing all in-flight registry requests. We therefore
+use an async SQLAlchemy engine (psycopg 3 supports asyncio natively) with a small connection pool.
+"""
+import os
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from docker_tag_monitor.digests import split_digest
+
+DATABASE_URL = os.getenv("REFLEX_DB_URL", "sqlite:///reflex.db")
+"""
+The same connection string that the Reflex web backend uses. We read it ourselves (instead of from rx.config), because
+the scraper does not import Reflex, which would slow down its startup and increase its memory usage considerably.
+"""
+DATABASE_POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "3"))
+"""
+Number of database connections the scraper keeps open.
+"""
+
+_engine: AsyncEngine | None = None
+
+
+def get_async_engine() -> AsyncEngine:
+    global _engine
+    if _engine is None:
+        _engine = create_async_engine(DATABASE_URL, pool_size=DATABASE_POOL_SIZE, max_overflow=0,
+                                      pool_pre_ping=True)
+    return _engine
+
+
+def async_session() -> AsyncSession:
+    """
+    Returns a new async session. We disable expire_on_commit, because otherwise accessing an attribute of an ORM
+    object after a commit would trigger an implicit (lazy) refresh query, which is not possible with async sessions.
+    """
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+
+# Inserts the missing (algorithm, hash) pairs into the Digest table, and returns the ids of all given pairs
+INTERN_DIGESTS_QUERY = text("""WITH input AS (SELECT *
+                                              FROM unnest(CAST(:algorithms AS text[]), CAST(:hashes AS bytea[]))
+                                                  AS t(algorithm, hash)),
+                                    inserted AS (INSERT INTO digest (algorithm, hash)
+                                                     SELECT algorithm, hash FROM input
+                                                     ON CONFLICT (algorithm, hash) DO NOTHING
+                                                     RETURNING id, algorithm, hash)
+                               SELECT id, algorithm, hash
+                               FROM inserted
+                               UNION ALL
+                               SELECT digest.id, digest.algorithm, digest.hash
+                               FROM digest
+                                        JOIN input ON digest.algorithm = input.algorithm AND digest.hash = input.hash""")
+
+
+async def intern_digests(session: AsyncSession, digests: set[str]) -> dict[str, int]:
+    """
+    Ensures that the given digests (e.g. "sha256:<hex>") exist in the Digest table, returning a mapping from each
+    digest to the id of its Digest row. Uses a single query, regardless of the number of digests.
+    """
+    if not digests:
+        return {}
+
+    digests_by_key = {split_digest(digest): digest for digest in digests}
+    algorithms, hashes = zip(*digests_by_key.keys())
+    rows = await session.exec(INTERN_DIGESTS_QUERY,
+                              params={"algorithms": list(algorithms), "hashes": list(hashes)})
+    return {digests_by_key[(algorithm, bytes(hash_bytes))]: digest_id for digest_id, algorithm, hash_bytes in rows}
@@ -5,12 +5,13 @@ from typing import Optional
 import aiohttp
 from aiohttp import ClientSession
 from docker_registry_client_async import Indices
-from pydantic.v1.datetime_parse import parse_datetime
 from datetime import datetime
 
 from docker_tag_monitor.constants import DOCKERHUB_IMAGE_QUERY_URL, DOCKERHUB_LIST_TAGS_FOR_IMAGE_URL, \
     DOCKERHUB_TAG_DETAILS_FOR_IMAGE_URL, DOCKERHUB_AUTH_TOKEN_URL
 from docker_tag_monitor.models import ImageToScrape
+from docker_tag_monitor.parsing import parse_datetime, json_loads
+from docker_tag_monitor.registry_traffic import create_client_session
 
 logger = logging.getLogger("DockerHubScraper")
 
@@ -21,10 +22,10 @@ async def get_popular_images():
     logger.info("Getting popular images")
     most_popular_images: list[str] = []
 
-    async with aiohttp.ClientSession() as session:
+    async with create_client_session() as session:
         try:
             async with session.get(DOCKERHUB_IMAGE_QUERY_URL, raise_for_status=True) as response:
-                data = await response.json()
+                data = await response.json(loads=json_loads)
         except aiohttp.ClientError as e:
             logger.warning(f"Failed to get list of popular DockerHub images: {e}")
             return most_popular_images
@@ -50,13 +51,13 @@ async def get_images_with_tags_to_scrape(most_popular_images: list[str]) -> list
     logger.info("Retrieving tags for the popular images")
     images_to_scrape: list[ImageToScrape] = []
 
-    async with aiohttp.ClientSession() as session:
+    async with create_client_session() as session:
         for image_name in most_popular_images:
             tags_url = DOCKERHUB_LIST_TAGS_FOR_IMAGE_URL.format(image_name=image_name,
                                                                 tags_per_image=TAGS_PER_IMAGE_MAX_COUNT)
             try:
                 async with session.get(tags_url, raise_for_status=True) as response:
-                    tags = await response.json()
+                    tags = await response.json(loads=json_loads)
             except aiohttp.ClientError as e:
                 logger.warning(f"Failed to get tags for image '{image_name}': {e}")
                 return images_to_scrape
@@ -85,7 +86,7 @@ async def get_last_push_date(image: ImageToScrape, session: ClientSession) -> Op
                                                                  tag_name=image.tag)
     try:
         async with session.get(tag_details_url, raise_for_status=True) as response:
-            tag_details = await response.json()
+            tag_details = await response.json(loads=json_loads)
     except aiohttp.ClientError as e:
         logger.warning(f"Failed to get tag details for image '{image_name}': {e}")
         return None
@@ -107,13 +108,13 @@ async def get_dockerhub_auth_header() -> dict[str, str]:
     if username and password:
         # See https://docs.docker.com/reference/api/hub/latest/#tag/authentication-api/operation/AuthCreateAccessToken
         try:
-            async with aiohttp.ClientSession() as session:
+            async with create_client_session() as session:
                 data = {
                     "identifier": username,
                     "secret": password
                 }
                 async with session.post(DOCKERHUB_AUTH_TOKEN_URL, json=data, raise_for_status=True) as response:
-                    result = await response.json()
+                    result = await response.json(loads=json_loads)
                     access_token = result["access_token"]
                     auth_headers["Authorization"] = f"Bearer {access_token}"
         except Exception as e:
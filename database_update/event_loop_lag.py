@@ -0,0 +1,52 @@
+import asyncio
+import statistics
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass
+class EventLoopLagStats:
+    samples: int
+    mean_ms: float
+    p99_ms: float
+    max_ms: float
+
+    def __str__(self):
+        return f"mean={self.mean_ms:.1f}ms, p99={self.p99_ms:.1f}ms, max={self.max_ms:.1f}ms ({self.samples} samples)"
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a coroutine that sleeps for a fixed interval. Any lag beyond a few
+    milliseconds means that some code blocked the event loop (e.g. synchronous database I/O), which also delays all
+    in-flight registry requests and distorts the timing of the request limiter.
+    """
+
+    def __init__(self, sample_interval_seconds: float = 0.05):
+        self._sample_interval_seconds = sample_interval_seconds
+        self._lags: list[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _sample(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self._sample_interval_seconds)
+            self._lags.append(max(0.0, time.perf_counter() - start - self._sample_interval_seconds))
+
+    def start(self):
+        self._lags.clear()
+        self._task = asyncio.create_task(self._sample())
+
+    def stop(self) -> EventLoopLagStats:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if not self._lags:
+            return EventLoopLagStats(samples=0, mean_ms=0.0, p99_ms=0.0, max_ms=0.0)
+
+        lags_ms = sorted(lag * 1000 for lag in self._lags)
+        return EventLoopLagStats(samples=len(lags_ms), mean_ms=statistics.fmean(lags_ms),
+                                 p99_ms=lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))],
+                                 max_ms=lags_ms[-1])
@@ -0,0 +1,30 @@
+import asyncio
+import logging
+import os
+import sys
+from typing import Coroutine
+
+logger = logging.getLogger("DatabaseUpdater")
+
+USE_UVLOOP = os.getenv("USE_UVLOOP", "true").lower() in ["true", "1", "yes"]
+"""
+Whether to run the scraper on uvloop (if it is installed), which has a considerably lower per-request overhead than
+the default asyncio event loop.
+"""
+
+
+def run(main: Coroutine):
+    """
+    Runs the scraper's main coroutine on the fastest available event loop.
+    """
+    if sys.platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    elif USE_UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            logger.info("uvloop is not installed, using the default asyncio event loop")
+        else:
+            return asyncio.run(main, loop_factory=uvloop.new_event_loop)
+
+    return asyncio.run(main)
@@ -1,8 +1,5 @@
+# Note: the pages are imported by the app module (docker_tag_monitor.py), such that the scraper process can import
+# e.g. the models without importing Reflex
 from . import models
-from .pages import (
-    overview,
-    image_details,
-    site_status
-)
 
-__all__ = ["models", "overview", "image_details", "site_status"]
+__all__ = ["models"]
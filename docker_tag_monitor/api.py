@@ -0,0 +1,273 @@
+"""
+Read-only JSON API (mounted on the Reflex backend, see docker_tag_monitor.py), e.g. for CI pipelines that want to know
+how often an image changes, without having to use the websocket-based UI.
+
+Responses of the per-image endpoint are served from the details snapshots (see details_snapshot.py), so repeated
+requests do not query the database. They carry strong ETag and Last-Modified headers (which only change when the
+scraper records a new digest of the image, or deletes old ones), support conditional requests, and are cached by
+Caddy (see edge_cache.py) or a CDN. The bulk endpoint fetches the statistics of many images with a single query.
+"""
+import email.utils
+import json
+import os
+from datetime import timezone, timedelta
+from typing import Optional
+
+import durationpy
+import reflex as rx
+from docker_registry_client_async import ImageName
+from sqlalchemy import text
+from sqlmodel import select
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from .details_snapshot import DetailsSnapshot, load_details_snapshot, build_details_snapshot, store_details_snapshot, \
+    get_details_snapshot_version
+from .edge_cache import get_edge_cache_max_age, image_surrogate_key
+from .instrumentation import metrics
+from .models import ImageToScrape
+from .parsing import parse_datetime
+from .state import validate_image_name, POSTGRESQL_AGGREGATION_INTERVALS
+from .utils import add_existing_images_to_monitoring_db, reserve_bulk_add_slots
+
+API_CACHE_MAX_AGE = durationpy.from_str(os.getenv("API_CACHE_MAX_AGE", "5m"))
+"""
+For how long clients may reuse a response of the API without revalidating it. Caddy (and CDNs) may cache responses for
+longer (see edge_cache.py), because the scraper purges them from Caddy's cache when the data changes.
+"""
+API_NOT_FOUND_CACHE_MAX_AGE = durationpy.from_str(os.getenv("API_NOT_FOUND_CACHE_MAX_AGE", "1m"))
+"""
+For how long "image not found" responses of the API may be cached.
+"""
+API_BULK_MAX_IMAGES = int(os.getenv("API_BULK_MAX_IMAGES", "500"))
+"""
+Maximum number of image references that a single request to the bulk statistics endpoint may contain.
+"""
+API_BULK_MAX_QUEUED_IMAGES = int(os.getenv("API_BULK_MAX_QUEUED_IMAGES", "20"))
+"""
+Maximum number of not yet monitored images that a single request to the bulk statistics endpoint may add to the
+monitoring DB (see also BULK_ADD_MAX_PENDING_IMAGES and BULK_ADD_MAX_REQUESTS_PER_SECOND in utils.py).
+"""
+
+# Joins the requested (endpoint, image, tag) tuples (passed as three arrays, unnested in parallel) with the monitored
+# images via the endpoint_image_tag unique index, and computes the first and last update of each image from the
+# compound_index_image_id_scraped_at_id index
+IMAGE_STATS_QUERY = text("""SELECT requested.endpoint, requested.image, requested.tag,
+                                   i.image_update_count, i.added_at, i.last_pushed,
+                                   updates.first_update, updates.last_update
+                            FROM unnest(CAST(:endpoints AS text[]), CAST(:images AS text[]), CAST(:tags AS text[]))
+                                     AS requested(endpoint, image, tag)
+                                     JOIN image_to_scrape AS i
+                                          ON i.endpoint = requested.endpoint
+                                              AND i.image = requested.image
+                                              AND i.tag = requested.tag
+                                     CROSS JOIN LATERAL (SELECT MIN(u.scraped_at) AS first_update,
+                                                                MAX(u.scraped_at) AS last_update
+                                                         FROM image_update AS u
+                                                         WHERE u.image_id = i.id) AS updates""")
+
+
+def _cache_control(max_age) -> str:
+    return f"public, max-age={int(max_age.total_seconds())}"
+
+
+def _error(status_code: int, message: str) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code,
+                        headers={"Cache-Control": _cache_control(API_NOT_FOUND_CACHE_MAX_AGE)})
+
+
+def _load_snapshot(image_name: ImageName) -> Optional[DetailsSnapshot]:
+    """
+    Returns the details snapshot of the image (building it on a miss), or None if the image is not monitored. Unlike
+    the image details page, the API never adds images to the monitoring DB.
+    """
+    resolved_registry = image_name.resolve_endpoint()
+    resolved_image = image_name.resolve_image()
+    resolved_tag = image_name.resolve_tag()
+
+    snapshot = load_details_snapshot(resolved_registry, resolved_image, resolved_tag)
+    if snapshot is None:
+        version = get_details_snapshot_version(resolved_registry, resolved_image, resolved_tag)
+        with rx.session() as session:
+            query = select(ImageToScrape).where(ImageToScrape.endpoint == resolved_registry,
+                                                ImageToScrape.image == resolved_image,
+                                                ImageToScrape.tag == resolved_tag)
+            image_to_scrape: Optional[ImageToScrape] = session.exec(query).first()
+            if image_to_scrape is None:
+                return None
+            snapshot = build_details_snapshot(session, image_to_scrape, version)
+        store_details_snapshot(snapshot)
+    return snapshot
+
+
+def _is_not_modified(request: Request, etag: str, last_modified: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match uses the weak comparison, and takes precedence over If-Modified-Since
+        candidates = [candidate.strip().removeprefix("W/") for candidate in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return email.utils.parsedate_to_datetime(last_modified) <= email.utils.parsedate_to_datetime(
+                if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def image_updates(request: Request) -> Response:
+    """
+    GET /api/v1/images/{endpoint}/{image}:{tag}/updates?granularity=weekly|monthly
+
+    Returns the number of image updates (i.e., new digests) per week or month, newest first.
+
+    Note: this is a synchronous endpoint (which Starlette runs in a thread pool), because rx.session() is synchronous.
+    """
+    granularity = request.query_params.get("granularity", "weekly")
+    if granularity not in POSTGRESQL_AGGREGATION_INTERVALS:
+        return _error(400, f"Invalid granularity '{granularity}', must be one of "
+                           f"{', '.join(POSTGRESQL_AGGREGATION_INTERVALS)}")
+
+    try:
+        image_name = ImageName.parse(request.path_params["image_name"])
+        validate_image_name(image_name)
+    except ValueError:
+        return _error(400, "Invalid image/tag format")
+
+    snapshot = _load_snapshot(image_name)
+    if snapshot is None:
+        return _error(404, "This image is not monitored (open its details page to start monitoring it)")
+
+    image = snapshot["image"]
+    # The first page of the digest table is ordered by scraped_at (newest first), so it contains the last update
+    last_update_id, last_update_scraped_at = snapshot["first_page"][0][:2] if snapshot["first_page"] else (0, None)
+    # The update count is part of the ETag, because deleting old ImageUpdates (see the scraper's retention) changes
+    # the buckets, but not the last update
+    etag = f'"{image["id"]}-{last_update_id}-{image["image_update_count"]}-{granularity}"'
+    last_modified = email.utils.format_datetime(
+        parse_datetime(last_update_scraped_at or image["added_at"]).astimezone(timezone.utc), usegmt=True)
+    edge_cache_max_age = get_edge_cache_max_age(default=API_CACHE_MAX_AGE)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": last_modified,
+        # s-maxage applies to shared caches (Caddy, CDNs) only
+        "Cache-Control": f"{_cache_control(min(API_CACHE_MAX_AGE, timedelta(seconds=edge_cache_max_age)))}, "
+                         f"s-maxage={edge_cache_max_age}",
+        "Surrogate-Key": image_surrogate_key(image["endpoint"], image["image"], image["tag"]),
+    }
+
+    if _is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    buckets = snapshot["buckets"].get(POSTGRESQL_AGGREGATION_INTERVALS[granularity], [])
+    return JSONResponse({
+        "endpoint": image["endpoint"],
+        "image": image["image"],
+        "tag": image["tag"],
+        "added_at": image["added_at"],
+        "last_pushed": image["last_pushed"],
+        "last_update": last_update_scraped_at,
+        "total_updates": image["image_update_count"],
+        "granularity": granularity,
+        "updates": [{"interval_start": interval_start, "count": count} for interval_start, count in buckets],
+    }, headers=headers)
+
+
+def _query_image_stats(image_keys: list[tuple[str, str, str]]) -> dict[tuple[str, str, str], dict]:
+    with rx.session() as session:
+        rows = session.exec(IMAGE_STATS_QUERY, params={
+            "endpoints": [endpoint for endpoint, _, _ in image_keys],
+            "images": [image for _, image, _ in image_keys],
+            "tags": [tag for _, _, tag in image_keys],
+        }).all()
+
+    image_stats = {}
+    for endpoint, image, tag, update_count, added_at, last_pushed, first_update, last_update in rows:
+        average_update_interval_seconds = None
+        if update_count > 1:
+            average_update_interval_seconds = round((last_update - first_update).total_seconds() / (update_count - 1))
+        image_stats[(endpoint, image, tag)] = {
+            "total_updates": update_count,
+            "added_at": added_at.isoformat(),
+            "last_pushed": last_pushed.isoformat() if last_pushed else None,
+            "last_update": last_update.isoformat() if last_update else None,
+            "average_update_interval_seconds": average_update_interval_seconds,
+        }
+    return image_stats
+
+
+async def bulk_image_stats(request: Request) -> Response:
+    """
+    POST /api/v1/images/stats with a JSON body such as {"images": ["python:3.12-slim", "ghcr.io/foo/bar:1.2"]}
+
+    Returns the update statistics of each image, in the order of the request. Images that are not monitored yet are
+    returned with status "queued", and are added to the monitoring DB (if they exist in their registry) after the
+    response was sent. At most API_BULK_MAX_QUEUED_IMAGES images are queued per request (and fewer while the backend
+    is still checking the images of other requests), the others are returned with status "not_queued".
+    """
+    try:
+        image_references = (await request.json())["images"]
+        if not isinstance(image_references, list) or not all(isinstance(ref, str) for ref in image_references):
+            raise ValueError
+    except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+        return JSONResponse({"error": 'The body must be a JSON object of the form {"images": ["<image>:<tag>", ...]}'},
+                            status_code=400)
+    if len(image_references) > API_BULK_MAX_IMAGES:
+        return JSONResponse({"error": f"At most {API_BULK_MAX_IMAGES} images are allowed per request"},
+                            status_code=400)
+
+    image_names: dict[str, Optional[ImageName]] = {}  # maps the (unique) references to their parsed image names
+    for image_reference in image_references:
+        if image_reference not in image_names:
+            try:
+                image_name = ImageName.parse(image_reference)
+                validate_image_name(image_name)
+                image_names[image_reference] = ImageName(endpoint=image_name.resolve_endpoint(),
+                                                         image=image_name.resolve_image(), tag=image_name.resolve_tag())
+            except ValueError:
+                image_names[image_reference] = None
+
+    image_keys = list({(image_name.endpoint, image_name.image, image_name.tag)
+                       for image_name in image_names.values() if image_name is not None})
+    image_stats = await run_in_threadpool(_query_image_stats, image_keys) if image_keys else {}
+
+    unknown_image_count = len(set(image_keys) - set(image_stats))
+    queue_capacity = reserve_bulk_add_slots(min(unknown_image_count, API_BULK_MAX_QUEUED_IMAGES))
+
+    results = []
+    unknown_image_names: dict[tuple[str, str, str], ImageName] = {}
+    for image_reference in image_references:
+        image_name = image_names[image_reference]
+        if image_name is None:
+            results.append({"reference": image_reference, "status": "invalid"})
+            continue
+        image_key = (image_name.endpoint, image_name.image, image_name.tag)
+        result = {"reference": image_reference, "endpoint": image_name.endpoint, "image": image_name.image,
+                  "tag": image_name.tag}
+        if image_key in image_stats:
+            result.update(status="monitored", **image_stats[image_key])
+        elif image_key in unknown_image_names or len(unknown_image_names) < queue_capacity:
+            result.update(status="queued")
+            unknown_image_names[image_key] = image_name
+        else:
+            result.update(status="not_queued")
+        results.append(result)
+
+    background_task = None
+    if unknown_image_names:
+        background_task = BackgroundTask(add_existing_images_to_monitoring_db, list(unknown_image_names.values()))
+    return JSONResponse({"images": results}, background=background_task)
+
+
+api = Starlette(routes=[
+    Route("/api/v1/images/stats", bulk_image_stats, methods=["POST"]),
+    Route("/api/v1/images/{image_name:path}/updates", image_updates, methods=["GET"]),
+    # Prometheus metrics of the event handlers (not forwarded by Caddy, see instrumentation.py)
+    Route("/metrics", metrics, methods=["GET"]),
+])
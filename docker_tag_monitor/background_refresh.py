@@ -0,0 +1,105 @@
+"""
+Background refresher for external data shown in the web UI (e.g. the GitHub star count).
+
+The refresher runs as a lifespan task of each worker process. Values are fetched asynchronously (never inside an event
+handler or computed var), and only by one worker process at a time: the workers compete for a short-lived lock in
+Valkey, the winner fetches the value and stores it in Valkey, and all other workers copy it from there. State vars
+therefore only read the in-memory copy (see get_external_value()).
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+import aiohttp
+import durationpy
+import redis
+
+from docker_tag_monitor.cache import get_async_redis
+from docker_tag_monitor.constants import NAMESPACE_AND_REPO, GITHUB_STARS_REFRESH_INTERVAL_SECONDS
+
+logger = logging.getLogger("DockerTagMonitor-BackgroundRefresh")
+
+BACKGROUND_REFRESH_POLL_INTERVAL = durationpy.from_str(os.getenv("BACKGROUND_REFRESH_POLL_INTERVAL", "1m"))
+"""
+How often each worker process checks whether external values need to be refreshed (or copied from Valkey).
+"""
+
+
+@dataclass
+class RefreshJob:
+    name: str
+    interval: timedelta
+    fetch: Callable[[], Awaitable[str]]
+
+
+def format_github_stars(stargazers_count: int) -> str:
+    if stargazers_count >= 1000:
+        return f"{stargazers_count / 1000:.1f}K"  # turns e.g. 1234 into 1.2K
+    return str(stargazers_count)
+
+
+async def fetch_github_stars() -> str:
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        async with session.get(f"https://api.github.com/repos/{NAMESPACE_AND_REPO}") as response:
+            response.raise_for_status()
+            data = await response.json()
+            return format_github_stars(data["stargazers_count"])
+
+
+REFRESH_JOBS = [
+    RefreshJob(name="github_stars", interval=timedelta(seconds=GITHUB_STARS_REFRESH_INTERVAL_SECONDS),
+               fetch=fetch_github_stars),
+]
+
+_external_values: dict[str, str] = {}
+_last_local_refresh: dict[str, float] = {}
+
+
+def get_external_value(name: str, default: str = "") -> str:
+    """
+    Returns the most recently refreshed value of the given RefreshJob. Never blocks.
+    """
+    return _external_values.get(name, default)
+
+
+async def refresh_job(job: RefreshJob):
+    client = get_async_redis()
+    if client is None:
+        # Without Valkey, every worker process fetches the value on its own
+        if _last_local_refresh.get(job.name, -9999.9) + job.interval.total_seconds() < time.monotonic():
+            _last_local_refresh[job.name] = time.monotonic()
+            _external_values[job.name] = await job.fetch()
+        return
+
+    value_key = f"dtm:external:{job.name}"
+    lock_key = f"{value_key}:lock"
+    # The lock expires after the job's interval, so (at most) one worker process fetches the value per interval
+    if await client.set(lock_key, "1", nx=True, ex=job.interval):
+        try:
+            value = await job.fetch()
+        except Exception:
+            await client.delete(lock_key)  # let the next poll (of any worker process) try again
+            raise
+        await client.set(value_key, value)
+        _external_values[job.name] = value
+    else:
+        value = await client.get(value_key)
+        if value is not None:
+            _external_values[job.name] = value.decode()
+
+
+async def run_background_refreshers():
+    """
+    Lifespan task of the Reflex app (see app.register_lifespan_task()) that refreshes all REFRESH_JOBS forever.
+    """
+    while True:
+        for job in REFRESH_JOBS:
+            try:
+                await refresh_job(job)
+            except (aiohttp.ClientError, redis.RedisError, asyncio.TimeoutError, KeyError, ValueError) as e:
+                logger.warning(f"Failed to refresh the external value '{job.name}': {e}")
+        await asyncio.sleep(BACKGROUND_REFRESH_POLL_INTERVAL.total_seconds())
@@ -0,0 +1,231 @@
+"""
+Caches shared by all Reflex (gunicorn) workers and the scraper. They are stored in the Valkey instance that Reflex
+already uses as state manager (see REDIS_URL), and each worker keeps a small in-process LRU cache in front of Valkey.
+
+Cache entries are invalidated via "generation" counters: the key of each entry contains the current generation, and
+writers (e.g. the scraper after inserting new ImageToScrape rows) simply increment the generation, which makes all
+existing entries unreachable (they expire on their own).
+
+This module must not import Reflex, because the scraper uses it, too.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Optional
+
+import durationpy
+import redis
+import redis.asyncio
+
+from docker_tag_monitor.invalidation_bus import ImageChange, CHANGE_TYPE_CREATED, CHANGE_TYPE_DELETED, \
+    CHANGE_TYPE_RESYNC
+from docker_tag_monitor.parsing import json_loads
+
+logger = logging.getLogger("DockerTagMonitor-Cache")
+
+REDIS_URL = os.getenv("REDIS_URL", "")
+"""
+Connection string of the Valkey (Redis) instance. If empty (e.g. during local development), only the in-process caches
+are used, which are then only invalidated by expiry.
+"""
+SEARCH_CACHE_TTL = durationpy.from_str(os.getenv("SEARCH_CACHE_TTL", "10m"))
+"""
+For how long search results are cached in Valkey (unless the cache is invalidated earlier).
+"""
+SEARCH_CACHE_LOCAL_MAX_SIZE = int(os.getenv("SEARCH_CACHE_LOCAL_MAX_SIZE", "1000"))
+"""
+Maximum number of search results (per search term) that each worker process keeps in its in-process LRU cache.
+"""
+CACHE_GENERATION_CHECK_INTERVAL = durationpy.from_str(os.getenv("CACHE_GENERATION_CHECK_INTERVAL", "5s"))
+"""
+How often each worker process re-reads the generation counters from Valkey. This is the maximum amount of time for
+which the in-process caches may return outdated entries after an invalidation.
+"""
+
+SEARCH_CACHE_GENERATION_KEY = "dtm:search:generation"
+# Note: the version must be increased whenever the structure of the cached search results changes
+SEARCH_CACHE_KEY_PREFIX = "dtm:search:v2:"
+
+_redis_client: Optional[redis.Redis] = None
+_async_redis_client: Optional[redis.asyncio.Redis] = None
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    Returns the (synchronous) Valkey client used by the Reflex workers, or None if REDIS_URL is not set.
+    """
+    global _redis_client
+    if _redis_client is None and REDIS_URL:
+        # Short timeouts, because a slow cache must not be slower than querying the database
+        _redis_client = redis.Redis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    return _redis_client
+
+
+def get_async_redis() -> Optional[redis.asyncio.Redis]:
+    """
+    Returns the asyncio Valkey client (used by the scraper and the background tasks of the web backend), or None if
+    REDIS_URL is not set.
+    """
+    global _async_redis_client
+    if _async_redis_client is None and REDIS_URL:
+        _async_redis_client = redis.asyncio.Redis.from_url(REDIS_URL, socket_timeout=2, socket_connect_timeout=2)
+    return _async_redis_client
+
+
+class LruCache:
+    """
+    Thread-safe in-process cache that evicts the least recently used entry once it contains more than max_size
+    entries.
+    """
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries: OrderedDict[Any, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Any) -> Optional[Any]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: Any, value: Any):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: Any):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class CacheGeneration:
+    """
+    Locally cached copy of a generation counter stored in Valkey, re-read at most every
+    CACHE_GENERATION_CHECK_INTERVAL.
+    """
+
+    def __init__(self, key: str):
+        self._key = key
+        self._value = "0"
+        self._last_check = -9999.9
+
+    def get(self) -> str:
+        if self._last_check + CACHE_GENERATION_CHECK_INTERVAL.total_seconds() > time.monotonic():
+            return self._value
+
+        self._last_check = time.monotonic()
+        client = get_redis()
+        if client is not None:
+            try:
+                value = client.get(self._key)
+                self._value = value.decode() if value else "0"
+            except redis.RedisError as e:
+                logger.warning(f"Failed to read the cache generation '{self._key}': {e}")
+        return self._value
+
+    def expire(self):
+        """
+        Makes the next get() re-read the generation counter from Valkey.
+        """
+        self._last_check = -9999.9
+
+
+_search_cache_generation = CacheGeneration(SEARCH_CACHE_GENERATION_KEY)
+_local_search_cache = LruCache(SEARCH_CACHE_LOCAL_MAX_SIZE)
+_local_search_cache_ttl = min(SEARCH_CACHE_TTL, timedelta(minutes=1))
+
+
+def get_cached_search_results(search_key: str) -> Optional[list[dict]]:
+    """
+    Returns the cached search results (dicts with endpoint, image and tag) for the normalized search_key, or None on
+    a cache miss.
+    """
+    generation = _search_cache_generation.get()
+    local_entry = _local_search_cache.get((generation, search_key))
+    if local_entry is not None:
+        expires_at, results = local_entry
+        if expires_at > time.monotonic():
+            return results
+
+    client = get_redis()
+    if client is None:
+        return None
+
+    try:
+        raw_results = client.get(f"{SEARCH_CACHE_KEY_PREFIX}{generation}:{search_key}")
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read search results from the cache: {e}")
+        return None
+
+    if raw_results is None:
+        return None
+
+    results = json_loads(raw_results)
+    _local_search_cache.set((generation, search_key),
+                            (time.monotonic() + _local_search_cache_ttl.total_seconds(), results))
+    return results
+
+
+def set_cached_search_results(search_key: str, results: list[dict]):
+    generation = _search_cache_generation.get()
+    _local_search_cache.set((generation, search_key),
+                            (time.monotonic() + _local_search_cache_ttl.total_seconds(), results))
+
+    client = get_redis()
+    if client is None:
+        return
+
+    try:
+        client.set(f"{SEARCH_CACHE_KEY_PREFIX}{generation}:{search_key}", json.dumps(results), ex=SEARCH_CACHE_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to write search results to the cache: {e}")
+
+
+def invalidate_search_cache():
+    """
+    Invalidates all cached search results, e.g. after new ImageToScrape rows have been inserted.
+    """
+    client = get_redis()
+    if client is None:
+        return
+
+    try:
+        client.incr(SEARCH_CACHE_GENERATION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate the search cache: {e}")
+
+
+async def invalidate_search_cache_async():
+    """
+    Like invalidate_search_cache(), but for the (asyncio-based) scraper.
+    """
+    client = get_async_redis()
+    if client is None:
+        return
+
+    try:
+        await client.incr(SEARCH_CACHE_GENERATION_KEY)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to invalidate the search cache: {e}")
+
+
+def handle_image_change(change: ImageChange):
+    """
+    Handler of the invalidation bus (see invalidation_bus.py) that drops the in-process search results as soon as the
+    scraper created or deleted images, instead of waiting up to CACHE_GENERATION_CHECK_INTERVAL.
+    """
+    if change.change_type in (CHANGE_TYPE_CREATED, CHANGE_TYPE_DELETED, CHANGE_TYPE_RESYNC):
+        _local_search_cache.clear()
+        _search_cache_generation.expire()
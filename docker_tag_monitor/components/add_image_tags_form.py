@@ -31,14 +31,14 @@ def _form_component() -> rx.Component:
                                 on_change=AddAdditionalTagsState.on_check_all),
                     rx.foreach(AddAdditionalTagsState.shown_image_tag_fields,
                                lambda field, idx: rx.hstack(
-                                   rx.checkbox(text=field.tag, name=field.tag,
-                                               checked=AddAdditionalTagsState.shown_image_tag_fields[idx].checked,
+                                   rx.checkbox(text=field["tag"], name=field["tag"],
+                                               checked=AddAdditionalTagsState.shown_image_tag_fields[idx]["checked"],
                                                disabled=AddAdditionalTagsState.loading | ~
-                                               AddAdditionalTagsState.shown_image_tag_fields[idx].can_add_to_monitoring_db,
+                                               AddAdditionalTagsState.shown_image_tag_fields[idx]["can_add_to_monitoring_db"],
                                                on_change=lambda checked: AddAdditionalTagsState.set_checkbox(idx,
                                                                                                              checked)
                                                ),
-                                   rx.cond(~AddAdditionalTagsState.shown_image_tag_fields[idx].can_add_to_monitoring_db,
+                                   rx.cond(~AddAdditionalTagsState.shown_image_tag_fields[idx]["can_add_to_monitoring_db"],
                                            rx.tooltip(rx.icon("circle-help", size=18),
                                                       content="This tag is already monitored"))
                                )
@@ -1,6 +1,6 @@
 import reflex as rx
 
-from ..models import ImageUpdate
+from .utils import ImageUpdateWithDigest
 from ..state import ImageDetailsState
 
 
@@ -65,7 +65,7 @@ def _pagination_view() -> rx.Component:
     )
 
 
-def show_digest(item: ImageUpdate, index: int) -> rx.Component:
+def show_digest(item: ImageUpdateWithDigest, index: int) -> rx.Component:
     bg_color = rx.cond(
         index % 2 == 0,
         rx.color("gray", 1),
@@ -77,16 +77,16 @@ def show_digest(item: ImageUpdate, index: int) -> rx.Component:
         rx.color("accent", 3),
     )
     return rx.table.row(
-        rx.table.cell(item.scraped_at),
+        rx.table.cell(item["scraped_at"]),
         rx.table.cell(
             rx.hstack(
-                item.digest,
+                item["digest"],
                 rx.tooltip(
                     rx.icon_button(
                         rx.icon("clipboard-copy", size=16),
                         variant="surface",
                         on_click=lambda: rx.set_clipboard(f"{ImageDetailsState.image_to_scrape.endpoint}/"
-                                                          f"{ImageDetailsState.image_to_scrape.image}@{item.digest}"),
+                                                          f"{ImageDetailsState.image_to_scrape.image}@{item["digest"]}"),
                         size="1",
                     ),
                     content="Copy digest to clipboard",
@@ -49,8 +49,8 @@ def search_bar() -> rx.Component:
             rx.cond(SearchState.search_results,
                     rx.vstack(
                         rx.foreach(SearchState.search_results,
-                                   lambda item: clickable_image_details_link(f"{item.endpoint}/{item.image}:{item.tag}",
-                                                                             item))),
+                                   lambda item: clickable_image_details_link(
+                                       item["endpoint"] + "/" + item["image"] + ":" + item["tag"], item))),
                     ),
             size="1"),
     )
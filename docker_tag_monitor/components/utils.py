@@ -4,14 +4,22 @@ from typing import TypedDict
 import reflex as rx
 
 
-class ImageToScrapeWithCount(TypedDict):
+class ImageReference(TypedDict):
     endpoint: str
     image: str
     tag: str
+
+
+class ImageToScrapeWithCount(ImageReference):
     added_at: str
     image_update_count: int
 
 
+class ImageUpdateWithDigest(TypedDict):
+    scraped_at: str
+    digest: str
+
+
 class ImageUpdateAggregated(TypedDict):
     interval_start: datetime
     count: int
@@ -22,6 +30,12 @@ class ImageUpdateGraphData(TypedDict):
     count: int
 
 
+class ImageTagField(TypedDict):
+    tag: str
+    can_add_to_monitoring_db: bool
+    checked: bool
+
+
 class DailyScanSummary(TypedDict):
     date: str
     successful_scans: int
@@ -33,7 +47,7 @@ class DailyScanDuration(TypedDict):
     duration_minutes: float
 
 
-def clickable_image_details_link(text: str, image_to_scrape: ImageToScrapeWithCount) -> rx.Component:
+def clickable_image_details_link(text: str, image_to_scrape: ImageReference) -> rx.Component:
     return rx.link(text,
                    href=f"/details/{image_to_scrape["endpoint"]}/{image_to_scrape["image"]}:{image_to_scrape["tag"]}")
 
@@ -14,6 +14,13 @@ ORDERED_PAGE_ROUTES = [  # Note: keep these in sync with the "@template(route=..
 
 MAX_DAILY_SCAN_ENTRIES_IN_GRAPH = 50
 
+OVERVIEW_TOTAL_ITEMS_CACHE_SECONDS = 60
+"""
+For how long the total number of monitored images (shown as page count in the overview table) is cached.
+"""
+
+DIGEST_TABLE_ITEMS_PER_PAGE = 12
+
 IMAGE_LAST_VIEWED_UPDATE_THRESHOLD = durationpy.from_str(os.getenv("IMAGE_LAST_VIEWED_UPDATE_THRESHOLD", "1d"))
 """
 It is overkill to update ImageToScape.last_viewed to <now> each and every time a user accesses the image details page.
@@ -21,6 +28,12 @@ This interval specifies how much time must have passed since the last ImageToSca
 updated to <now>.
 """
 
+DETAILS_PAGE_LIVE_UPDATE_MAX_DURATION = durationpy.from_str(os.getenv("DETAILS_PAGE_LIVE_UPDATE_MAX_DURATION", "1h"))
+"""
+For how long after loading the image details page it refreshes itself whenever the scraper changes the shown image.
+The limit exists because the backend cannot reliably detect that the user closed the page.
+"""
+
 POPULAR_IMAGES_MAX_COUNT = 50
 
 FILL_LAST_PUSH_DATE_BATCH_SIZE = 50
@@ -0,0 +1,51 @@
+"""
+Routing of the web backend's database queries to an (optional) read replica.
+
+Read-only queries (overview table, search, digest table/graph, status page) use read_session(), which connects to
+REFLEX_DB_READ_URL. Writes always use the primary (rx.session()). Because a replica lags slightly behind the primary,
+read_session() also uses the primary for READ_YOUR_WRITES_WINDOW after the same client session wrote something (see
+record_write()), so that users always see their own changes.
+"""
+import os
+import time
+from typing import Optional
+
+import durationpy
+import reflex as rx
+import sqlmodel
+
+from docker_tag_monitor.cache import LruCache
+
+REFLEX_DB_READ_URL = os.getenv("REFLEX_DB_READ_URL", "")
+"""
+Connection string of a read replica of the database (same format as REFLEX_DB_URL). If empty, all queries use the
+primary database.
+"""
+READ_YOUR_WRITES_WINDOW = durationpy.from_str(os.getenv("READ_YOUR_WRITES_WINDOW", "10s"))
+"""
+For how long after a client session wrote to the database all of its queries use the primary database. Should be
+larger than the usual replication lag.
+"""
+
+# Each client session's websocket is connected to one worker process, so it suffices to track the writes per process
+_last_write_times = LruCache(10000)  # maps client tokens to the time.monotonic() of their last write
+
+
+def record_write(client_token: str):
+    _last_write_times.set(client_token, time.monotonic())
+
+
+def read_session(client_token: Optional[str] = None) -> sqlmodel.Session:
+    """
+    Returns a session for read-only queries, which uses the read replica (if configured), unless the given client
+    session wrote to the database within the READ_YOUR_WRITES_WINDOW.
+    """
+    if not REFLEX_DB_READ_URL:
+        return rx.session()
+
+    if client_token:
+        last_write_time = _last_write_times.get(client_token)
+        if last_write_time is not None and last_write_time + READ_YOUR_WRITES_WINDOW.total_seconds() > time.monotonic():
+            return rx.session()
+
+    return rx.session(REFLEX_DB_READ_URL)
@@ -0,0 +1,286 @@
+"""
+Precomputed per-image snapshot of the data shown on the image details page (image metadata, weekly and monthly update
+buckets, and the first page of the digest table), stored in Valkey.
+
+The data of an image only changes when the scraper records a new digest, so the scraper rebuilds the snapshots of
+changed images (if they exist, i.e., if the image was viewed recently), and the details page only queries the database
+on a snapshot miss.
+
+A snapshot that the web backend builds on a miss may be based on data that the scraper changes before the snapshot is
+stored. Each change therefore increments a per-image version (a separate Valkey key), and each snapshot contains the
+version that was read before its data was queried. Snapshots with an outdated version are treated as a miss.
+
+This module must not import Reflex, because the scraper uses it, too.
+"""
+import json
+import logging
+import os
+from datetime import datetime
+from typing import Optional, TypedDict
+
+import durationpy
+import redis
+from sqlalchemy import text, tuple_
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from docker_tag_monitor.cache import get_redis, get_async_redis
+from docker_tag_monitor.constants import DIGEST_TABLE_ITEMS_PER_PAGE
+from docker_tag_monitor.digests import format_digest
+from docker_tag_monitor.models import ImageToScrape, ImageUpdate, Digest
+from docker_tag_monitor.parsing import json_loads
+
+logger = logging.getLogger("DockerTagMonitor-DetailsSnapshot")
+
+DETAILS_SNAPSHOT_TTL = durationpy.from_str(os.getenv("DETAILS_SNAPSHOT_TTL", "1d"))
+"""
+For how long a details snapshot is kept in Valkey after it was last (re-)built.
+"""
+
+# Note: the version must be increased whenever the structure of DetailsSnapshot changes
+DETAILS_SNAPSHOT_KEY_PREFIX = "dtm:details:v3:"
+DETAILS_SNAPSHOT_VERSION_KEY_PREFIX = "dtm:details-version:"
+
+# Reads the (weekly and monthly) ImageUpdateRollup buckets of an image, filling the gaps between its first and last
+# bucket with zero-count buckets
+UPDATE_BUCKETS_QUERY = text("""SELECT bounds.granularity, series.bucket_start, COALESCE(rollup.count, 0)
+                               FROM (SELECT granularity,
+                                            MIN(bucket_start) AS first_bucket_start,
+                                            MAX(bucket_start) AS last_bucket_start
+                                     FROM image_update_rollup
+                                     WHERE image_id = :image_id
+                                     GROUP BY granularity) AS bounds
+                                        CROSS JOIN LATERAL generate_series(
+                                           bounds.first_bucket_start, bounds.last_bucket_start,
+                                           CAST('1 ' || bounds.granularity AS interval)) AS series(bucket_start)
+                                        LEFT JOIN image_update_rollup AS rollup
+                                                  ON rollup.image_id = :image_id
+                                                      AND rollup.granularity = bounds.granularity
+                                                      AND rollup.bucket_start = series.bucket_start""")
+
+
+class DetailsSnapshot(TypedDict):
+    image: dict  # the JSON-serialized ImageToScrape
+    # Maps "week"/"month" to (interval start, update count), newest first, without gaps
+    buckets: dict[str, list[tuple[str, int]]]
+    first_page: list[tuple[int, str, str]]  # (ImageUpdate.id, scraped_at, digest) of the first digest table page
+    version: int  # the version of the image's data (see the module docstring)
+
+
+def details_snapshot_key(endpoint: str, image: str, tag: str) -> str:
+    return f"{DETAILS_SNAPSHOT_KEY_PREFIX}{endpoint}/{image}:{tag}"
+
+
+def details_snapshot_version_key(endpoint: str, image: str, tag: str) -> str:
+    return f"{DETAILS_SNAPSHOT_VERSION_KEY_PREFIX}{endpoint}/{image}:{tag}"
+
+
+def build_digest_table_query(image_id: int):
+    """
+    Returns the (unordered) query for the digest table rows of the given image, i.e., tuples of
+    (ImageUpdate.id, ImageUpdate.scraped_at, Digest.algorithm, Digest.hash).
+    """
+    return select(ImageUpdate.id, ImageUpdate.scraped_at, Digest.algorithm, Digest.hash).join(
+        Digest, Digest.id == ImageUpdate.digest_id).where(ImageUpdate.image_id == image_id)
+
+
+def build_digest_table_page_query(image_id: int, direction: str, first_item_key: Optional[tuple[datetime, int]],
+                                  last_item_key: Optional[tuple[datetime, int]], items_per_page: int,
+                                  total_items: int):
+    """
+    Returns the query for the "first", "prev", "next" or "last" page of digests, using keyset (seek) pagination on the
+    sort key (scraped_at DESC, id DESC), which matches the compound_index_image_id_scraped_at_id index. Also returns
+    the effective direction ("first" if the given direction is not possible). The rows of the "prev" and "last" pages
+    are returned in reverse order.
+    """
+    query = build_digest_table_query(image_id)
+    sort_key = tuple_(ImageUpdate.scraped_at, ImageUpdate.id)
+    if direction == "next" and last_item_key:
+        query = query.where(sort_key < tuple_(*last_item_key)).order_by(
+            ImageUpdate.scraped_at.desc(), ImageUpdate.id.desc()).limit(items_per_page)
+    elif direction == "prev" and first_item_key:
+        # We scan backwards, and reverse the rows afterward
+        query = query.where(sort_key > tuple_(*first_item_key)).order_by(
+            ImageUpdate.scraped_at, ImageUpdate.id).limit(items_per_page)
+    elif direction == "last":
+        query = query.order_by(ImageUpdate.scraped_at, ImageUpdate.id).limit(
+            total_items % items_per_page or items_per_page)
+    else:
+        direction = "first"
+        query = query.order_by(ImageUpdate.scraped_at.desc(), ImageUpdate.id.desc()).limit(items_per_page)
+    return query, direction
+
+
+def _first_page_query(image_id: int):
+    return build_digest_table_page_query(image_id, "first", None, None, DIGEST_TABLE_ITEMS_PER_PAGE, 0)[0]
+
+
+def _to_snapshot(image: ImageToScrape, bucket_rows, first_page_rows, version: int) -> DetailsSnapshot:
+    buckets: dict[str, list[tuple[str, int]]] = {"week": [], "month": []}
+    for granularity, interval_start, count in sorted(bucket_rows, key=lambda row: row[1], reverse=True):
+        buckets[granularity].append((interval_start.isoformat(), count))
+
+    return DetailsSnapshot(
+        image=image.model_dump(mode="json"),
+        buckets=buckets,
+        first_page=[(image_update_id, scraped_at.isoformat(), format_digest(algorithm, hash_bytes))
+                    for image_update_id, scraped_at, algorithm, hash_bytes in first_page_rows],
+        version=version,
+    )
+
+
+def build_details_snapshot(session: Session, image: ImageToScrape, version: int) -> DetailsSnapshot:
+    """
+    Builds the snapshot of the given image. The version must have been read (see get_details_snapshot_version())
+    before the image was queried.
+    """
+    bucket_rows = session.exec(UPDATE_BUCKETS_QUERY, params={"image_id": image.id}).all()
+    first_page_rows = session.exec(_first_page_query(image.id)).all()
+    return _to_snapshot(image, bucket_rows, first_page_rows, version)
+
+
+async def build_details_snapshot_async(session: AsyncSession, image_id: int,
+                                       version: int) -> Optional[DetailsSnapshot]:
+    image = (await session.exec(select(ImageToScrape).where(ImageToScrape.id == image_id))).first()
+    if image is None:
+        return None
+    bucket_rows = (await session.exec(UPDATE_BUCKETS_QUERY, params={"image_id": image_id})).all()
+    first_page_rows = (await session.exec(_first_page_query(image_id))).all()
+    return _to_snapshot(image, bucket_rows, first_page_rows, version)
+
+
+def load_details_snapshot(endpoint: str, image: str, tag: str) -> Optional[DetailsSnapshot]:
+    """
+    Returns the snapshot of the given image, or None if there is none, or if the image changed after its snapshot was
+    built.
+    """
+    client = get_redis()
+    if client is None:
+        return None
+
+    try:
+        raw_snapshot, raw_version = client.mget(details_snapshot_key(endpoint, image, tag),
+                                                details_snapshot_version_key(endpoint, image, tag))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read the details snapshot of '{endpoint}/{image}:{tag}': {e}")
+        return None
+
+    return _parse_snapshot(raw_snapshot, raw_version)
+
+
+async def load_details_snapshot_async(endpoint: str, image: str, tag: str) -> Optional[DetailsSnapshot]:
+    """
+    Like load_details_snapshot(), for the background tasks of the web backend.
+    """
+    client = get_async_redis()
+    if client is None:
+        return None
+
+    try:
+        raw_snapshot, raw_version = await client.mget(details_snapshot_key(endpoint, image, tag),
+                                                      details_snapshot_version_key(endpoint, image, tag))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read the details snapshot of '{endpoint}/{image}:{tag}': {e}")
+        return None
+
+    return _parse_snapshot(raw_snapshot, raw_version)
+
+
+def _parse_snapshot(raw_snapshot: Optional[bytes], raw_version: Optional[bytes]) -> Optional[DetailsSnapshot]:
+    if raw_snapshot is None:
+        return None
+    snapshot: DetailsSnapshot = json_loads(raw_snapshot)
+    if snapshot["version"] != int(raw_version or 0):
+        return None  # the image changed after the snapshot was built
+    return snapshot
+
+
+def get_details_snapshot_version(endpoint: str, image: str, tag: str) -> int:
+    """
+    Returns the current version of the data of the given image, which must be read before the data of a new snapshot
+    is queried.
+    """
+    client = get_redis()
+    if client is None:
+        return 0
+
+    try:
+        return int(client.get(details_snapshot_version_key(endpoint, image, tag)) or 0)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to read the details snapshot version of '{endpoint}/{image}:{tag}': {e}")
+        return -1  # never matches, i.e., the snapshot is rebuilt on the next page load
+
+
+def store_details_snapshot(snapshot: DetailsSnapshot):
+    client = get_redis()
+    if client is None:
+        return
+
+    image = snapshot["image"]
+    try:
+        client.set(details_snapshot_key(image["endpoint"], image["image"], image["tag"]), json.dumps(snapshot),
+                   ex=DETAILS_SNAPSHOT_TTL)
+    except redis.RedisError as e:
+        logger.warning(f"Failed to store the details snapshot of "
+                       f"'{image['endpoint']}/{image['image']}:{image['tag']}': {e}")
+
+
+def _increment_version(pipeline: redis.asyncio.client.Pipeline, endpoint: str, image: str, tag: str):
+    # The version key expires together with the snapshots that may refer to it. If it expired, the version starts
+    # again at 1, and a remaining snapshot of an older version 1 is rebuilt (or deleted) by the caller
+    key = details_snapshot_version_key(endpoint, image, tag)
+    pipeline.incr(key)
+    pipeline.expire(key, DETAILS_SNAPSHOT_TTL)
+
+
+async def refresh_details_snapshots_async(session: AsyncSession, images: list[ImageToScrape]):
+    """
+    Increments the versions of the given (changed) images, which invalidates their snapshots, and rebuilds the
+    existing snapshots. Images without a snapshot are skipped, because they were not viewed recently (the details page
+    builds the snapshot on demand).
+    """
+    client = get_async_redis()
+    if client is None or not images:
+        return
+
+    try:
+        async with client.pipeline(transaction=False) as pipeline:
+            for image in images:
+                _increment_version(pipeline, image.endpoint, image.image, image.tag)
+                pipeline.exists(details_snapshot_key(image.endpoint, image.image, image.tag))
+            results = await pipeline.execute()
+
+        # Each image has 3 results: the incremented version, the result of EXPIRE and the result of EXISTS
+        images_with_snapshot = [(image, version) for image, version, exists in zip(images, results[0::3], results[2::3])
+                                if exists]
+        if not images_with_snapshot:
+            return
+
+        async with client.pipeline(transaction=False) as pipeline:
+            for image, version in images_with_snapshot:
+                snapshot = await build_details_snapshot_async(session, image.id, version)
+                if snapshot is not None:
+                    pipeline.set(details_snapshot_key(image.endpoint, image.image, image.tag), json.dumps(snapshot),
+                                 ex=DETAILS_SNAPSHOT_TTL)
+            await pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to refresh the details snapshots of {len(images)} images: {e}")
+
+
+async def delete_details_snapshots_async(images: list[tuple[str, str, str]]):
+    """
+    Deletes the details snapshots of the given (endpoint, image, tag) tuples, and increments their versions, so that
+    snapshots that are being built (from the data before the deletion) are not used either.
+    """
+    client = get_async_redis()
+    if client is None or not images:
+        return
+
+    try:
+        async with client.pipeline(transaction=False) as pipeline:
+            pipeline.delete(*[details_snapshot_key(endpoint, image, tag) for endpoint, image, tag in images])
+            for endpoint, image, tag in images:
+                _increment_version(pipeline, endpoint, image, tag)
+            await pipeline.execute()
+    except redis.RedisError as e:
+        logger.warning(f"Failed to delete the details snapshots of {len(images)} images: {e}")
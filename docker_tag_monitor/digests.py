@@ -0,0 +1,13 @@
+def split_digest(digest: str) -> tuple[str, bytes]:
+    """
+    Splits a digest string such as "sha256:<64 hex characters>" into its algorithm and the raw (binary) hash, which is
+    how digests are stored in the Digest table.
+    """
+    algorithm, separator, hex_hash = digest.partition(":")
+    if not separator:
+        raise ValueError(f"Invalid digest format: {digest}")
+    return algorithm, bytes.fromhex(hex_hash)
+
+
+def format_digest(algorithm: str, hash_bytes: bytes) -> str:
+    return f"{algorithm}:{hash_bytes.hex()}"
@@ -1,10 +1,28 @@
 import reflex as rx
 
 from . import styles
+from .api import api
+from .background_refresh import run_background_refreshers
+from .cache import handle_image_change as invalidate_search_cache_on_image_change
+from .instrumentation import EventHandlerMetricsMiddleware, instrument_sql_queries
+from .invalidation_bus import add_image_change_handler, run_image_change_listener
+from .pages import (  # noqa (importing the pages registers their routes)
+    overview,
+    image_details,
+    site_status
+)
+from .tag_index import handle_image_change as invalidate_tag_index_on_image_change
 
 app = rx.App(
     style=styles.base_style,
-    stylesheets=styles.base_stylesheets
+    stylesheets=styles.base_stylesheets,
+    api_transformer=api,
 )
+app.register_lifespan_task(run_background_refreshers)
+app.register_lifespan_task(run_image_change_listener)
+add_image_change_handler(invalidate_search_cache_on_image_change)
+add_image_change_handler(invalidate_tag_index_on_image_change)
+app.add_middleware(EventHandlerMetricsMiddleware())
+instrument_sql_queries()
 
 # TODO: figure out how we can set e.g. logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO) such that it works
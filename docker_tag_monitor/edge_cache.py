@@ -0,0 +1,110 @@
+"""
+Helpers for the HTTP cache of Caddy (the "cache" directive of the cache-handler module, see Caddyfile), which caches
+the GET responses of the JSON API (see api.py).
+
+The backend tags each response with a surrogate key of the image, and lets Caddy cache it until the scraper's next
+run starts (the scraper stores that time in Valkey). Whenever the scraper changes the data of an image while it runs,
+it purges the surrogate key of that image from Caddy's cache.
+
+This module must not import Reflex, because the scraper uses it, too.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+import aiohttp
+import durationpy
+import redis
+from yarl import URL
+
+from docker_tag_monitor.cache import CacheGeneration, get_async_redis
+
+logger = logging.getLogger("DockerTagMonitor-EdgeCache")
+
+EDGE_CACHE_MAX_AGE = durationpy.from_str(os.getenv("EDGE_CACHE_MAX_AGE", "1h"))
+"""
+Maximum time for which Caddy may cache an API response. Caddy usually caches the responses until the scraper's next
+run starts, but purges are only sent to the Caddy instances listed in EDGE_CACHE_PURGE_URLS, so this limits how long
+other instances may serve outdated responses.
+"""
+EDGE_CACHE_PURGE_URLS = [url.strip() for url in os.getenv("EDGE_CACHE_PURGE_URLS", "").split(",") if url.strip()]
+"""
+Comma-separated base URLs of the (internal) cache API listeners of the Caddy instances, e.g. "http://frontend:2020".
+Each host name is resolved to all of its addresses (e.g. those of the pods of a headless Kubernetes service), and the
+Caddy instance at each address is purged. If empty, the scraper does not purge anything, and cached responses only
+expire.
+"""
+
+SCRAPER_NEXT_RUN_KEY = "dtm:scraper:next_run_at"
+PURGE_CHUNK_SIZE = 100
+
+# Note: although the next run time is not a generation counter, it is read from Valkey the same way
+_scraper_next_run = CacheGeneration(SCRAPER_NEXT_RUN_KEY)
+
+
+def image_surrogate_key(endpoint: str, image: str, tag: str) -> str:
+    return f"image:{endpoint}/{image}:{tag}"
+
+
+def get_edge_cache_max_age(default: timedelta) -> int:
+    """
+    Returns for how many seconds Caddy may cache a response, i.e., until the scraper's next run starts (capped at
+    EDGE_CACHE_MAX_AGE). Returns the default while the scraper is running (or if its next run is unknown).
+    """
+    seconds_until_next_run = float(_scraper_next_run.get()) - time.time()
+    if seconds_until_next_run <= 0:
+        return int(min(default, EDGE_CACHE_MAX_AGE).total_seconds())
+    return int(min(seconds_until_next_run, EDGE_CACHE_MAX_AGE.total_seconds()))
+
+
+async def set_scraper_next_run_async(next_run_at: datetime):
+    client = get_async_redis()
+    if client is None:
+        return
+
+    try:
+        await client.set(SCRAPER_NEXT_RUN_KEY, str(next_run_at.timestamp()))
+    except redis.RedisError as e:
+        logger.warning(f"Failed to store the time of the scraper's next run: {e}")
+
+
+async def _resolve_purge_urls() -> list[str]:
+    """
+    Returns the purge URLs of all Caddy instances, i.e., one URL per address of each host in EDGE_CACHE_PURGE_URLS.
+    """
+    loop = asyncio.get_running_loop()
+    purge_urls = []
+    for purge_url in EDGE_CACHE_PURGE_URLS:
+        url = URL(purge_url)
+        try:
+            address_infos = await loop.getaddrinfo(url.host, url.port, type=socket.SOCK_STREAM)
+        except OSError as e:
+            logger.warning(f"Failed to resolve the edge cache '{purge_url}': {e}")
+            continue
+        purge_urls.extend(str(url.with_host(address)) for address in sorted({info[4][0] for info in address_infos}))
+    return purge_urls
+
+
+async def purge_edge_cache_async(images: list[tuple[str, str, str]]):
+    """
+    Purges the cached API responses of the given (endpoint, image, tag) tuples from all EDGE_CACHE_PURGE_URLS.
+    """
+    if not EDGE_CACHE_PURGE_URLS or not images:
+        return
+
+    purge_urls = await _resolve_purge_urls()
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+        # Purge in chunks, to keep the size of the Surrogate-Key header reasonable
+        for chunk_start in range(0, len(images), PURGE_CHUNK_SIZE):
+            surrogate_keys = ", ".join(image_surrogate_key(endpoint, image, tag)
+                                       for endpoint, image, tag in images[chunk_start:chunk_start + PURGE_CHUNK_SIZE])
+            for purge_url in purge_urls:
+                try:
+                    async with session.request("PURGE", f"{purge_url}/souin-api/souin/",
+                                               headers={"Surrogate-Key": surrogate_keys}) as response:
+                        response.raise_for_status()
+                except aiohttp.ClientError as e:
+                    logger.warning(f"Failed to purge images from the edge cache '{purge_url}': {e}")
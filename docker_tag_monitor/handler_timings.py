@@ -0,0 +1,45 @@
+"""
+Accounting of the time that the currently running Reflex event handler spends in SQL queries and registry requests,
+which instrumentation.py reports per event handler.
+
+This module must not import Reflex, because registry.py (which the scraper uses, too) reports its requests here.
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class HandlerTimings:
+    started_at: float = field(default_factory=time.perf_counter)
+    sql_seconds: float = 0.0
+    sql_queries: int = 0
+    # Concurrent registry requests (e.g. checking several images with asyncio.gather()) are summed up
+    registry_seconds: float = 0.0
+    registry_requests: int = 0
+    delta_bytes: int = 0
+    updates: int = 0
+
+
+# Set by the EventHandlerMetricsMiddleware while an event handler runs, None otherwise (e.g. in the scraper)
+current_handler_timings: ContextVar[Optional[HandlerTimings]] = ContextVar("current_handler_timings", default=None)
+
+
+@contextmanager
+def registry_request_timing():
+    """
+    Adds the duration of the enclosed registry request to the timings of the current event handler (if any).
+    """
+    timings = current_handler_timings.get()
+    if timings is None:
+        yield
+        return
+
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.registry_seconds += time.perf_counter() - started_at
+        timings.registry_requests += 1
@@ -0,0 +1,171 @@
+"""
+Instrumentation of the Reflex event handlers.
+
+The EventHandlerMetricsMiddleware measures every event handler (of all states): its wall time, the time spent in SQL
+queries (see instrument_sql_queries()) and in registry requests (see handler_timings.py), the number of queries, and
+the size of the state deltas it sends. These are exposed as Prometheus histograms (labelled by handler) at the
+backend's /metrics endpoint, which Caddy does not forward (so it is only reachable from within the cluster). Handlers
+that take longer than SLOW_EVENT_HANDLER_THRESHOLD are logged as warning. Background tasks (e.g. the live updates of
+the details page) are not measured.
+
+Every state delta produced by an event handler is sent to the browser via the websocket, and the state itself is
+stored per client session in Valkey, so state fields should only contain the (lightweight) data the UI actually shows
+(see the TypedDict DTOs in components/utils.py). The middleware therefore also logs deltas that exceed
+STATE_DELTA_SIZE_BUDGET_BYTES.
+"""
+import logging
+import os
+import time
+from typing import Optional
+
+import durationpy
+import reflex as rx
+from prometheus_client import CollectorRegistry, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, \
+    multiprocess
+from reflex.event import Event
+from reflex.state import BaseState, StateUpdate
+from sqlalchemy import event as sqlalchemy_event
+from sqlalchemy.engine import Engine
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .handler_timings import HandlerTimings, current_handler_timings
+
+logger = logging.getLogger("DockerTagMonitor-Instrumentation")
+
+STATE_DELTA_SIZE_BUDGET_BYTES = int(os.getenv("STATE_DELTA_SIZE_BUDGET_BYTES", "32768"))
+"""
+Maximum size (in bytes) of the serialized state delta of a single update sent by an event handler. Larger deltas are
+logged as warning. Set to 0 to disable the measurement of the delta sizes (which serializes each delta a second time).
+"""
+SLOW_EVENT_HANDLER_THRESHOLD = durationpy.from_str(os.getenv("SLOW_EVENT_HANDLER_THRESHOLD", "1s"))
+"""
+Event handlers that take longer than this (from receiving the event until the final state update) are logged as
+warning, together with the time they spent in SQL queries and registry requests.
+"""
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")
+"""
+Directory in which the worker processes store their metrics (the multiprocess mode of prometheus_client), so that
+/metrics returns the metrics of all worker processes, not only those of the process that handles the request. Set in
+the Dockerfile. Should be empty when the backend starts.
+"""
+
+if PROMETHEUS_MULTIPROC_DIR:
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR, exist_ok=True)
+
+_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+EVENT_HANDLER_DURATION = Histogram("dtm_event_handler_duration_seconds",
+                                   "Wall time of an event handler, until its final state update", ["handler"],
+                                   buckets=_DURATION_BUCKETS)
+EVENT_HANDLER_SQL_DURATION = Histogram("dtm_event_handler_sql_duration_seconds",
+                                       "Time an event handler spent in SQL queries", ["handler"],
+                                       buckets=_DURATION_BUCKETS)
+EVENT_HANDLER_SQL_QUERIES = Histogram("dtm_event_handler_sql_queries",
+                                      "Number of SQL queries executed by an event handler", ["handler"],
+                                      buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100))
+EVENT_HANDLER_REGISTRY_DURATION = Histogram("dtm_event_handler_registry_duration_seconds",
+                                            "Time an event handler spent in registry requests", ["handler"],
+                                            buckets=_DURATION_BUCKETS)
+EVENT_HANDLER_DELTA_BYTES = Histogram("dtm_event_handler_delta_bytes",
+                                      "Serialized size of a state update sent by an event handler", ["handler"],
+                                      buckets=(256, 1024, 4096, 16384, 32768, 65536, 262144, 1048576))
+
+
+def handler_label(event_name: str) -> str:
+    # e.g. "reflex___state____state.docker_tag_monitor___state____search_state.validate_and_search"
+    # -> "search_state.validate_and_search"
+    state_name, _, handler_name = event_name.rpartition(".")
+    return f"{state_name.rpartition('.')[2].rpartition('____')[2]}.{handler_name}"
+
+
+class EventHandlerMetricsMiddleware(rx.Middleware):
+    """
+    Measures each event handler (see the module docstring). Note: events of unknown handlers never reach
+    postprocess(), so clients cannot create arbitrary "handler" labels.
+    """
+
+    async def preprocess(self, app: rx.App, state: BaseState, event: Event) -> Optional[StateUpdate]:
+        # The handler runs in the same context (the task that processes the websocket event)
+        current_handler_timings.set(HandlerTimings())
+        return None
+
+    async def postprocess(self, app: rx.App, state: BaseState, event: Event, update: StateUpdate) -> StateUpdate:
+        timings = current_handler_timings.get()
+        label = handler_label(event.name)
+
+        if STATE_DELTA_SIZE_BUDGET_BYTES > 0:
+            delta_size = len(update.json().encode())
+            EVENT_HANDLER_DELTA_BYTES.labels(label).observe(delta_size)
+            if timings is not None:
+                timings.delta_bytes += delta_size
+            if delta_size > STATE_DELTA_SIZE_BUDGET_BYTES:
+                changed_fields = {substate: list(fields) for substate, fields in update.delta.items()}
+                logger.warning(f"Event handler '{event.name}' sent a state delta of {delta_size} bytes "
+                               f"(budget: {STATE_DELTA_SIZE_BUDGET_BYTES} bytes), changed fields: {changed_fields}")
+
+        if timings is not None:
+            timings.updates += 1
+            if update.final:
+                current_handler_timings.set(None)
+                self._observe(label, timings)
+        return update
+
+    @staticmethod
+    def _observe(label: str, timings: HandlerTimings):
+        duration = time.perf_counter() - timings.started_at
+        EVENT_HANDLER_DURATION.labels(label).observe(duration)
+        EVENT_HANDLER_SQL_DURATION.labels(label).observe(timings.sql_seconds)
+        EVENT_HANDLER_SQL_QUERIES.labels(label).observe(timings.sql_queries)
+        EVENT_HANDLER_REGISTRY_DURATION.labels(label).observe(timings.registry_seconds)
+
+        if duration > SLOW_EVENT_HANDLER_THRESHOLD.total_seconds():
+            logger.warning(f"Slow event handler '{label}' took {duration:.3f}s: SQL {timings.sql_seconds:.3f}s "
+                           f"({timings.sql_queries} queries), registry {timings.registry_seconds:.3f}s "
+                           f"({timings.registry_requests} requests), {timings.updates} state updates "
+                           f"({timings.delta_bytes} bytes)")
+
+
+def _before_cursor_execute(_connection, _cursor, _statement, _parameters, context, _executemany):
+    if current_handler_timings.get() is not None:
+        context.dtm_query_started_at = time.perf_counter()
+
+
+def _after_cursor_execute(_connection, _cursor, _statement, _parameters, context, _executemany):
+    _record_query(context)
+
+
+def _handle_error(exception_context):
+    if exception_context.execution_context is not None:
+        _record_query(exception_context.execution_context)
+
+
+def _record_query(context):
+    timings = current_handler_timings.get()
+    started_at = getattr(context, "dtm_query_started_at", None)
+    if timings is not None and started_at is not None:
+        timings.sql_seconds += time.perf_counter() - started_at
+        timings.sql_queries += 1
+
+
+def instrument_sql_queries():
+    """
+    Registers SQLAlchemy event listeners (for all engines, i.e., also for the read replica, see db_routing.py) that add
+    the duration of each query to the timings of the current event handler.
+    """
+    sqlalchemy_event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    sqlalchemy_event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    sqlalchemy_event.listen(Engine, "handle_error", _handle_error)
+
+
+def metrics(_request: Request) -> Response:
+    """
+    GET /metrics
+
+    Returns the metrics in the Prometheus text format.
+    """
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry, path=PROMETHEUS_MULTIPROC_DIR)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
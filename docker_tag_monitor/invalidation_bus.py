@@ -0,0 +1,176 @@
+"""
+Cross-process invalidation bus based on PostgreSQL's LISTEN/NOTIFY.
+
+The scraper (a separate process) sends a notification after each committed change of ImageToScrape/ImageUpdate rows
+(see notify_image_changes_async()). Each web worker process holds one LISTEN connection (see
+run_image_change_listener(), a lifespan task of the Reflex app), and passes the received changes to the registered
+handlers (which invalidate in-process caches) and to the open details pages that wait for changes of their image.
+
+Note: the shared caches in Valkey (search results, details snapshots) are invalidated by the scraper itself (once,
+instead of once per web worker).
+
+This module must not import Reflex, because the scraper uses it, too.
+"""
+import asyncio
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+import durationpy
+import psycopg
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from docker_tag_monitor.parsing import json_loads
+
+logger = logging.getLogger("DockerTagMonitor-InvalidationBus")
+
+INVALIDATION_LISTENER_RECONNECT_INTERVAL = durationpy.from_str(
+    os.getenv("INVALIDATION_LISTENER_RECONNECT_INTERVAL", "5s"))
+"""
+How long a web worker process waits before it re-establishes its LISTEN connection after the connection was lost.
+"""
+
+CHANNEL = "dtm_image_changes"
+
+CHANGE_TYPE_CREATED = "created"  # new ImageToScrape rows
+CHANGE_TYPE_UPDATED = "updated"  # new ImageUpdate rows (i.e., new digests)
+CHANGE_TYPE_PRUNED = "pruned"  # old ImageUpdate rows were deleted (see the scraper's retention)
+CHANGE_TYPE_DELETED = "deleted"  # deleted ImageToScrape rows
+CHANGE_TYPE_RESYNC = "resync"  # sent (locally) after (re-)connecting, because any image may have changed meanwhile
+
+# PostgreSQL limits the payload of a notification to 8000 bytes, so larger changes are split into several notifications
+MAX_PAYLOAD_SIZE = 7500
+
+
+@dataclass
+class ImageChange:
+    change_type: str  # one of the CHANGE_TYPE_* constants
+    images: list[tuple[int, str, str, str]]  # (ImageToScrape.id, endpoint, image, tag) of the changed images
+
+
+ImageChangeHandler = Callable[[ImageChange], None]
+
+_handlers: list[ImageChangeHandler] = []
+_waiters: dict[tuple[str, str, str], set[asyncio.Future]] = {}
+
+
+def _encode_payloads(change: ImageChange) -> list[str]:
+    payloads = []
+    images = []
+    for image in change.images:
+        images.append(list(image))
+        if len(images) > 1 and len(json.dumps({"t": change.change_type, "i": images})) > MAX_PAYLOAD_SIZE:
+            images.pop()
+            payloads.append(json.dumps({"t": change.change_type, "i": images}))
+            images = [list(image)]
+    if images:
+        payloads.append(json.dumps({"t": change.change_type, "i": images}))
+    return payloads
+
+
+async def notify_image_changes_async(session: AsyncSession, change_type: str, images: list[tuple[int, str, str, str]]):
+    """
+    Notifies all web worker processes about the given changes (in a separate transaction, i.e., the changes should
+    already be committed, and the Valkey caches should already be invalidated).
+    """
+    if not images:
+        return
+
+    try:
+        for payload in _encode_payloads(ImageChange(change_type=change_type, images=images)):
+            await session.exec(text("SELECT pg_notify(:channel, :payload)"),
+                               params={"channel": CHANNEL, "payload": payload})
+        await session.commit()
+    except Exception as e:
+        await session.rollback()
+        logger.warning(f"Failed to send the notification about {len(images)} {change_type} images: {e}")
+
+
+def add_image_change_handler(handler: ImageChangeHandler):
+    """
+    Registers a handler that is called (in the web worker process) for every received change.
+    """
+    _handlers.append(handler)
+
+
+async def wait_for_image_change(endpoint: str, image: str, tag: str, timeout: float) -> Optional[str]:
+    """
+    Waits until the given image changes, returning the change type, or None if it did not change within the timeout.
+    """
+    key = (endpoint, image, tag)
+    future = asyncio.get_running_loop().create_future()
+    _waiters.setdefault(key, set()).add(future)
+    try:
+        return await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        return None
+    finally:
+        waiters = _waiters.get(key)
+        if waiters is not None:
+            waiters.discard(future)
+            if not waiters:
+                del _waiters[key]
+
+
+def _dispatch(change: ImageChange):
+    for handler in _handlers:
+        try:
+            handler(change)
+        except Exception as e:
+            logger.warning(f"Image change handler {handler.__qualname__} failed: {e}")
+
+    if change.change_type == CHANGE_TYPE_RESYNC:
+        changed_waiters = [waiter for waiters in _waiters.values() for waiter in waiters]
+    else:
+        changed_waiters = [waiter for _, endpoint, image, tag in change.images
+                           for waiter in _waiters.get((endpoint, image, tag), [])]
+    for waiter in changed_waiters:
+        if not waiter.done():
+            waiter.set_result(change.change_type)
+
+
+def _get_listener_conninfo() -> Optional[str]:
+    database_url = make_url(os.getenv("REFLEX_DB_URL", "sqlite:///reflex.db"))
+    if database_url.get_backend_name() != "postgresql":
+        return None
+    # psycopg does not understand SQLAlchemy's "postgresql+psycopg://" scheme
+    return database_url.set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+async def run_image_change_listener():
+    """
+    Lifespan task of the Reflex app (see app.register_lifespan_task()) that listens for the notifications of the scraper
+    forever.
+    """
+    conninfo = _get_listener_conninfo()
+    if conninfo is None:
+        logger.info("Not listening for image changes, because the database is not PostgreSQL")
+        return
+
+    is_reconnect = False
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as connection:
+                await connection.execute(f"LISTEN {CHANNEL}")
+                if is_reconnect:
+                    # Notifications sent while we were disconnected are lost
+                    _dispatch(ImageChange(change_type=CHANGE_TYPE_RESYNC, images=[]))
+                is_reconnect = True
+
+                async for notification in connection.notifies():
+                    try:
+                        payload = json_loads(notification.payload)
+                        images = [(image_id, endpoint, image, tag) for image_id, endpoint, image, tag in payload["i"]]
+                        change = ImageChange(change_type=payload["t"], images=images)
+                    except (ValueError, KeyError, TypeError) as e:
+                        logger.warning(f"Ignoring invalid image change notification: {e}")
+                        continue
+                    _dispatch(change)
+        except psycopg.Error as e:
+            logger.warning(f"The image change listener lost its database connection: {e}")
+            is_reconnect = True
+        await asyncio.sleep(INVALIDATION_LISTENER_RECONNECT_INTERVAL.total_seconds())
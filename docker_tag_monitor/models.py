@@ -1,4 +1,4 @@
-from datetime import datetime
+from datetime import datetime, date
 from typing import List
 
 import sqlalchemy as sa
@@ -14,6 +14,18 @@ class BackgroundJobExecution(sqlmodel.SQLModel, table=True):
     failed_queries: int
 
 
+class JobExecutionDaily(sqlmodel.SQLModel, table=True):
+    """
+    Daily rollup of the BackgroundJobExecution rows (by the day on which the job started), maintained by the scraper
+    whenever a job finishes, so that the status page does not need to aggregate the raw rows (which are compacted).
+    """
+    __tablename__ = "job_execution_daily"
+    day: date = sqlmodel.Field(primary_key=True)
+    successful_scans: int = 0  # number of jobs with failed_queries = 0 and successful_queries > 0
+    failed_scans: int = 0  # number of jobs with successful_queries = 0 or failed_queries > 0
+    total_duration_seconds: float = 0.0  # sum of the durations of all jobs of the day
+
+
 class ScrapedImage(sqlmodel.SQLModel, table=True):
     """
     Helper table that keeps tracks of all tags of an image (updated every digest refresh cycle).
@@ -27,6 +39,11 @@ class ScrapedImage(sqlmodel.SQLModel, table=True):
     image: str
     known_tags: List[float] = sqlmodel.Field(
         sa_column=sqlmodel.Column(sqlmodel.ARRAY(sqlmodel.String), server_default="{}"))
+    known_tags_updated_at: datetime | None = sqlmodel.Field(
+        default=None, sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True))
+    """
+    When the scraper last retrieved the tags of the image from the registry (None if it never did).
+    """
 
 
 class ImageToScrape(sqlmodel.SQLModel, table=True):
@@ -34,6 +51,11 @@ class ImageToScrape(sqlmodel.SQLModel, table=True):
     __table_args__ = (
         sa.UniqueConstraint("endpoint", "image", "tag", name="endpoint_image_tag"),
         sa.Index("compound_index_endpoint_image", "endpoint", "image"),
+        # Lets the overview table (sorted by update count) do an index range scan
+        sa.Index("compound_index_image_update_count_id", sa.text("image_update_count DESC"), "id"),
+        # Trigram indexes (pg_trgm extension) that serve the "contains" (LIKE '%...%') filters of the search
+        sa.Index("trgm_index_image", "image", postgresql_using="gin", postgresql_ops={"image": "gin_trgm_ops"}),
+        sa.Index("trgm_index_tag", "tag", postgresql_using="gin", postgresql_ops={"tag": "gin_trgm_ops"}),
     )
     id: int | None = sqlmodel.Field(default=None, primary_key=True)
     endpoint: str = sqlmodel.Field(index=True)
@@ -46,12 +68,51 @@ class ImageToScrape(sqlmodel.SQLModel, table=True):
     last_pushed: datetime | None = sqlmodel.Field(default=None,
                                                   sa_column=sa.Column(sa.DateTime(timezone=True), nullable=True,
                                                                       index=True))
+    image_update_count: int = sqlmodel.Field(default=0, sa_column=sa.Column(sa.Integer, nullable=False,
+                                                                           server_default="0"))
+    """
+    Number of ImageUpdate rows of this image, maintained by the scraper whenever it inserts or deletes ImageUpdates
+    (so that the overview table does not need to count them on every page load).
+    """
+
+
+class Digest(sqlmodel.SQLModel, table=True):
+    """
+    Dimension table that stores each distinct image digest only once, because many tags (e.g. "3.12", "3.12.7" and
+    "latest") point to the same digest. The hash is stored in binary form (32 bytes for SHA-256) instead of the
+    71-character "sha256:<hex>" string.
+    """
+    __tablename__ = "digest"
+    __table_args__ = (
+        sa.UniqueConstraint("algorithm", "hash", name="algorithm_hash"),
+    )
+    id: int | None = sqlmodel.Field(default=None, primary_key=True)
+    algorithm: str  # e.g. "sha256"
+    hash: bytes = sqlmodel.Field(sa_column=sa.Column(sa.LargeBinary, nullable=False))
 
 
 class ImageUpdate(sqlmodel.SQLModel, table=True):
     __tablename__ = "image_update"
+    __table_args__ = (
+        # Makes "which tags share this digest" lookups index-only
+        sa.Index("compound_index_digest_image", "digest_id", "image_id"),
+        # Serves the keyset-paginated digest table of the details page
+        sa.Index("compound_index_image_id_scraped_at_id", "image_id", "scraped_at", "id"),
+    )
     id: int | None = sqlmodel.Field(default=None, primary_key=True)
     scraped_at: datetime = sqlmodel.Field(
         sa_column=sa.Column(sa.DateTime(timezone=True), server_default=sa.func.now(), index=True))
     image_id: int = sqlmodel.Field(foreign_key="image_to_scrape.id", index=True, ondelete="CASCADE")
-    digest: str
+    digest_id: int = sqlmodel.Field(foreign_key="digest.id")
+
+
+class ImageUpdateRollup(sqlmodel.SQLModel, table=True):
+    """
+    Number of ImageUpdates per image and week/month bucket, maintained incrementally by the scraper whenever it
+    inserts or deletes ImageUpdates, so that the details page graph does not need to aggregate all ImageUpdates.
+    """
+    __tablename__ = "image_update_rollup"
+    image_id: int = sqlmodel.Field(foreign_key="image_to_scrape.id", primary_key=True, ondelete="CASCADE")
+    granularity: str = sqlmodel.Field(primary_key=True)  # "week" or "month" (the PostgreSQL DATE_TRUNC field)
+    bucket_start: datetime = sqlmodel.Field(sa_column=sa.Column(sa.DateTime(timezone=True), primary_key=True))
+    count: int
@@ -9,7 +9,8 @@ from ..utils import refresh_digest_last_pushed_cutoff
 from ..components.utils import format_timedelta_human_friendly
 
 
-@template(route="/details/[[...splat]]", title="Image details", on_load=ImageDetailsState.on_page_load)
+@template(route="/details/[[...splat]]", title="Image details",
+          on_load=[ImageDetailsState.on_page_load, ImageDetailsState.watch_image_changes])
 def index() -> rx.Component:
     return rx.vstack(
         rx.center(
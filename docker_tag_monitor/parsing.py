@@ -0,0 +1,30 @@
+"""
+Parsing helpers that avoid heavy dependencies (such as pydantic's validation), so that they are cheap to use in the
+scraper's hot paths.
+"""
+import json
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+try:
+    import orjson
+except ImportError:  # orjson speeds up decoding large registry/Docker Hub responses, but is not strictly required
+    orjson = None
+
+
+def json_loads(data: str | bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def parse_datetime(value: str) -> datetime:
+    """
+    Parses an ISO 8601 date, e.g. "2025-08-14T12:52:58.11151Z" (Docker Hub) or "2024-01-02T03:04:05.123456789Z" (image
+    configs, which contain nanoseconds that are truncated to microseconds). Dates without a time zone are assumed to be
+    in UTC.
+    """
+    parsed_datetime = datetime.fromisoformat(value)
+    if parsed_datetime.tzinfo is None:
+        parsed_datetime = parsed_datetime.replace(tzinfo=ZoneInfo('UTC'))
+    return parsed_datetime
@@ -0,0 +1,235 @@
+"""
+Helper functions for talking to image registries. This module must not import Reflex, because it is also used by
+the (lean) scraper process.
+"""
+import asyncio
+import base64
+import logging
+import os
+import re
+import time
+from typing import Optional
+
+import durationpy
+from aiohttp import ContentTypeError, ClientResponseError
+from docker_registry_client_async import ImageName, DockerRegistryClientAsync
+
+from docker_tag_monitor.cache import LruCache
+from docker_tag_monitor.handler_timings import registry_request_timing
+from docker_tag_monitor.parsing import json_loads
+from docker_tag_monitor.registry_traffic import create_registry_client
+
+logger = logging.getLogger("DockerTagMonitor-Registry")
+
+REGISTRY_CLIENT_MAX_CONNECTIONS = int(os.getenv("REGISTRY_CLIENT_MAX_CONNECTIONS", "100"))
+"""
+Maximum number of simultaneously open connections of the (process-wide) registry client of the web backend.
+"""
+IMAGE_EXISTS_CACHE_TTL = durationpy.from_str(os.getenv("IMAGE_EXISTS_CACHE_TTL", "1h"))
+"""
+For how long the web backend remembers that an image exists in its registry.
+"""
+IMAGE_NOT_FOUND_CACHE_TTL = durationpy.from_str(os.getenv("IMAGE_NOT_FOUND_CACHE_TTL", "5m"))
+"""
+For how long the web backend remembers that an image does NOT exist in its registry (HTTP 404). Shorter than
+IMAGE_EXISTS_CACHE_TTL, because users often look up an image right before pushing it.
+"""
+IMAGE_EXISTENCE_CACHE_MAX_SIZE = int(os.getenv("IMAGE_EXISTENCE_CACHE_MAX_SIZE", "10000"))
+
+_shared_registry_client: Optional[DockerRegistryClientAsync] = None
+_shared_registry_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_shared_registry_client_configured: Optional[asyncio.Future] = None
+_image_existence_cache = LruCache(IMAGE_EXISTENCE_CACHE_MAX_SIZE)
+
+
+async def configure_and_reset_client(registry_client: DockerRegistryClientAsync):
+    # Add Docker Hub credentials, if provided via environment variables
+    username = os.getenv("DOCKERHUB_USERNAME")
+    password = os.getenv("DOCKERHUB_PASSWORD")
+    # Note: from various experiments, since we just perform HEAD requests to Docker Hub, it seems that there is no
+    # ratelimit-related difference between using an account, or being anonymous
+    if username and password:
+        b64_credentials = base64.b64encode(f"{username}:{password}".encode("ascii")).decode("ascii")
+        await registry_client.add_credentials(credentials=b64_credentials, endpoint="https://index.docker.io/")
+
+    registry_client.tokens.clear()  # do the reset first, otherwise it would undo the configuration done next
+    # Add compatibility for Chainguard's registry, whose auth endpoint does not return Content-Type: application/json
+    # but "text/plain", which would cause an aiohttp.ContentTypeError within the docker_registry_client_async library.
+    # By setting the value to an empty string, the aiohttp client's json() method WON'T check the content type at all.
+    await registry_client.add_auth_token_json_kwargs(
+        endpoint="cgr.dev", json_kwargs={"content_type": ""}
+    )
+
+
+async def get_shared_registry_client() -> DockerRegistryClientAsync:
+    """
+    Returns the process-wide registry client of the web backend, whose connection pool and auth tokens are reused
+    across calls. There is one client per event loop, because aiohttp sessions are bound to the loop that created them.
+    """
+    global _shared_registry_client, _shared_registry_client_loop, _shared_registry_client_configured
+
+    loop = asyncio.get_running_loop()
+    configuration_failed = _shared_registry_client_configured is not None and \
+        _shared_registry_client_configured.done() and \
+        (_shared_registry_client_configured.cancelled() or _shared_registry_client_configured.exception() is not None)
+    if _shared_registry_client is None or _shared_registry_client_loop is not loop or configuration_failed:
+        previous_client, previous_loop = _shared_registry_client, _shared_registry_client_loop
+        _shared_registry_client = create_registry_client(
+            tcp_connector_kwargs={"limit": REGISTRY_CLIENT_MAX_CONNECTIONS, "ttl_dns_cache": 300})
+        _shared_registry_client_loop = loop
+        # Concurrent callers must wait for the (single) configuration of the new client
+        _shared_registry_client_configured = asyncio.ensure_future(
+            configure_and_reset_client(_shared_registry_client))
+        # Only closed after the replacement, so that concurrent callers do not replace the client a second time
+        if previous_client is not None:
+            await _close_registry_client(previous_client, previous_loop)
+
+    await asyncio.shield(_shared_registry_client_configured)
+    return _shared_registry_client
+
+
+async def _close_registry_client(registry_client: DockerRegistryClientAsync, loop: asyncio.AbstractEventLoop):
+    """
+    Closes the given (replaced) registry client, whose aiohttp session must be closed on the loop that created it.
+    """
+    try:
+        if loop is asyncio.get_running_loop():
+            await registry_client.close()
+        elif not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(registry_client.close(), loop)
+        # Otherwise, the session can no longer be closed, because its loop is closed
+    except Exception as e:
+        logger.warning(f"Failed to close the replaced registry client: {e}")
+
+
+async def image_exists_in_registry(image_name: ImageName, registry_client: DockerRegistryClientAsync) -> bool:
+    """
+    Checks whether the image exists in its registry, caching the answer (positive answers for
+    IMAGE_EXISTS_CACHE_TTL, and "not found" answers for IMAGE_NOT_FOUND_CACHE_TTL). Other failures are not cached.
+    """
+    cache_key = f"{image_name.resolve_endpoint()}/{image_name.resolve_image()}:{image_name.resolve_tag()}"
+    cache_entry = _image_existence_cache.get(cache_key)
+    if cache_entry is not None:
+        expires_at, exists = cache_entry
+        if expires_at > time.monotonic():
+            return exists
+
+    with registry_request_timing():
+        result = await registry_client.head_manifest(image_name)
+    if not result.result and result.client_response.status == 401:  # e.g. an expired auth token
+        await configure_and_reset_client(registry_client)
+        with registry_request_timing():
+            result = await registry_client.head_manifest(image_name)
+
+    if result.result:
+        _image_existence_cache.set(cache_key, (time.monotonic() + IMAGE_EXISTS_CACHE_TTL.total_seconds(), True))
+    elif result.client_response.status == 404:
+        _image_existence_cache.set(cache_key, (time.monotonic() + IMAGE_NOT_FOUND_CACHE_TTL.total_seconds(), False))
+
+    return bool(result.result)
+
+
+async def images_exists_in_registry(image_names: list[ImageName]) -> bool:
+    """
+    Returns True if all images exist in their registries, checking them concurrently.
+    """
+    try:
+        registry_client = await get_shared_registry_client()
+        results = await asyncio.gather(*(image_exists_in_registry(image_name, registry_client)
+                                         for image_name in image_names))
+    except Exception as e:
+        logger.debug(f"Failed to check whether the images exist in the registry: {e}")
+        return False
+
+    return all(results)
+
+
+def contains_digest(tag: str, min_segment_length: int = 32) -> bool:
+    """
+    Detects tags containing long sequences of alphanumeric characters that look like
+    digests or hashes (e.g.,
+    "update-available-441cc46cf89f0bc773dc84872ccab6c3b4a81dda7b946087b072f613d81ed106", or Notation/Cosign
+    "sha256-<64-characters-of-the-hash>[.att|.sig|.sbom]" tags).
+    Returns True if the tag contains at least one sequence of `min_length` or more consecutive
+    alphanumeric characters.
+    """
+    # Find all sequences of consecutive alphanumeric characters, e.g., splitting
+    # "1.2-update-available-441cc46cf89f0bc773dc84872ccab6c3b4a81dda7b946087b072f613d81ed106" into
+    # ["1", "2", "update", "available", "441cc46cf89f0bc773dc84872ccab6c3b4a81dda7b946087b072f613d81ed106"]
+    alphanumeric_sequences = re.findall(r'[a-zA-Z0-9]+', tag)
+    return any(len(seq) >= min_segment_length for seq in alphanumeric_sequences)
+
+
+async def get_all_image_tags(image_name: ImageName, client: Optional[DockerRegistryClientAsync] = None) -> list[str]:
+    close_connection = False
+    if client is None:
+        client = create_registry_client()
+        await configure_and_reset_client(client)
+        close_connection = True
+    """
+    Ideally, we would like the sorting of the returned tags to be done by push-date (descending).
+    An earlier (removed) implementation used the proprietary /repositories API endpoints of specific registries
+    (e.g. Docker Hub, Quay, and Microsoft MCR) to achieve this. But these registry endpoints did not support glob-
+    like search syntax, and the implementation was complex (see Git commit 6f6027d96a78270220c5bdeb26e8151d92700ec7
+    and earlier).
+
+    Instead, we now simply use the official tag list feature that every image registry offers.
+    The returned tag list is sorted lexicographically, not by push date, and to achieve the latter, we would have
+    to do the following for every entry in tag_list_response.tags (which is too much work / network calls to be
+    feasible):
+    - Retrieve the manifest of the tag
+    - If the returned manifest is an image INDEX, we choose one of the referenced image MANIFESTS at random and
+      retrieve its manifest
+    - Retrieve the blob of the "config" object of the manifest, parse the entries in "history" -> "created"
+      (see https://github.com/opencontainers/image-spec/blob/main/config.md), and assume that the image was
+      pushed immediately after the "created" date (which just indicates when layers where built)
+
+    Also, note that we are NOT using paginated calls on purpose (which is described here:
+    https://distribution.github.io/distribution/spec/api/#listing-image-tags).
+    It seems that registries like Docker Hub and MCR return ALL tags without enforcing pagination, even if an
+    image has thousands of tags.
+    """
+    # TODO implement pagination, because e.g. otherwise the OWASP ZAP image hosted on GHCR will not return all tags
+    try:
+        max_retries = 5
+        custom_content_type_header_value = ""
+        last_error: Optional[Exception] = None
+        for attempt in range(max_retries):
+            try:
+                json_kwargs = {"loads": json_loads}
+                if custom_content_type_header_value:
+                    json_kwargs["content_type"] = custom_content_type_header_value
+                with registry_request_timing():
+                    tag_list_response = await client.get_tag_list(image_name, json_kwargs=json_kwargs)
+            except ClientResponseError as e:
+                if attempt == max_retries - 1:
+                    last_error = e
+                    break
+
+                if isinstance(e, ContentTypeError) and e.status == 200 and \
+                        (content_type := e.headers["content-type"]) != "application/json":
+                    custom_content_type_header_value = content_type
+
+                if not custom_content_type_header_value:
+                    logger.debug(f"Attempt {attempt + 1}/{max_retries} to get tags for {image_name} failed "
+                                 f"with ClientResponseError (trying again ...): {e}")
+                await asyncio.sleep(1)
+
+                continue
+
+            # Note: tag_list_response.tags is an array of ImageName objects
+            tag_list: list[ImageName] = tag_list_response.tags
+            tags: list[str] = [tag.tag for tag in tag_list]  # noqa (type parser false positive)
+            # Tags are returned in lexicographical order, so usually "oldest version first". To the user, it will be more
+            # practical to see the most recent versions first, so we reverse the order
+            tags.reverse()
+
+            tags = [t for t in tags if not contains_digest(t)]
+
+            return tags
+
+        if last_error is not None:
+            raise last_error
+    finally:
+        if close_connection:
+            await client.close()
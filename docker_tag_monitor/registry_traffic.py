@@ -0,0 +1,322 @@
+"""
+Record/replay support for the HTTP traffic to image registries and Docker Hub.
+
+Live registries change constantly, which makes it impossible to run the same scraper workload twice. To be able to
+compare two versions of the scraper (or the web backend), you can first record the traffic of a (production) run, and
+then replay it locally, without any network access:
+
+- REGISTRY_TRAFFIC_MODE=record writes every request/response pair (method, URL, status, response headers, body digest,
+  timing) to the append-only file REGISTRY_TRAFFIC_FILE. Bodies are stored only once per digest (most of them are
+  empty, because the scraper mostly does HEAD requests). Use a file name ending with ".gz" to compress the file.
+- REGISTRY_TRAFFIC_MODE=replay serves the recorded responses from REGISTRY_TRAFFIC_FILE instead of making any
+  network requests. If the same request was recorded several times, the responses are served in the recorded order
+  (the last one is repeated once they are exhausted). Set REGISTRY_TRAFFIC_REPLAY_LATENCY=true to also wait for the
+  originally recorded duration of each request.
+
+Note: the recorded file contains the (short-lived) bearer tokens returned by the auth endpoints of the registries.
+Request headers (which may contain credentials) are NOT recorded.
+"""
+import asyncio
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Any, Optional
+
+import aiohttp
+from docker_registry_client_async import DockerRegistryClientAsync
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+logger = logging.getLogger("RegistryTraffic")
+
+REGISTRY_TRAFFIC_MODE = os.getenv("REGISTRY_TRAFFIC_MODE", "").lower()
+"""
+Either "" (regular operation, the default), "record" or "replay".
+"""
+REGISTRY_TRAFFIC_FILE = os.getenv("REGISTRY_TRAFFIC_FILE", "registry_traffic.jsonl.gz")
+"""
+The file that recorded traffic is appended to (mode "record"), or read from (mode "replay").
+"""
+REGISTRY_TRAFFIC_REPLAY_LATENCY = os.getenv("REGISTRY_TRAFFIC_REPLAY_LATENCY", "false").lower() in ["true", "1", "yes"]
+"""
+Whether replayed responses are delayed by the latency that was originally recorded.
+"""
+
+
+def _open_traffic_file(mode: str):
+    if REGISTRY_TRAFFIC_FILE.endswith(".gz"):
+        return gzip.open(REGISTRY_TRAFFIC_FILE, mode + "t", encoding="utf-8")
+    return open(REGISTRY_TRAFFIC_FILE, mode, encoding="utf-8")
+
+
+class TrafficRecorder:
+    """
+    Appends one compact JSON line per exchange to the traffic file. A body is written as a separate "blob" line,
+    the first time its digest is seen (in this process).
+    """
+
+    def __init__(self):
+        self._file = _open_traffic_file("a")
+        self._written_body_digests: set[str] = set()
+        self._start = time.monotonic()
+
+    def _write(self, record: dict[str, Any]):
+        self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+
+    def record(self, method: str, url: str, started: float, elapsed: float, status: Optional[int] = None,
+               headers: Optional[list[tuple[str, str]]] = None, body: bytes = b"", error: Optional[Exception] = None):
+        record: dict[str, Any] = {
+            "m": method,
+            "u": url,
+            "t": round(started - self._start, 4),
+            "e": round(elapsed, 4),
+        }
+        if error is not None:
+            record["x"] = [type(error).__name__, str(error)]
+        else:
+            record["s"] = status
+            record["h"] = headers
+            if body:
+                body_digest = "sha256:" + hashlib.sha256(body).hexdigest()
+                if body_digest not in self._written_body_digests:
+                    self._write({"b": body_digest, "d": base64.b64encode(body).decode("ascii")})
+                    self._written_body_digests.add(body_digest)
+                record["d"] = body_digest
+        self._write(record)
+
+    def close(self):
+        self._file.close()
+
+
+class TrafficReplayer:
+    """
+    Loads the traffic file and serves the recorded exchanges, keyed by (method, URL).
+    """
+
+    def __init__(self):
+        self._bodies: dict[str, bytes] = {}
+        self._exchanges: dict[tuple[str, str], deque[dict[str, Any]]] = {}
+        with _open_traffic_file("r") as f:
+            try:
+                for line in f:
+                    record = json.loads(line)
+                    if "b" in record:
+                        self._bodies[record["b"]] = base64.b64decode(record["d"])
+                    else:
+                        self._exchanges.setdefault((record["m"], record["u"]), deque()).append(record)
+            except (EOFError, json.JSONDecodeError) as e:
+                # Happens if the recording process was killed (the last line is incomplete)
+                logger.warning(f"Traffic file {REGISTRY_TRAFFIC_FILE} is truncated, ignoring the rest: {e}")
+        logger.info(f"Loaded {sum(len(e) for e in self._exchanges.values())} recorded exchanges "
+                    f"from {REGISTRY_TRAFFIC_FILE}")
+
+    def next_exchange(self, method: str, url: str) -> tuple[dict[str, Any], bytes]:
+        exchanges = self._exchanges.get((method, url))
+        if not exchanges:
+            raise aiohttp.ClientConnectionError(f"No recorded response for {method} {url}")
+        exchange = exchanges.popleft() if len(exchanges) > 1 else exchanges[0]
+        return exchange, self._bodies.get(exchange.get("d"), b"")
+
+
+_recorder: Optional[TrafficRecorder] = None
+_replayer: Optional[TrafficReplayer] = None
+
+
+def _get_recorder() -> TrafficRecorder:
+    global _recorder
+    if _recorder is None:
+        _recorder = TrafficRecorder()
+        atexit.register(_recorder.close)
+    return _recorder
+
+
+def _get_replayer() -> TrafficReplayer:
+    global _replayer
+    if _replayer is None:
+        _replayer = TrafficReplayer()
+    return _replayer
+
+
+def _url_with_params(str_or_url, params) -> str:
+    url = URL(str(str_or_url))
+    if params:
+        url = url.update_query(params)
+    return str(url)
+
+
+class ReplayedResponse:
+    """
+    Minimal stand-in for aiohttp.ClientResponse, offering those attributes and methods that our code and the
+    docker_registry_client_async library use.
+    """
+
+    def __init__(self, method: str, url: str, status: int, headers: list[tuple[str, str]], body: bytes):
+        self.method = method
+        self.url = URL(url)
+        self.status = status
+        self.reason = ""
+        self.headers = CIMultiDictProxy(CIMultiDict(headers))
+        self.content_type = self.headers.get("Content-Type", "application/octet-stream").partition(";")[0].strip()
+        self.request_info = aiohttp.RequestInfo(self.url, method, CIMultiDictProxy(CIMultiDict()), self.url)
+        self.history = ()
+        self._body = body
+
+    @property
+    def ok(self) -> bool:
+        return self.status < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise aiohttp.ClientResponseError(self.request_info, self.history, status=self.status,
+                                              message=self.reason, headers=self.headers)
+
+    async def read(self) -> bytes:
+        return self._body
+
+    async def text(self, encoding: Optional[str] = None, **_kwargs) -> str:
+        return self._body.decode(encoding or "utf-8")
+
+    async def json(self, *, encoding: Optional[str] = None, loads=json.loads,
+                   content_type: Optional[str] = "application/json") -> Any:
+        if content_type and content_type not in self.content_type:
+            raise aiohttp.ContentTypeError(self.request_info, self.history, status=self.status,
+                                           message=f"Attempt to decode JSON with unexpected mimetype: "
+                                                   f"{self.content_type}", headers=self.headers)
+        return loads(self._body.decode(encoding or "utf-8"))
+
+    def release(self):
+        pass
+
+    def close(self):
+        pass
+
+    async def __aenter__(self) -> "ReplayedResponse":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class _ResponseContextManager:
+    """
+    Makes the result of TrafficClientSession.get() etc. both awaitable and usable with "async with", like aiohttp does.
+    """
+
+    def __init__(self, coro):
+        self._coro = coro
+        self._response = None
+
+    def __await__(self):
+        return self._coro.__await__()
+
+    async def __aenter__(self):
+        self._response = await self._coro
+        return await self._response.__aenter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self._response.__aexit__(exc_type, exc_val, exc_tb)
+
+
+class TrafficClientSession:
+    """
+    Drop-in replacement for aiohttp.ClientSession that records or replays all exchanges, depending on
+    REGISTRY_TRAFFIC_MODE. In "record" mode, the actual requests are delegated to a real aiohttp.ClientSession.
+    """
+
+    def __init__(self, **client_session_kwargs):
+        self._session: Optional[aiohttp.ClientSession] = None
+        if REGISTRY_TRAFFIC_MODE == "record":
+            self._session = aiohttp.ClientSession(**client_session_kwargs)
+            _get_recorder()  # opens the traffic file early, so that the recorded "t" offsets are never negative
+        self.headers = self._session.headers if self._session else CIMultiDict(client_session_kwargs.get("headers", {}))
+
+    @property
+    def closed(self) -> bool:
+        return self._session.closed if self._session else False
+
+    async def _request(self, method: str, str_or_url, *, params=None, raise_for_status=None, **kwargs):
+        url = _url_with_params(str_or_url, params)
+        if self._session is None:
+            exchange, body = _get_replayer().next_exchange(method, url)
+            if REGISTRY_TRAFFIC_REPLAY_LATENCY:
+                await asyncio.sleep(exchange["e"])
+            if "x" in exchange:
+                error_class = getattr(aiohttp, exchange["x"][0], None)
+                if not (isinstance(error_class, type) and issubclass(error_class, aiohttp.ClientConnectionError)):
+                    error_class = aiohttp.ClientConnectionError
+                raise error_class(exchange["x"][1])
+            response = ReplayedResponse(method, url, exchange["s"], exchange["h"], body)
+        else:
+            started = time.monotonic()
+            try:
+                response = await self._session.request(method, url, raise_for_status=False, **kwargs)
+                body = await response.read()  # the body is cached by aiohttp, so our caller can still read it
+            except aiohttp.ClientError as e:
+                _get_recorder().record(method, url, started, time.monotonic() - started, error=e)
+                raise
+            _get_recorder().record(method, url, started, time.monotonic() - started, status=response.status,
+                                   headers=list(response.headers.items()), body=body)
+
+        if callable(raise_for_status):
+            await raise_for_status(response)
+        elif raise_for_status:
+            response.raise_for_status()
+        return response
+
+    def request(self, method: str, url, **kwargs) -> _ResponseContextManager:
+        return _ResponseContextManager(self._request(method.upper(), url, **kwargs))
+
+    def get(self, url, **kwargs) -> _ResponseContextManager:
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs) -> _ResponseContextManager:
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs) -> _ResponseContextManager:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs) -> _ResponseContextManager:
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs) -> _ResponseContextManager:
+        return self.request("DELETE", url, **kwargs)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+    async def __aenter__(self) -> "TrafficClientSession":
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+
+def is_traffic_recording_or_replaying() -> bool:
+    return REGISTRY_TRAFFIC_MODE in ["record", "replay"]
+
+
+def create_client_session(**client_session_kwargs) -> aiohttp.ClientSession | TrafficClientSession:
+    """
+    Returns a regular aiohttp.ClientSession, or a TrafficClientSession if traffic is recorded or replayed.
+    """
+    if is_traffic_recording_or_replaying():
+        return TrafficClientSession(**client_session_kwargs)
+    return aiohttp.ClientSession(**client_session_kwargs)
+
+
+def create_registry_client(**registry_client_kwargs) -> DockerRegistryClientAsync:
+    """
+    Returns a new DockerRegistryClientAsync whose HTTP traffic is recorded or replayed, if configured.
+    """
+    if is_traffic_recording_or_replaying():
+        return DockerRegistryClientAsync(client_session=TrafficClientSession(),  # noqa (duck-typed ClientSession)
+                                         **registry_client_kwargs)
+    return DockerRegistryClientAsync(**registry_client_kwargs)
@@ -1,42 +1,108 @@
-import fnmatch
+import asyncio
 import re
 import time
-from dataclasses import dataclass
 from datetime import datetime
 from typing import Optional
 from zoneinfo import ZoneInfo
 
 import reflex as rx
-import requests
-from dateutil.relativedelta import relativedelta
 from docker_registry_client_async import ImageName
-from sqlalchemy import text
-from sqlmodel import select, func, col
+from sqlalchemy import text, case, or_, and_, TextClause
+from sqlmodel import select, func, col, update
 
+from .background_refresh import get_external_value
+from .cache import get_cached_search_results, set_cached_search_results, invalidate_search_cache
 from .components.utils import ImageUpdateAggregated, ImageUpdateGraphData, format_graph_labels, ImageToScrapeWithCount, \
-    DailyScanSummary, DailyScanDuration
-from .constants import NAMESPACE_AND_REPO, GITHUB_STARS_REFRESH_INTERVAL_SECONDS, \
-    MAX_DAILY_SCAN_ENTRIES_IN_GRAPH, IMAGE_LAST_VIEWED_UPDATE_THRESHOLD
-from .models import ImageToScrape, ImageUpdate
-from .utils import images_exists_in_registry, add_selected_tags_to_monitoring_db, get_additional_image_tags_to_monitor, \
-    TAGS_PER_IMAGE_MAX_COUNT, is_image_no_longer_scanned
+    DailyScanSummary, DailyScanDuration, ImageUpdateWithDigest, ImageReference, ImageTagField
+from .constants import DIGEST_TABLE_ITEMS_PER_PAGE, MAX_DAILY_SCAN_ENTRIES_IN_GRAPH, \
+    IMAGE_LAST_VIEWED_UPDATE_THRESHOLD, OVERVIEW_TOTAL_ITEMS_CACHE_SECONDS, DETAILS_PAGE_LIVE_UPDATE_MAX_DURATION
+from .details_snapshot import build_digest_table_page_query, build_details_snapshot, load_details_snapshot, \
+    load_details_snapshot_async, store_details_snapshot, get_details_snapshot_version, DetailsSnapshot
+from .db_routing import read_session, record_write
+from .digests import format_digest
+from .invalidation_bus import wait_for_image_change, CHANGE_TYPE_DELETED
+from .models import ImageToScrape
+from .parsing import parse_datetime
+from .tag_index import get_tag_index, invalidate_tag_index, TagIndex
+from .utils import images_exists_in_registry, add_selected_tags_to_monitoring_db, TAGS_PER_IMAGE_MAX_COUNT, \
+    is_image_no_longer_scanned
+
+
+overview_total_items = 0
+overview_total_items_last_refresh = -9999.9
+
+
+def get_overview_total_items(session, refresh: bool = False) -> int:
+    """
+    Returns the number of ImageToScrape rows, cached for OVERVIEW_TOTAL_ITEMS_CACHE_SECONDS seconds, because an exact
+    COUNT(*) is expensive for large tables and the value usually only needs to be approximately right (for the page
+    count). Set refresh to count the rows in any case, e.g. for the last page, whose row count is derived from it.
+    """
+    global overview_total_items
+    global overview_total_items_last_refresh
+
+    if not refresh and overview_total_items_last_refresh + OVERVIEW_TOTAL_ITEMS_CACHE_SECONDS > time.monotonic():
+        return overview_total_items
+
+    overview_total_items = session.exec(select(func.count(ImageToScrape.id))).one()
+    overview_total_items_last_refresh = time.monotonic()
+    return overview_total_items
+
+
+def build_overview_page_query(direction: str, first_item_key: Optional[tuple[int, int]],
+                              last_item_key: Optional[tuple[int, int]], items_per_page: int,
+                              total_items: int) -> tuple[TextClause, dict, str]:
+    """
+    Returns the query (and its parameters) for the "first", "prev", "next" or "last" page of the overview table, using
+    keyset (seek) pagination on the sort key (image_update_count DESC, id), which matches the
+    compound_index_image_update_count_id index. In contrast to OFFSET, Postgres does not have to compute and discard
+    the rows of all preceding pages. Also returns the effective direction ("first" if the given direction is not
+    possible). The rows of the "prev" and "last" pages are returned in reverse order.
+    """
+    # Note: we format the date already in SQL instead of doing it in Python, because otherwise Reflex would throw
+    # this error when trying to call strftime on the item["added_at"] datetime object:
+    # TypeError: You must provide an annotation for the state var `item["added_at"]`.
+    # Annotation cannot be `typing.Any`
+    where_clause = ""
+    order_by_clause = "image_update_count DESC, id"
+    args = {"limit": items_per_page}
+    if direction == "next" and last_item_key:
+        where_clause = "WHERE image_update_count <= :count AND (image_update_count < :count OR id > :id)"
+        args["count"], args["id"] = last_item_key
+    elif direction == "prev" and first_item_key:
+        # We scan backwards, and reverse the rows afterward
+        where_clause = "WHERE image_update_count >= :count AND (image_update_count > :count OR id < :id)"
+        order_by_clause = "image_update_count, id DESC"
+        args["count"], args["id"] = first_item_key
+    elif direction == "last":
+        order_by_clause = "image_update_count, id DESC"
+        args["limit"] = total_items % items_per_page or items_per_page
+    else:
+        direction = "first"
+
+    query = text(f"""SELECT id,
+                            image_update_count,
+                            endpoint,
+                            image,
+                            tag,
+                            TO_CHAR(added_at, 'YYYY-MM-DD') AS added_at
+                     FROM image_to_scrape
+                     {where_clause}
+                     ORDER BY {order_by_clause}
+                     LIMIT :limit;""")
+    return query, args, direction
 
 
 class OverviewTableState(rx.State):
     items: rx.Field[list[ImageToScrapeWithCount]] = rx.field(default_factory=list)
+    # (image_update_count, id) of the first and last item of the current page, used for keyset pagination
+    _first_item_key: Optional[tuple[int, int]] = None
+    _last_item_key: Optional[tuple[int, int]] = None
 
     total_items: int = 0
-    offset: int = 0
+    page_number: int = 1
     items_per_page: int = 12
 
-    @rx.var
-    def page_number(self) -> int:
-        return (
-                (self.offset // self.items_per_page)
-                + 1
-                + (1 if self.offset % self.items_per_page else 0)
-        )
-
     @rx.var
     def total_pages(self) -> int:
         return (self.total_items // self.items_per_page) + (
@@ -45,57 +111,55 @@ class OverviewTableState(rx.State):
 
     def prev_page(self):
         if self.page_number > 1:
-            self.offset -= self.items_per_page
-            self.load_data()
+            self.load_page("prev")
 
     def next_page(self):
         if self.page_number < self.total_pages:
-            self.offset += self.items_per_page
-            self.load_data()
+            self.load_page("next")
 
     def first_page(self):
-        self.offset = 0
-        self.load_data()
+        self.load_page("first")
 
     def last_page(self):
-        self.offset = (self.total_pages - 1) * self.items_per_page
-        self.load_data()
+        self.load_page("last")
 
     def load_data(self):
-        # Note: we format the date already in SQL instead of doing it in Python, because otherwise Reflex would throw
-        # this error when trying to call strftime on the item["added_at"] datetime object:
-        # TypeError: You must provide an annotation for the state var `item["added_at"]`.
-        # Annotation cannot be `typing.Any`
-        query = text("""SELECT image_to_scrape.endpoint,
-                               image_to_scrape.image,
-                               image_to_scrape.tag,
-                               TO_CHAR(image_to_scrape.added_at, 'YYYY-MM-DD') AS added_at,
-                               COUNT(image_update.id)                          AS image_update_count
-                        FROM image_to_scrape
-                                 LEFT JOIN
-                             image_update ON image_to_scrape.id = image_update.image_id
-                        GROUP BY image_to_scrape.endpoint, image_to_scrape.image, image_to_scrape.tag,
-                                 image_to_scrape.added_at
-                        ORDER BY image_update_count DESC LIMIT :limit
-                        OFFSET :offset;""")
-
-        args = {
-            "limit": self.items_per_page,
-            "offset": self.offset
-        }
-
-        with rx.session() as session:
-            self.items.clear()
-            for row in session.exec(query, params=args):
-                self.items.append(ImageToScrapeWithCount(
-                    endpoint=row[0],
-                    image=row[1],
-                    tag=row[2],
-                    added_at=row[3],
-                    image_update_count=row[4]
-                ))
-
-            self.total_items = session.exec(select(func.count(ImageToScrape.id))).one()
+        with read_session() as session:
+            self.total_items = get_overview_total_items(session)
+        self.load_page("first")
+
+    def load_page(self, direction: str):
+        """
+        Loads the "first", "prev", "next" or "last" page (see build_overview_page_query()).
+        """
+        with read_session(self.router.session.client_token) as session:
+            if direction == "last":
+                # The number of rows of the last page is derived from the total, which must therefore be up-to-date
+                self.total_items = get_overview_total_items(session, refresh=True)
+            query, args, direction = build_overview_page_query(direction, self._first_item_key, self._last_item_key,
+                                                               self.items_per_page, self.total_items)
+            rows = list(session.exec(query, params=args))
+
+        if direction in ["prev", "last"]:
+            rows.reverse()
+
+        if not rows and direction in ["prev", "next"]:
+            return  # the data changed in the meantime, so we simply stay on the current page
+
+        self.items = [ImageToScrapeWithCount(endpoint=row[2], image=row[3], tag=row[4], added_at=row[5],
+                                             image_update_count=row[1])
+                      for row in rows]
+        self._first_item_key = (rows[0][1], rows[0][0]) if rows else None
+        self._last_item_key = (rows[-1][1], rows[-1][0]) if rows else None
+
+        if direction == "first":
+            self.page_number = 1
+        elif direction == "last":
+            self.page_number = max(1, self.total_pages)
+        elif direction == "prev":
+            self.page_number -= 1
+        else:
+            self.page_number += 1
 
 
 TAG_PATTERN = re.compile(r'[a-zA-Z0-9_][a-zA-Z0-9._-]{0,127}')
@@ -129,6 +193,25 @@ POSTGRESQL_AGGREGATION_INTERVALS = {  # maps the "aggregation_interval" from the
 
 IMAGE_DETAILS_PATH_PREFIX = "/details/"
 
+# Maps the client token to the task of its running live update watcher (see ImageDetailsState.watch_image_changes()),
+# so that a new watcher of the same client (e.g. after navigating to another image) can stop the previous one
+_live_update_watchers: dict[str, asyncio.Task] = {}
+
+
+def rebuild_details_snapshot(image_id: int, endpoint: str, image: str, tag: str) -> Optional[DetailsSnapshot]:
+    """
+    Builds (and stores) the snapshot of the given image from the primary database, because the snapshot is stored for
+    all clients (see on_page_load()). Returns None if the image no longer exists.
+    """
+    version = get_details_snapshot_version(endpoint, image, tag)
+    with rx.session() as session:
+        image_to_scrape = session.get(ImageToScrape, image_id)
+        if image_to_scrape is None:
+            return None
+        snapshot = build_details_snapshot(session, image_to_scrape, version)
+    store_details_snapshot(snapshot)
+    return snapshot
+
 
 class ImageDetailsState(rx.State):
     error: bool = False
@@ -138,13 +221,19 @@ class ImageDetailsState(rx.State):
     updates_no_longer_scanned: bool = False
     image_to_scrape: Optional[ImageToScrape] = None
 
-    digest_items: rx.Field[list[ImageUpdate]] = rx.field(default_factory=list)
+    digest_items: rx.Field[list[ImageUpdateWithDigest]] = rx.field(default_factory=list)
+    # Maps "week"/"month" to the (interval start, update count) buckets of the image (see DetailsSnapshot)
+    _digest_update_buckets: dict[str, list[tuple[str, int]]] = {}
     _digest_updates_aggregated: list[ImageUpdateAggregated] = []  # not sent to the UI
     digest_updates_graph_data: rx.Field[list[ImageUpdateGraphData]] = rx.field(default_factory=list)
 
+    # (scraped_at, id) of the first and last digest item of the current page, used for keyset pagination
+    _first_digest_item_key: Optional[tuple[datetime, int]] = None
+    _last_digest_item_key: Optional[tuple[datetime, int]] = None
+
     total_items: int = 0
-    offset: int = 0
-    items_per_page: int = 12
+    page_number: int = 1
+    items_per_page: int = DIGEST_TABLE_ITEMS_PER_PAGE
     aggregation_interval: str = "weekly"  # or "monthly", but we cannot use Literal["weekly", "monthly"] in Reflex state
 
     @rx.var
@@ -157,14 +246,6 @@ class ImageDetailsState(rx.State):
         """
         return 35 * len(self.digest_updates_graph_data) + 60
 
-    @rx.var
-    def page_number(self) -> int:
-        return (
-                (self.offset // self.items_per_page)
-                + 1
-                + (1 if self.offset % self.items_per_page else 0)
-        )
-
     @rx.var
     def total_pages(self) -> int:
         return (self.total_items // self.items_per_page) + (
@@ -173,27 +254,60 @@ class ImageDetailsState(rx.State):
 
     def prev_page(self):
         if self.page_number > 1:
-            self.offset -= self.items_per_page
-            self.load_digest_table_data_for_page()
+            self.load_digest_table_page("prev")
 
     def next_page(self):
         if self.page_number < self.total_pages:
-            self.offset += self.items_per_page
-            self.load_digest_table_data_for_page()
+            self.load_digest_table_page("next")
 
     def first_page(self):
-        self.offset = 0
-        self.load_digest_table_data_for_page()
+        self.load_digest_table_page("first")
 
     def last_page(self):
-        self.offset = (self.total_pages - 1) * self.items_per_page
-        self.load_digest_table_data_for_page()
+        self.load_digest_table_page("last")
 
-    def load_digest_table_data_for_page(self):
-        with rx.session() as session:
-            select_query = select(ImageUpdate).where(ImageUpdate.image_id == self.image_to_scrape.id).offset(
-                self.offset).limit(self.items_per_page).order_by(ImageUpdate.scraped_at.desc())
-            self.digest_items = session.exec(select_query).all()
+    def load_digest_table_page(self, direction: str):
+        """
+        Loads the "first", "prev", "next" or "last" page of digests (see build_digest_table_page_query()).
+        """
+        with read_session(self.router.session.client_token) as session:
+            if direction == "last":
+                # The number of rows of the last page is derived from the total, but the shown image (snapshot) may be
+                # outdated
+                self.total_items = session.exec(select(ImageToScrape.image_update_count)
+                                                .where(ImageToScrape.id == self.image_to_scrape.id)).first() or 0
+            query, direction = build_digest_table_page_query(self.image_to_scrape.id, direction,
+                                                             self._first_digest_item_key, self._last_digest_item_key,
+                                                             self.items_per_page, self.total_items)
+            rows = session.exec(query).all()
+
+        if direction in ["prev", "last"]:
+            rows.reverse()
+
+        if not rows and direction in ["prev", "next"]:
+            return  # the data changed in the meantime, so we simply stay on the current page
+
+        self.set_digest_items([(image_update_id, scraped_at, format_digest(algorithm, hash_bytes))
+                               for image_update_id, scraped_at, algorithm, hash_bytes in rows])
+
+        if direction == "first":
+            self.page_number = 1
+        elif direction == "last":
+            self.page_number = max(1, self.total_pages)
+        elif direction == "prev":
+            self.page_number -= 1
+        else:
+            self.page_number += 1
+
+    def set_digest_items(self, rows: list[tuple[int, datetime, str]]):
+        """
+        Sets the digest table items from (ImageUpdate.id, scraped_at, digest) rows, sorted by scraped_at (descending).
+        """
+        # Note: we convert scraped_at to str the same way Reflex would serialize a datetime
+        self.digest_items = [ImageUpdateWithDigest(scraped_at=str(scraped_at), digest=digest)
+                             for _, scraped_at, digest in rows]
+        self._first_digest_item_key = (rows[0][1], rows[0][0]) if rows else None
+        self._last_digest_item_key = (rows[-1][1], rows[-1][0]) if rows else None
 
     def change_aggregation_interval(self, new_interval: str):
         assert new_interval in ["weekly", "monthly"]
@@ -201,59 +315,20 @@ class ImageDetailsState(rx.State):
         self.load_digests_updates_graph_data()
 
     def load_digests_updates_graph_data(self):
-        # should always be the case, but we better check, to avoid SQL injections
+        # should always be the case, but we better check
         if self.aggregation_interval in POSTGRESQL_AGGREGATION_INTERVALS:
             self._digest_updates_aggregated.clear()
             self.digest_updates_graph_data.clear()
 
-            query = text("""SELECT DATE_TRUNC(:aggregation_interval, scraped_at) AS interval_start,
-                                   COUNT(*)                                      AS item_count
-                            FROM image_update
-                            WHERE image_id = :image_id
-                            GROUP BY interval_start
-                            ORDER BY interval_start DESC;""")
-
+            # Note: the buckets already contain zero-count entries for intervals without updates
             postgresql_aggregation_interval = POSTGRESQL_AGGREGATION_INTERVALS[self.aggregation_interval]
-            args = {
-                "aggregation_interval": postgresql_aggregation_interval,
-                "image_id": self.image_to_scrape.id
-            }
-
-            with rx.session() as session:
-                for row in session.exec(query, params=args):
-                    # Note: row[0] is a datetime object representing the interval start, row[1] is the count as int
-                    self._digest_updates_aggregated.append(ImageUpdateAggregated(interval_start=row[0], count=row[1]))
+            for interval_start, count in self._digest_update_buckets.get(postgresql_aggregation_interval, []):
+                self._digest_updates_aggregated.append(
+                    ImageUpdateAggregated(interval_start=parse_datetime(interval_start), count=count))
 
-            self.fill_missing_intervals()
             self.digest_updates_graph_data = format_graph_labels(self._digest_updates_aggregated,
                                                                  self.aggregation_interval)
 
-    def fill_missing_intervals(self):
-        if len(self._digest_updates_aggregated) < 2:
-            return
-
-        start_date = self._digest_updates_aggregated[-1]["interval_start"]
-        end_date = self._digest_updates_aggregated[0]["interval_start"]
-
-        # Create a set of existing interval_start dates to simplify the lookup
-        existing_dates = {update["interval_start"] for update in self._digest_updates_aggregated}
-
-        # Iterate through each week in the range
-        current_date = start_date
-        while current_date <= end_date:
-            if current_date not in existing_dates:
-                self._digest_updates_aggregated.append(ImageUpdateAggregated(interval_start=current_date, count=0))
-
-            if self.aggregation_interval == "weekly":
-                current_date += relativedelta(weeks=1)
-            elif self.aggregation_interval == "monthly":
-                current_date += relativedelta(months=1)
-            else:
-                raise ValueError(f"Unknown aggregation interval: {self.aggregation_interval}")
-
-        # Sort the list again by interval_start
-        self._digest_updates_aggregated.sort(key=lambda update: update["interval_start"], reverse=True)
-
     async def on_page_load(self):
         # Reset vars to default
         self.error = False
@@ -263,6 +338,7 @@ class ImageDetailsState(rx.State):
         self.updates_no_longer_scanned = False
         self.image_to_scrape = None
         self.digest_items.clear()
+        self._digest_update_buckets = {}
         self._digest_updates_aggregated.clear()
         self.digest_updates_graph_data.clear()
 
@@ -291,66 +367,127 @@ class ImageDetailsState(rx.State):
             resolved_image = image_name.resolve_image()
             resolved_tag = image_name.resolve_tag()
 
-            with rx.session() as session:
+            # Serve the page from the precomputed snapshot, which avoids all database queries for popular images
+            snapshot = load_details_snapshot(resolved_registry, resolved_image, resolved_tag)
+            if snapshot is None:
+                version = get_details_snapshot_version(resolved_registry, resolved_image, resolved_tag)
                 query = select(ImageToScrape).where(ImageToScrape.endpoint == resolved_registry,
                                                     ImageToScrape.image == resolved_image,
                                                     ImageToScrape.tag == resolved_tag)
-                image_to_scrape: Optional[ImageToScrape] = session.exec(query).first()
-                if image_to_scrape is None:
-                    if not await images_exists_in_registry([image_name]):
-                        self.non_existent_image = True
+                # The snapshot is shared by all clients (until the scraper changes the image, or for at most
+                # DETAILS_SNAPSHOT_TTL), so it is built from the primary database, never from a lagging read replica
+                with rx.session() as session:
+                    image_to_scrape: Optional[ImageToScrape] = session.exec(query).first()
+                    if image_to_scrape is None:
+                        if not await images_exists_in_registry([image_name]):
+                            self.non_existent_image = True
+                            return
+
+                        image_to_scrape = ImageToScrape(
+                            endpoint=resolved_registry,
+                            image=resolved_image,
+                            tag=resolved_tag,
+                        )
+                        session.add(image_to_scrape)
+                        session.commit()
+                        session.refresh(image_to_scrape)  # ensures that the ".id" of image_to_scrape is populated
+                        record_write(self.router.session.client_token)
+                        invalidate_search_cache()
+
+                        self.image_to_scrape = image_to_scrape
+
+                        self.not_found = True
                         return
 
-                    image_to_scrape = ImageToScrape(
-                        endpoint=resolved_registry,
-                        image=resolved_image,
-                        tag=resolved_tag,
-                    )
-                    session.add(image_to_scrape)
-                    session.commit()
-                    session.refresh(image_to_scrape)  # ensures that the ".id" field of image_to_scrape is populated
+                    snapshot = build_details_snapshot(session, image_to_scrape, version)
+                store_details_snapshot(snapshot)
 
-                    self.image_to_scrape = image_to_scrape
+            self.page_number = 1
+            self.apply_details_snapshot(snapshot)
 
-                    self.not_found = True
-                    return
+            if self.total_items == 0:
+                self.not_found = True
+                return
 
-                self.image_to_scrape = image_to_scrape
+            now = datetime.now(ZoneInfo('UTC'))
+            last_viewed_age = now - self.image_to_scrape.last_viewed
+            if last_viewed_age > IMAGE_LAST_VIEWED_UPDATE_THRESHOLD:
+                self.image_to_scrape.last_viewed = now
+                with rx.session() as session:
+                    session.exec(update(ImageToScrape).where(ImageToScrape.id == self.image_to_scrape.id)
+                                 .values(last_viewed=now))
+                    session.commit()
+                record_write(self.router.session.client_token)
+                snapshot["image"] = self.image_to_scrape.model_dump(mode="json")
+                store_details_snapshot(snapshot)
+        finally:
+            self.loading = False
 
-                count_query = select(func.count(ImageUpdate.id)).where(ImageUpdate.image_id == self.image_to_scrape.id)
-                self.total_items = session.exec(count_query).one()
+    def apply_details_snapshot(self, snapshot: DetailsSnapshot):
+        self.image_to_scrape = ImageToScrape.model_validate(snapshot["image"])
+        self.total_items = self.image_to_scrape.image_update_count
+        self.updates_no_longer_scanned = is_image_no_longer_scanned(self.image_to_scrape)
 
-                if self.total_items == 0:
-                    self.not_found = True
-                    return
+        self._digest_update_buckets = snapshot["buckets"]
+        self.load_digests_updates_graph_data()
 
-                now = datetime.now(ZoneInfo('UTC'))
-                last_viewed_age = now - self.image_to_scrape.last_viewed
-                if last_viewed_age > IMAGE_LAST_VIEWED_UPDATE_THRESHOLD:
-                    self.image_to_scrape.last_viewed = now
-                    session.add(self.image_to_scrape)
-                    session.commit()
+        # Other pages of the digest table are kept as they are (their keyset pagination still works)
+        if self.page_number == 1:
+            self.set_digest_items([(image_update_id, parse_datetime(scraped_at), digest)
+                                   for image_update_id, scraped_at, digest in snapshot["first_page"]])
 
-                self.updates_no_longer_scanned = is_image_no_longer_scanned(self.image_to_scrape)
+    @rx.event(background=True)
+    async def watch_image_changes(self):
+        """
+        Refreshes the page whenever the scraper changes the shown image (see invalidation_bus.py), for at most
+        DETAILS_PAGE_LIVE_UPDATE_MAX_DURATION, or until the client navigates to another page. Runs after on_page_load().
+        """
+        async with self:
+            if self.image_to_scrape is None:
+                return
+            image_id = self.image_to_scrape.id
+            endpoint, image, tag = self.image_to_scrape.endpoint, self.image_to_scrape.image, self.image_to_scrape.tag
+            path = self.router.url.path
+            client_token = self.router.session.client_token
+
+        # Stops the watcher of the previously loaded page (of this or another image)
+        task = asyncio.current_task()
+        previous_task = _live_update_watchers.get(client_token)
+        if previous_task is not None and previous_task is not task:
+            previous_task.cancel()
+        _live_update_watchers[client_token] = task
 
-                self.load_digests_updates_graph_data()
+        try:
+            deadline = time.monotonic() + DETAILS_PAGE_LIVE_UPDATE_MAX_DURATION.total_seconds()
+            while (remaining_seconds := deadline - time.monotonic()) > 0:
+                change_type = await wait_for_image_change(endpoint, image, tag, timeout=remaining_seconds)
+                if change_type is None:
+                    return
 
-            self.load_digest_table_data_for_page()
+                # Loads the data without holding the state lock. The scraper rebuilds the existing snapshots of
+                # changed images before it notifies us, so the (blocking) rebuild in a thread is rarely needed
+                snapshot = None
+                if change_type != CHANGE_TYPE_DELETED:
+                    snapshot = await load_details_snapshot_async(endpoint, image, tag)
+                    if snapshot is None:
+                        snapshot = await asyncio.to_thread(rebuild_details_snapshot, image_id, endpoint, image, tag)
+
+                async with self:
+                    if self.router.url.path != path:
+                        return  # the client navigated to another page
+                    if change_type == CHANGE_TYPE_DELETED:
+                        return [ImageDetailsState.on_page_load, ImageDetailsState.watch_image_changes]
+                    if snapshot is not None:
+                        self.apply_details_snapshot(snapshot)
+                        self.not_found = self.total_items == 0
         finally:
-            self.loading = False
-
-
-@dataclass
-class ImageTagField:
-    tag: str
-    can_add_to_monitoring_db: bool
-    checked: bool
+            if _live_update_watchers.get(client_token) is task:
+                del _live_update_watchers[client_token]
 
 
 class AddAdditionalTagsState(rx.State):
     view_state: str = "show_button"  # alternatives: "show_form", "show_result"
     loading: bool = False
-    _image_tags: list[tuple[str, bool]] = []
     shown_image_tag_fields: rx.Field[list[ImageTagField]] = rx.field(default_factory=list)
     select_unselect_all_checked: bool = True
     extra_search_result_count: int = 0
@@ -362,41 +499,33 @@ class AddAdditionalTagsState(rx.State):
         self.loading = True
         yield  # immediately update the UI
 
-        if not self._image_tags:
-            image_details_state: ImageDetailsState = await self.get_state(ImageDetailsState)
-            image_name = ImageName.parse(f"{image_details_state.image_to_scrape.endpoint}/"
-                                         f"{image_details_state.image_to_scrape.image}:"
-                                         f"{image_details_state.image_to_scrape.tag}")
-            try:
-                self._image_tags = await get_additional_image_tags_to_monitor(image_name)
+        image_details_state: ImageDetailsState = await self.get_state(ImageDetailsState)
+        image_name = ImageName.parse(f"{image_details_state.image_to_scrape.endpoint}/"
+                                     f"{image_details_state.image_to_scrape.image}:"
+                                     f"{image_details_state.image_to_scrape.tag}")
+        try:
+            tag_index = await get_tag_index(image_name)
+            if self.view_state == "show_button":
                 self.view_state = "show_form"
-            except Exception as e:
-                self.error = str(e)
-                self._image_tags.clear()
-
-        if self.search_string:
-            if '*' in self.search_string or '?' in self.search_string:
-
-                matching_image_tag_fields = [ImageTagField(tag=itf[0], can_add_to_monitoring_db=itf[1], checked=True)
-                                             for itf in self._image_tags if
-                                             fnmatch.fnmatch(itf[0], self.search_string)]
-            else:
-                matching_image_tag_fields = [ImageTagField(tag=itf[0], can_add_to_monitoring_db=itf[1], checked=True)
-                                             for itf in self._image_tags if self.search_string in itf[0]]
-
-            self.shown_image_tag_fields = matching_image_tag_fields[:TAGS_PER_IMAGE_MAX_COUNT]
-            self.extra_search_result_count = max(0, len(matching_image_tag_fields) - TAGS_PER_IMAGE_MAX_COUNT)
-        else:
-            self.shown_image_tag_fields = [ImageTagField(tag=itf[0], can_add_to_monitoring_db=itf[1], checked=True)
-                                           for itf in self._image_tags[:TAGS_PER_IMAGE_MAX_COUNT]]
-            self.extra_search_result_count = max(0, len(self._image_tags) - TAGS_PER_IMAGE_MAX_COUNT)
+        except Exception as e:
+            self.error = str(e)
+            tag_index = TagIndex([])
+
+        # We don't want to show the tag of `image_name`, because that is the tag whose details page
+        # the user currently looks at (so it is obviously already monitored). So we exclude it:
+        matching_image_tags, match_count = tag_index.search(self.search_string, excluded_tag=image_name.tag,
+                                                            limit=TAGS_PER_IMAGE_MAX_COUNT)
+        self.shown_image_tag_fields = [ImageTagField(tag=tag, can_add_to_monitoring_db=can_add_to_monitoring_db,
+                                                     checked=True)
+                                       for tag, can_add_to_monitoring_db in matching_image_tags]
+        self.extra_search_result_count = match_count - len(matching_image_tags)
 
         self.loading = False
 
     @rx.event
     async def handle_submit(self, _form_data: dict):
-        selected_additional_tags = [itf.tag for itf in self.shown_image_tag_fields if
-                                    itf.checked and itf.can_add_to_monitoring_db]
+        selected_additional_tags = [itf["tag"] for itf in self.shown_image_tag_fields if
+                                    itf["checked"] and itf["can_add_to_monitoring_db"]]
         self.loading = True
 
         yield
@@ -409,8 +538,10 @@ class AddAdditionalTagsState(rx.State):
 
         try:
             await add_selected_tags_to_monitoring_db(image_name, selected_additional_tags)
+            record_write(self.router.session.client_token)
         except ValueError as e:
             self.error = str(e)
+        invalidate_tag_index(image_name)  # the monitoring state of the selected tags has changed
 
         self.view_state = "show_result"
 
@@ -428,21 +559,56 @@ class AddAdditionalTagsState(rx.State):
     async def on_check_all(self, checked: bool):
         self.select_unselect_all_checked = checked
         for itf in self.shown_image_tag_fields:
-            if itf.can_add_to_monitoring_db:
-                itf.checked = checked
+            if itf["can_add_to_monitoring_db"]:
+                itf["checked"] = checked
 
     @rx.event
     async def set_checkbox(self, index: int, checked: bool):
-        self.shown_image_tag_fields[index].checked = checked
+        self.shown_image_tag_fields[index]["checked"] = checked
         # If all checkboxes are ticked, also set selected_additional_tags to True
-        self.select_unselect_all_checked = all([itf.checked for itf in self.shown_image_tag_fields])
+        self.select_unselect_all_checked = all([itf["checked"] for itf in self.shown_image_tag_fields])
+
+
+def build_image_search_query(image_name: ImageName, limit: int = 5):
+    """
+    Returns a query for the (endpoint, image, tag) of the ImageToScrape rows whose endpoint, image and tag contain the
+    respective parts of the (not necessarily complete) image_name, ranked by relevance: exact matches of the image
+    (and tag) come first, followed by image (and tag) prefix matches, and the remaining rows ordered by their trigram
+    similarity to the search term.
+
+    The "contains" filters (LIKE '%...%') are served by the pg_trgm GIN indexes of the image and tag columns.
+    """
+    # Note: we use image_name.image (in addition to resolve_image()) because the latter would turn "foo"
+    # to "library/foo" and thus the search would fail to find (existing) images such as "library/afoo"
+    image_candidates = [image_name.image, image_name.resolve_image()]
+    full_name = col(ImageToScrape.endpoint) + "/" + col(ImageToScrape.image) + ":" + col(ImageToScrape.tag)
+    search_term = f"{image_name.resolve_endpoint()}/{image_name.resolve_image()}:{image_name.tag or ''}"
+
+    query = select(ImageToScrape.endpoint, ImageToScrape.image, ImageToScrape.tag).where(
+        col(ImageToScrape.endpoint).contains(image_name.resolve_endpoint()),
+        col(ImageToScrape.image).contains(image_name.image),
+    )
+    is_prefix_match = or_(*[col(ImageToScrape.image).startswith(image) for image in image_candidates])
+
+    if image_name.tag:
+        query = query.where(col(ImageToScrape.tag).contains(image_name.tag))
+        is_prefix_match = and_(is_prefix_match, col(ImageToScrape.tag).startswith(image_name.tag))
+
+    is_exact_match = and_(col(ImageToScrape.image).in_(image_candidates),
+                          ImageToScrape.tag == image_name.resolve_tag())
+
+    return query.order_by(
+        case((is_exact_match, 0), (is_prefix_match, 1), else_=2),
+        func.similarity(full_name, search_term).desc(),
+        ImageToScrape.id,
+    ).limit(limit)
 
 
 class SearchState(rx.State):
     search_string: str = ""
     error: bool = False
     unknown_image: bool = False
-    search_results: rx.Field[list[ImageToScrape]] = rx.field(default_factory=list)
+    search_results: rx.Field[list[ImageReference]] = rx.field(default_factory=list)
 
     def clear_search(self):
         self.validate_and_search("")
@@ -464,57 +630,53 @@ class SearchState(rx.State):
             self.error = True
             return
 
-        with rx.session() as session:
-            # Note: we use image_name.image (instead of resolve_image()) because the latter would turn "foo"
-            # to "library/foo" and thus the search would fail to find (existing) images such as "library/afoo"
-            query = select(ImageToScrape).where(
-                col(ImageToScrape.endpoint).contains(image_name.resolve_endpoint()),
-                col(ImageToScrape.image).contains(image_name.image),
-            )
-
-            if image_name.tag:
-                query = query.where(col(ImageToScrape.tag).contains(image_name.tag))
-
-            query = query.limit(5)
-
-            self.search_results = session.exec(query).all()
-
-            if not self.search_results:
-                self.unknown_image = True
-
+        # Note: the key must contain image_name.image (not resolve_image()), see build_image_search_query()
+        search_key = f"{image_name.resolve_endpoint()}/{image_name.image}:{image_name.tag or ''}"
+        cached_search_results = get_cached_search_results(search_key)
+        if cached_search_results is not None:
+            self.search_results = cached_search_results
+        else:
+            with read_session(self.router.session.client_token) as session:
+                self.search_results = [ImageReference(endpoint=endpoint, image=image, tag=tag) for endpoint, image, tag
+                                       in session.exec(build_image_search_query(image_name)).all()]
+            set_cached_search_results(search_key, self.search_results)
 
-github_stars = ""
-github_starts_last_refresh = -9999.9
+        if not self.search_results:
+            self.unknown_image = True
 
 
 class NavbarState(rx.State):
 
-    @rx.var
+    @rx.var(cache=False)
     def github_stars(self) -> str:
         """
-        Refreshes the GitHub stars count every GITHUB_STARS_REFRESH_INTERVAL_SECONDS seconds (to avoid GitHub API
-        throttling).
+        Returns the GitHub stars count, which is refreshed in the background (see background_refresh.py), because
+        fetching it here would block the event loop of the worker process. Not cached, so that every hydration (e.g.
+        page load) returns the latest refreshed value (reading it is cheap).
         """
-        global github_stars
-        global github_starts_last_refresh
-
-        if github_starts_last_refresh + GITHUB_STARS_REFRESH_INTERVAL_SECONDS > time.monotonic():
-            return github_stars
-
-        github_starts_last_refresh = time.monotonic()
-
-        try:
-            response = requests.get(f"https://api.github.com/repos/{NAMESPACE_AND_REPO}")
-            data = response.json()
-            github_stars_from_resp: int = data["stargazers_count"]
-
-            if github_stars_from_resp >= 1000:
-                github_stars = f"{github_stars_from_resp / 1000:.1f}K"  # turns e.g. 1234 into 1.2K
-            github_stars = str(github_stars_from_resp)
-        except Exception:
-            pass
-
-        return github_stars
+        return get_external_value("github_stars")
+
+
+# Retrieves the last :limit days of the daily rollup of the BackgroundJobExecution objects (filling gaps with zeros),
+# returning one row per day, with the columns:
+# - the day
+# - number of BackgroundJobExecutions where failed_queries is 0 and successful_queries > 0
+# - number of BackgroundJobExecutions where either successful_queries is 0 or failed_queries > 0
+# - the average duration (seconds) of the BackgroundJobExecutions
+DAILY_SCAN_SUMMARY_QUERY = text("""WITH bounds AS (SELECT MIN(day) AS first_day, MAX(day) AS last_day
+                                                   FROM job_execution_daily),
+                                        date_series AS (SELECT generate_series(
+                                                                       GREATEST(first_day, last_day - (:limit - 1)),
+                                                                       last_day, INTERVAL '1 day')::date AS day
+                                                        FROM bounds)
+                                   SELECT date_series.day,
+                                          COALESCE(daily.successful_scans, 0),
+                                          COALESCE(daily.failed_scans, 0),
+                                          COALESCE(daily.total_duration_seconds /
+                                                   NULLIF(daily.successful_scans + daily.failed_scans, 0), 0)
+                                   FROM date_series
+                                            LEFT JOIN job_execution_daily AS daily ON daily.day = date_series.day
+                                   ORDER BY date_series.day DESC""")
 
 
 class StatusState(rx.State):
@@ -525,59 +687,14 @@ class StatusState(rx.State):
         self.daily_scan_summary_graph_data.clear()
         self.daily_scan_duration_graph_data.clear()
 
-        # Retrieve the aggregation of BackgroundJobExecution objects, returning one row per day, with the columns:
-        # -  the day
-        # - number of BackgroundJobExecutions where failed_queries is 0 and successful_queries > 0
-        # - number of BackgroundJobExecutions where either successful_queries is 0 or failed_queries > 0
-        summary_query = text("""WITH date_series AS (SELECT generate_series(
-                                                                    (SELECT MIN(DATE_TRUNC('day', started))
-                                                                     FROM background_job_execution),
-                                                                    (SELECT MAX(DATE_TRUNC('day', started))
-                                                                     FROM background_job_execution),
-                                                                    '1 day'::interval
-                                                            ) ::date AS day
-                                    )
-        SELECT date_series.day,
-               COALESCE(SUM(CASE
-                                WHEN background_job_execution.failed_queries = 0 AND
-                                     background_job_execution.successful_queries > 0 THEN 1
-                                ELSE 0 END), 0) AS successful_scans,
-               COALESCE(SUM(CASE
-                                WHEN background_job_execution.successful_queries = 0 OR
-                                     background_job_execution.failed_queries > 0 THEN 1
-                                ELSE 0 END), 0) AS failed_scans
-        FROM date_series
-                 LEFT JOIN background_job_execution ON
-            DATE_TRUNC('day', background_job_execution.started) = date_series.day
-        GROUP BY date_series.day
-        ORDER BY date_series.day DESC LIMIT :limit""")
-
-        scan_duration_query = text("""WITH date_series AS (SELECT generate_series(
-                                                                          (SELECT MIN(DATE (started)) FROM background_job_execution),
-                                                                          (SELECT MAX(DATE (completed)) FROM background_job_execution),
-                                                                          INTERVAL '1 day'
-                                                                  ) ::date AS execution_date)
-                                      SELECT ds.execution_date,
-                                             COALESCE(AVG(EXTRACT(EPOCH FROM (bje.completed - bje.started))),
-                                                      0) AS average_duration_seconds
-                                      FROM date_series ds
-                                               LEFT JOIN
-                                           background_job_execution bje ON DATE (bje.started) = ds.execution_date
-                                      GROUP BY ds.execution_date
-                                      ORDER BY ds.execution_date DESC
-                                          LIMIT :limit""")
-
-        with rx.session() as session:
-            for row in session.exec(summary_query, params={"limit": MAX_DAILY_SCAN_ENTRIES_IN_GRAPH}):
-                # Note: row[0] is a date object representing the day, row[1] and [2] are the successful/failed scans
-                daily_scan_summary = DailyScanSummary(date=str(row[0]), successful_scans=row[1], failed_scans=row[2])
-                self.daily_scan_summary_graph_data.append(daily_scan_summary)
-
-            for row in session.exec(scan_duration_query, params={"limit": MAX_DAILY_SCAN_ENTRIES_IN_GRAPH}):
-                # Note: row[0] is a date object representing the day, row[1] is the
-                # duration (seconds) returned as Decimal object, which we need to convert to float
-                daily_scan_duration = DailyScanDuration(date=str(row[0]), duration_minutes=float(row[1] / 60))
-                self.daily_scan_duration_graph_data.append(daily_scan_duration)
+        with read_session() as session:
+            for day, successful_scans, failed_scans, duration_seconds in session.exec(
+                    DAILY_SCAN_SUMMARY_QUERY, params={"limit": MAX_DAILY_SCAN_ENTRIES_IN_GRAPH}):
+                # Note: day is a date object
+                self.daily_scan_summary_graph_data.append(
+                    DailyScanSummary(date=str(day), successful_scans=successful_scans, failed_scans=failed_scans))
+                self.daily_scan_duration_graph_data.append(
+                    DailyScanDuration(date=str(day), duration_minutes=float(duration_seconds) / 60))
 
         self.daily_scan_summary_graph_data.reverse()
         self.daily_scan_duration_graph_data.reverse()
@@ -0,0 +1,114 @@
+"""
+Per-repository index of all tags (and whether they are already monitored), used by the "add more tags" form.
+
+The index is shared by all client sessions of a worker process (instead of storing the tags in the state of each
+session), so that a repository with many thousands of tags is only loaded (and kept in memory) once, and searching it
+does not require (de-)serializing the tag list on every keystroke.
+"""
+import asyncio
+import fnmatch
+import functools
+import os
+import re
+import time
+from itertools import islice
+from typing import Callable, Iterator
+
+import durationpy
+from docker_registry_client_async import ImageName
+
+from docker_tag_monitor.cache import LruCache
+from docker_tag_monitor.invalidation_bus import ImageChange, CHANGE_TYPE_CREATED, CHANGE_TYPE_DELETED, \
+    CHANGE_TYPE_RESYNC
+from docker_tag_monitor.utils import get_image_tags_with_monitoring_state
+
+TAG_INDEX_TTL = durationpy.from_str(os.getenv("TAG_INDEX_TTL", "5m"))
+"""
+For how long the tag index of a repository is reused before it is rebuilt (which picks up new tags and changes of the
+monitoring state made by other worker processes).
+"""
+TAG_INDEX_MAX_REPOSITORIES = int(os.getenv("TAG_INDEX_MAX_REPOSITORIES", "100"))
+"""
+Maximum number of repositories whose tag index is kept in memory (per worker process).
+"""
+
+
+@functools.lru_cache(maxsize=1000)
+def compile_tag_filter(search_string: str) -> Callable[[str], bool]:
+    """
+    Returns a predicate that checks whether a tag matches the search string, which is either a glob pattern (if it
+    contains "*" or "?") or a substring.
+    """
+    if '*' in search_string or '?' in search_string:
+        return re.compile(fnmatch.translate(search_string)).match
+    return lambda tag: search_string in tag
+
+
+class TagIndex:
+    def __init__(self, image_tags: list[tuple[str, bool]]):
+        self.image_tags = image_tags  # (tag, can be added to the monitoring DB), in the order returned by the registry
+        self.created_at = time.monotonic()
+
+    def is_expired(self) -> bool:
+        return self.created_at + TAG_INDEX_TTL.total_seconds() < time.monotonic()
+
+    def _iterate_matches(self, search_string: str, excluded_tag: str) -> Iterator[tuple[str, bool]]:
+        tag_filter = compile_tag_filter(search_string) if search_string else None
+        for image_tag in self.image_tags:
+            tag = image_tag[0]
+            if tag != excluded_tag and (tag_filter is None or tag_filter(tag)):
+                yield image_tag
+
+    def search(self, search_string: str, excluded_tag: str, limit: int) -> tuple[list[tuple[str, bool]], int]:
+        """
+        Returns the first `limit` (tag, can be added to the monitoring DB) tuples whose tag matches the search string
+        (all tags, if it is empty), and the total number of matches.
+        """
+        matches = self._iterate_matches(search_string, excluded_tag)
+        first_matches = list(islice(matches, limit))
+        return first_matches, len(first_matches) + sum(1 for _ in matches)
+
+
+_tag_indexes = LruCache(TAG_INDEX_MAX_REPOSITORIES)
+_tag_index_builds: dict[tuple[str, str], asyncio.Future] = {}
+
+
+async def get_tag_index(image_name: ImageName) -> TagIndex:
+    """
+    Returns the (cached) tag index of the image's repository. Concurrent requests for the same repository share one
+    build of the index.
+    """
+    key = (image_name.endpoint, image_name.image)
+    tag_index = _tag_indexes.get(key)
+    if tag_index is not None and not tag_index.is_expired():
+        return tag_index
+
+    build = _tag_index_builds.get(key)
+    if build is None:
+        async def build_tag_index() -> TagIndex:
+            try:
+                new_tag_index = TagIndex(await get_image_tags_with_monitoring_state(image_name))
+                _tag_indexes.set(key, new_tag_index)
+                return new_tag_index
+            finally:
+                del _tag_index_builds[key]
+
+        build = _tag_index_builds[key] = asyncio.ensure_future(build_tag_index())
+
+    return await asyncio.shield(build)
+
+
+def invalidate_tag_index(image_name: ImageName):
+    _tag_indexes.delete((image_name.endpoint, image_name.image))
+
+
+def handle_image_change(change: ImageChange):
+    """
+    Handler of the invalidation bus (see invalidation_bus.py) that drops the tag indexes of the repositories whose
+    monitored tags were changed by the scraper.
+    """
+    if change.change_type == CHANGE_TYPE_RESYNC:
+        _tag_indexes.clear()
+    elif change.change_type in (CHANGE_TYPE_CREATED, CHANGE_TYPE_DELETED):
+        for endpoint, image in {(endpoint, image) for _, endpoint, image, _ in change.images}:
+            _tag_indexes.delete((endpoint, image))
@@ -1,157 +1,93 @@
 import asyncio
-import base64
 import logging
 import os
-import re
 from datetime import datetime, timedelta
 from typing import Optional
 from zoneinfo import ZoneInfo
 
 import durationpy
 import reflex as rx
-from aiohttp import ContentTypeError, ClientResponseError
-from docker_registry_client_async import ImageName, DockerRegistryClientAsync
+from asynciolimiter import Limiter
+from docker_registry_client_async import ImageName
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert
 from sqlmodel import col, select
 
+from docker_tag_monitor.cache import invalidate_search_cache
 from docker_tag_monitor.models import ImageToScrape
+from docker_tag_monitor.registry import configure_and_reset_client, images_exists_in_registry, contains_digest, \
+    get_all_image_tags, get_shared_registry_client, image_exists_in_registry
 
 logger = logging.getLogger("DockerTagMonitor-Utils")
 
 TAGS_PER_IMAGE_MAX_COUNT = 50
 
 
-async def configure_and_reset_client(registry_client: DockerRegistryClientAsync):
-    # Add Docker Hub credentials, if provided via environment variables
-    username = os.getenv("DOCKERHUB_USERNAME")
-    password = os.getenv("DOCKERHUB_PASSWORD")
-    # Note: from various experiments, since we just perform HEAD requests to Docker Hub, it seems that there is no
-    # ratelimit-related difference between using an account, or being anonymous
-    if username and password:
-        b64_credentials = base64.b64encode(f"{username}:{password}".encode("ascii")).decode("ascii")
-        await registry_client.add_credentials(credentials=b64_credentials, endpoint="https://index.docker.io/")
-
-    registry_client.tokens.clear()  # do the reset first, otherwise it would undo the configuration done next
-    # Add compatibility for Chainguard's registry, whose auth endpoint does not return Content-Type: application/json
-    # but "text/plain", which would cause an aiohttp.ContentTypeError within the docker_registry_client_async library.
-    # By setting the value to an empty string, the aiohttp client's json() method WON'T check the content type at all.
-    await registry_client.add_auth_token_json_kwargs(
-        endpoint="cgr.dev", json_kwargs={"content_type": ""}
-    )
-
-
-async def images_exists_in_registry(image_names: list[ImageName]) -> bool:
-    async with DockerRegistryClientAsync() as registry_client:
-        await configure_and_reset_client(registry_client)
-        try:
-            for image_name in image_names:
-                result = await registry_client.head_manifest(image_name)
-                if not result.result:
-                    return False
-        except Exception as e:
-            return False
+KNOWN_TAGS_MAX_AGE: timedelta = durationpy.from_str(os.getenv("KNOWN_TAGS_MAX_AGE", "6h"))
+"""
+Maximum age of the tags that the scraper stored in ScrapedImage.known_tags, for them to be shown in the "add more
+tags" form. If the stored tags are older (or missing), the tags are retrieved from the registry instead.
+"""
+
+BULK_ADD_MAX_REQUESTS_PER_SECOND = float(os.getenv("BULK_ADD_MAX_REQUESTS_PER_SECOND", "2"))
+"""
+Maximum rate (per worker process) of the registry requests that check whether the images queued by the bulk
+statistics endpoint of the API exist (see add_existing_images_to_monitoring_db()). These requests use the web
+backend's registry credentials (and thus its rate limit), so anonymous API clients must not be able to exhaust them.
+"""
+BULK_ADD_MAX_PENDING_IMAGES = int(os.getenv("BULK_ADD_MAX_PENDING_IMAGES", "100"))
+"""
+Maximum number of queued images (per worker process) whose existence has not been checked yet. Further images are not
+queued until the pending ones have been checked.
+"""
+
+_bulk_add_limiter = Limiter(BULK_ADD_MAX_REQUESTS_PER_SECOND)
+_bulk_add_pending_images = 0
+
+
+# See get_known_image_tags()
+KNOWN_IMAGE_TAGS_QUERY = text("""SELECT known_tag.tag, image_to_scrape.id IS NULL AS can_be_added
+                                 FROM scraped_image
+                                          LEFT JOIN LATERAL unnest(scraped_image.known_tags) WITH ORDINALITY
+                                     AS known_tag(tag, position) ON TRUE
+                                          LEFT JOIN image_to_scrape
+                                                    ON image_to_scrape.endpoint = scraped_image.endpoint
+                                                        AND image_to_scrape.image = scraped_image.image
+                                                        AND image_to_scrape.tag = known_tag.tag
+                                 WHERE scraped_image.endpoint = :endpoint
+                                   AND scraped_image.image = :image
+                                   AND scraped_image.known_tags_updated_at >= :cutoff_date
+                                 ORDER BY known_tag.position""")
+
+
+def get_known_image_tags(session, image_name: ImageName) -> Optional[list[tuple[str, bool]]]:
+    """
+    Returns the tags of the image that the scraper stored in ScrapedImage.known_tags (in their stored order), along
+    with a flag that is True if the tag is not yet monitored, or None if there are no sufficiently fresh known tags.
+    The flags are determined with a single join on the endpoint_image_tag unique index of ImageToScrape.
+    """
+    cutoff_date = datetime.now(ZoneInfo('UTC')) - KNOWN_TAGS_MAX_AGE
+    rows = session.exec(KNOWN_IMAGE_TAGS_QUERY, params={"endpoint": image_name.endpoint, "image": image_name.image,
+                                                        "cutoff_date": cutoff_date}).all()
+    if not rows:
+        return None
 
-    return True
+    # Note: the tag is None if known_tags is empty
+    return [(tag, can_be_added) for tag, can_be_added in rows if tag is not None]
 
 
-def contains_digest(tag: str, min_segment_length: int = 32) -> bool:
-    """
-    Detects tags containing long sequences of alphanumeric characters that look like
-    digests or hashes (e.g.,
-    "update-available-441cc46cf89f0bc773dc84872ccab6c3b4a81dda7b946087b072f613d81ed106", or Notation/Cosign
-    "sha256-<64-characters-of-the-hash>[.att|.sig|.sbom]" tags).
-    Returns True if the tag contains at least one sequence of `min_length` or more consecutive
-    alphanumeric characters.
-    """
-    # Find all sequences of consecutive alphanumeric characters, e.g., splitting
-    # "1.2-update-available-441cc46cf89f0bc773dc84872ccab6c3b4a81dda7b946087b072f613d81ed106" into
-    # ["1", "2", "update", "available", "441cc46cf89f0bc773dc84872ccab6c3b4a81dda7b946087b072f613d81ed106"]
-    alphanumeric_sequences = re.findall(r'[a-zA-Z0-9]+', tag)
-    return any(len(seq) >= min_segment_length for seq in alphanumeric_sequences)
-
-
-async def get_all_image_tags(image_name: ImageName, client: Optional[DockerRegistryClientAsync] = None) -> list[str]:
-    close_connection = False
-    if client is None:
-        client = DockerRegistryClientAsync()
-        await configure_and_reset_client(client)
-        close_connection = True
-    """
-    Ideally, we would like the sorting of the returned tags to be done by push-date (descending).
-    An earlier (removed) implementation used the proprietary /repositories API endpoints of specific registries
-    (e.g. Docker Hub, Quay, and Microsoft MCR) to achieve this. But these registry endpoints did not support glob-
-    like search syntax, and the implementation was complex (see Git commit 6f6027d96a78270220c5bdeb26e8151d92700ec7
-    and earlier).
-
-    Instead, we now simply use the official tag list feature that every image registry offers.
-    The returned tag list is sorted lexicographically, not by push date, and to achieve the latter, we would have
-    to do the following for every entry in tag_list_response.tags (which is too much work / network calls to be
-    feasible):
-    - Retrieve the manifest of the tag
-    - If the returned manifest is an image INDEX, we choose one of the referenced image MANIFESTS at random and
-      retrieve its manifest
-    - Retrieve the blob of the "config" object of the manifest, parse the entries in "history" -> "created"
-      (see https://github.com/opencontainers/image-spec/blob/main/config.md), and assume that the image was
-      pushed immediately after the "created" date (which just indicates when layers where built)
-
-    Also, note that we are NOT using paginated calls on purpose (which is described here:
-    https://distribution.github.io/distribution/spec/api/#listing-image-tags).
-    It seems that registries like Docker Hub and MCR return ALL tags without enforcing pagination, even if an
-    image has thousands of tags.
+async def get_image_tags_with_monitoring_state(image_name: ImageName) -> list[tuple[str, bool]]:
     """
-    # TODO implement pagination, because e.g. otherwise the OWASP ZAP image hosted on GHCR will not return all tags
-    try:
-        max_retries = 5
-        custom_content_type_header_value = ""
-        last_error: Optional[Exception] = None
-        for attempt in range(max_retries):
-            try:
-                json_kwargs = {"content_type": custom_content_type_header_value} if custom_content_type_header_value \
-                    else None
-                tag_list_response = await client.get_tag_list(image_name, json_kwargs=json_kwargs)
-            except ClientResponseError as e:
-                if attempt == max_retries - 1:
-                    last_error = e
-                    break
-
-                if isinstance(e, ContentTypeError) and e.status == 200 and \
-                        (content_type := e.headers["content-type"]) != "application/json":
-                    custom_content_type_header_value = content_type
-
-                if not custom_content_type_header_value:
-                    logger.debug(f"Attempt {attempt + 1}/{max_retries} to get tags for {image_name} failed "
-                                 f"with ClientResponseError (trying again ...): {e}")
-                await asyncio.sleep(1)
-
-                continue
-
-            # Note: tag_list_response.tags is an array of ImageName objects
-            tag_list: list[ImageName] = tag_list_response.tags
-            tags: list[str] = [tag.tag for tag in tag_list]  # noqa (type parser false positive)
-            # Tags are returned in lexicographical order, so usually "oldest version first". To the user, it will be more
-            # practical to see the most recent versions first, so we reverse the order
-            tags.reverse()
-
-            tags = [t for t in tags if not contains_digest(t)]
-
-            return tags
-
-        if last_error is not None:
-            raise last_error
-    finally:
-        if close_connection:
-            await client.close()
-
-
-async def get_additional_image_tags_to_monitor(image_name: ImageName, name_filter: str = "") -> list[tuple[str, bool]]:
-    """
-    Returns tuples where [0] indicates the tag and [1] is True if the tag can still be added to the monitoring DB,
-    False otherwise.
+    Returns tuples for all tags of the image's repository, where [0] indicates the tag and [1] is True if the tag can
+    still be added to the monitoring DB, False otherwise.
     """
-    tags = await get_all_image_tags(image_name)
+    with rx.session() as session:
+        known_image_tags = get_known_image_tags(session, image_name)
+
+    if known_image_tags is not None:
+        return known_image_tags
 
-    # We don't want to search for the tag of `image_name`, because that is the tag whose details page
-    # the user currently looks at (so it is obviously already monitored). So we filter it out:
-    tags = [tag for tag in tags if tag != image_name.tag]
+    tags = await get_all_image_tags(image_name, client=await get_shared_registry_client())
 
     with rx.session() as session:
         query = select(ImageToScrape).where(ImageToScrape.endpoint == image_name.endpoint,
@@ -180,9 +116,66 @@ async def add_selected_tags_to_monitoring_db(image_name: ImageName, selected_tag
     except Exception as e:
         raise ValueError(f"Database insert failed: {e}")
 
+    invalidate_search_cache()
+
     return True
 
 
+def reserve_bulk_add_slots(image_count: int) -> int:
+    """
+    Returns how many (of the given number of) images may be passed to add_existing_images_to_monitoring_db(), without
+    exceeding BULK_ADD_MAX_PENDING_IMAGES.
+    """
+    global _bulk_add_pending_images
+    reserved_count = max(0, min(image_count, BULK_ADD_MAX_PENDING_IMAGES - _bulk_add_pending_images))
+    _bulk_add_pending_images += reserved_count
+    return reserved_count
+
+
+def _release_bulk_add_slots(image_count: int):
+    global _bulk_add_pending_images
+    _bulk_add_pending_images -= image_count
+
+
+async def add_existing_images_to_monitoring_db(image_names: list[ImageName]) -> int:
+    """
+    Adds those of the given images that exist in their registry to the monitoring DB (skipping images that are
+    already monitored), and returns the number of inserted images. Unlike add_selected_tags_to_monitoring_db(), images
+    that do not exist (or whose existence cannot be checked) are silently skipped.
+
+    The caller must have reserved the images with reserve_bulk_add_slots(). The registry requests are limited to
+    BULK_ADD_MAX_REQUESTS_PER_SECOND.
+    """
+    async def image_exists(image_name: ImageName) -> bool:
+        try:
+            await _bulk_add_limiter.wait()
+            return await image_exists_in_registry(image_name, registry_client)
+        finally:
+            _release_bulk_add_slots(1)
+
+    try:
+        registry_client = await get_shared_registry_client()
+    except Exception:
+        _release_bulk_add_slots(len(image_names))
+        raise
+    results = await asyncio.gather(*(image_exists(image_name) for image_name in image_names), return_exceptions=True)
+    existing_image_names = [image_name for image_name, exists in zip(image_names, results) if exists is True]
+    if not existing_image_names:
+        return 0
+
+    with rx.session() as session:
+        query = insert(ImageToScrape).values([
+            {"endpoint": image_name.resolve_endpoint(), "image": image_name.resolve_image(),
+             "tag": image_name.resolve_tag()} for image_name in existing_image_names
+        ]).on_conflict_do_nothing(constraint="endpoint_image_tag")
+        inserted_count = session.exec(query).rowcount
+        session.commit()
+
+    if inserted_count:
+        invalidate_search_cache()
+    return inserted_count
+
+
 refresh_digest_last_pushed_cutoff: timedelta = durationpy.from_str(
     os.getenv("REFRESH_DIGEST_LAST_PUSHED_CUTOFF", "6mm"))
 
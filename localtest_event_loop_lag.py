@@ -0,0 +1,168 @@
+"""
+Helper script that measures how much the scraper's database access stalls its in-flight registry requests, comparing
+the synchronous sessions that the scraper used before (rx.session(), i.e., a synchronous SQLAlchemy engine) with the
+async engine of database_update/database.py.
+
+Both variants run the same workload, modelled on the digest refresh: batches of registry requests run concurrently
+(simulated with a fixed latency, so no registry or recorded traffic is needed), and their results are persisted by a
+BatchWriter (select the newest digest, insert the new one and update last_pushed for each result, one commit per
+batch) while the next batch of requests is in flight. The script reports the event loop lag (see EventLoopLagMonitor)
+and by how much the simulated registry requests took longer than their latency. It seeds a separate
+"event_loop_lag_benchmark" schema of the PostgreSQL database given in the REFLEX_DB_URL environment variable, and drops
+that schema afterward.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable
+
+from sqlalchemy import create_engine, text
+
+from database_update.batch_writer import BatchWriter
+from database_update.database import async_session, get_async_engine
+from database_update.event_loop_lag import EventLoopLagMonitor, EventLoopLagStats
+
+SCHEMA = "event_loop_lag_benchmark"
+
+SELECT_NEWEST_DIGEST_QUERY = text(f"""SELECT digest FROM {SCHEMA}.image_update
+                                      WHERE image_id = :image_id
+                                      ORDER BY scraped_at DESC
+                                      LIMIT 1""")
+INSERT_DIGEST_QUERY = text(f"INSERT INTO {SCHEMA}.image_update (image_id, digest) VALUES (:image_id, :digest)")
+UPDATE_LAST_PUSHED_QUERY = text(f"UPDATE {SCHEMA}.image_to_scrape SET last_pushed = now() WHERE id = :image_id")
+
+# The defaults of the scraper (see update_database.py)
+WRITER_QUEUE_SIZE = 500
+WRITER_BATCH_SIZE = 100
+WRITER_MAX_BATCH_DELAY = timedelta(milliseconds=500)
+
+
+def seed(images: int, updates_per_image: int):
+    engine = create_engine(os.environ["REFLEX_DB_URL"])
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        connection.execute(text(f"CREATE SCHEMA {SCHEMA}"))
+        connection.execute(text(f"""CREATE TABLE {SCHEMA}.image_to_scrape (id integer PRIMARY KEY,
+                                                                           last_pushed timestamptz)"""))
+        connection.execute(text(f"""CREATE TABLE {SCHEMA}.image_update (
+                                        id serial PRIMARY KEY,
+                                        image_id integer NOT NULL,
+                                        digest text NOT NULL,
+                                        scraped_at timestamptz NOT NULL DEFAULT now())"""))
+        connection.execute(text(f"""INSERT INTO {SCHEMA}.image_to_scrape (id)
+                                    SELECT i FROM generate_series(1, :images) AS i"""), {"images": images})
+        connection.execute(text(f"""INSERT INTO {SCHEMA}.image_update (image_id, digest, scraped_at)
+                                    SELECT i % :images + 1, md5(i::text), now() - i * interval '1 minute'
+                                    FROM generate_series(1, :rows) AS i"""),
+                           {"images": images, "rows": images * updates_per_image})
+        connection.execute(text(f"CREATE INDEX ON {SCHEMA}.image_update (image_id, scraped_at)"))
+        connection.execute(text(f"ANALYZE {SCHEMA}.image_update"))
+    engine.dispose()
+
+
+def drop_schema():
+    engine = create_engine(os.environ["REFLEX_DB_URL"])
+    with engine.begin() as connection:
+        connection.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    engine.dispose()
+
+
+async def refresh_digests(write_batch: Callable[[list[tuple[int, str]]], Awaitable[None]], images: int,
+                          batch_size: int, registry_latency: float) -> tuple[EventLoopLagStats, list[float], float]:
+    """
+    Returns the event loop lag, the overrun (in ms) of each simulated registry request and the total duration.
+    """
+    overruns_ms = []
+
+    async def fetch_digest(image_id: int) -> tuple[int, str]:
+        start = time.perf_counter()
+        await asyncio.sleep(registry_latency)
+        overruns_ms.append((time.perf_counter() - start - registry_latency) * 1000)
+        return image_id, f"sha256:{time.time_ns():064x}"
+
+    monitor = EventLoopLagMonitor()
+    monitor.start()
+    start = time.perf_counter()
+    writer = BatchWriter(write_batch, max_queue_size=WRITER_QUEUE_SIZE, max_batch_size=WRITER_BATCH_SIZE,
+                         max_batch_delay=WRITER_MAX_BATCH_DELAY)
+    writer.start()
+    try:
+        for first_image_id in range(1, images + 1, batch_size):
+            last_image_id = min(first_image_id + batch_size, images + 1)
+            for result in await asyncio.gather(*(fetch_digest(image_id)
+                                                 for image_id in range(first_image_id, last_image_id))):
+                await writer.put(result)
+    finally:
+        await writer.close()
+    return monitor.stop(), overruns_ms, time.perf_counter() - start
+
+
+async def run_synchronous(images: int, batch_size: int,
+                          registry_latency: float) -> tuple[EventLoopLagStats, list[float], float]:
+    """
+    The scraper before the async engine: blocking queries from within the writer coroutine.
+    """
+    engine = create_engine(os.environ["REFLEX_DB_URL"], pool_size=3, max_overflow=0)
+    try:
+        with engine.connect() as connection:
+            async def write_batch(results: list[tuple[int, str]]):
+                for image_id, digest in results:
+                    connection.execute(SELECT_NEWEST_DIGEST_QUERY, {"image_id": image_id}).first()
+                    connection.execute(INSERT_DIGEST_QUERY, {"image_id": image_id, "digest": digest})
+                    connection.execute(UPDATE_LAST_PUSHED_QUERY, {"image_id": image_id})
+                connection.commit()
+
+            return await refresh_digests(write_batch, images, batch_size, registry_latency)
+    finally:
+        engine.dispose()
+
+
+async def run_async(images: int, batch_size: int,
+                    registry_latency: float) -> tuple[EventLoopLagStats, list[float], float]:
+    """
+    The scraper with the async engine (database_update/database.py).
+    """
+    try:
+        async with async_session() as session:
+            async def write_batch(results: list[tuple[int, str]]):
+                for image_id, digest in results:
+                    (await session.exec(SELECT_NEWEST_DIGEST_QUERY, params={"image_id": image_id})).first()
+                    await session.exec(INSERT_DIGEST_QUERY, params={"image_id": image_id, "digest": digest})
+                    await session.exec(UPDATE_LAST_PUSHED_QUERY, params={"image_id": image_id})
+                await session.commit()
+
+            return await refresh_digests(write_batch, images, batch_size, registry_latency)
+    finally:
+        await get_async_engine().dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=2000, help="number of images whose digests are refreshed")
+    parser.add_argument("--updates-per-image", type=int, default=50, help="number of seeded digests per image")
+    parser.add_argument("--batch-size", type=int, default=10, help="number of concurrent registry requests")
+    parser.add_argument("--registry-latency", type=float, default=0.1,
+                        help="simulated duration (in seconds) of a registry request")
+    args = parser.parse_args()
+
+    # The sync variant uses the synchronous psycopg driver with the same connection string
+    if not os.environ["REFLEX_DB_URL"].startswith("postgresql"):
+        raise SystemExit("REFLEX_DB_URL must point to a PostgreSQL database")
+
+    seed(args.images, args.updates_per_image)
+    try:
+        for name, variant in [("synchronous session (before)", run_synchronous), ("async engine (after)", run_async)]:
+            stats, overruns_ms, duration = asyncio.run(variant(args.images, args.batch_size, args.registry_latency))
+            overruns_ms.sort()
+            print(f"{name}: event loop lag {stats}; registry request overrun "
+                  f"mean={statistics.fmean(overruns_ms):.1f}ms, p99={overruns_ms[int(len(overruns_ms) * 0.99)]:.1f}ms, "
+                  f"max={overruns_ms[-1]:.1f}ms; duration {duration:.1f}s")
+    finally:
+        drop_schema()
+
+
+if __name__ == "__main__":
+    main()
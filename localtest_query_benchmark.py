@@ -0,0 +1,556 @@
+"""
+Helper script that runs every production SQL query of the web backend and the scraper against a large, synthetic
+dataset (by default 1M monitored tags and 100M image updates), and reports the latency and the plan shape of each
+query, as reported by EXPLAIN (ANALYZE, BUFFERS). It exits with status 1 if a query's plan contains a sequential scan
+of a large table (unless the query is expected to read the whole table, see allowed_seq_scans).
+
+The dataset is seeded (with COPY) into a separate "query_benchmark" schema of the PostgreSQL database given in the
+REFLEX_DB_URL environment variable, cloning the structure (constraints and indexes) of the real tables, so the Alembic
+migrations must have been applied to the public schema. Queries that write are rolled back. Seeding 100M image updates
+takes a while, so use --keep (and then --reuse) to benchmark repeatedly, and --baseline to compare plan shapes and
+latencies with a previous run.
+
+The update frequency is skewed like in production: a few images (e.g. nightly "latest" tags) change in almost every
+scraper run, most images rarely change. The image updates are inserted in the order of the scraper runs, so that the
+rows of an image are spread over the whole table, as they are in production.
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import statistics
+import struct
+import sys
+import time
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Iterator
+
+from docker_registry_client_async import ImageName
+from sqlalchemy import create_engine, text, Connection
+from sqlmodel import select, func, update, delete
+
+from database_update.database import INTERN_DIGESTS_QUERY
+from docker_tag_monitor.api import IMAGE_STATS_QUERY
+from docker_tag_monitor.constants import FILL_LAST_PUSH_DATE_BATCH_SIZE, DIGEST_TABLE_ITEMS_PER_PAGE, \
+    MAX_DAILY_SCAN_ENTRIES_IN_GRAPH
+from docker_tag_monitor.details_snapshot import UPDATE_BUCKETS_QUERY, build_digest_table_page_query
+from docker_tag_monitor.models import ImageToScrape, ImageUpdate, ScrapedImage, BackgroundJobExecution, \
+    JobExecutionDaily
+from docker_tag_monitor.state import build_overview_page_query, build_image_search_query, DAILY_SCAN_SUMMARY_QUERY
+from docker_tag_monitor.utils import KNOWN_IMAGE_TAGS_QUERY, KNOWN_TAGS_MAX_AGE
+from update_database import build_last_digest_ids_query, build_images_to_refresh_query, ROLLUP_INCREMENT_QUERY, \
+    FILL_SCRAPED_IMAGES_QUERY, PRUNE_IMAGE_UPDATES_QUERY, DELETE_UNREFERENCED_DIGESTS_QUERY
+
+SCHEMA = "query_benchmark"
+# In dependency order (referenced tables first)
+TABLES = ["image_to_scrape", "digest", "image_update", "image_update_rollup", "scraped_image",
+          "background_job_execution", "job_execution_daily"]
+TABLES_WITH_ID = ["image_to_scrape", "digest", "image_update", "scraped_image", "background_job_execution"]
+
+DEFAULT_IMAGE_COUNT = 1_000_000
+DEFAULT_IMAGE_UPDATE_COUNT = 100_000_000
+RUNS_PER_QUERY = 10
+RUNS_PER_WRITE_QUERY = 3
+# A sequential scan of a table with at least this many rows fails the benchmark
+SEQ_SCAN_MIN_ROWS = 10_000
+
+# The shape of the dataset mirrors the scraper's defaults (SCRAPE_INTERVAL, IMAGE_UPDATE_MAX_AGE, ...)
+SCRAPE_INTERVAL = timedelta(hours=2)
+IMAGE_UPDATE_MAX_AGE = timedelta(days=365)
+IMAGE_LAST_ACCESSED_MAX_AGE = timedelta(days=2 * 365)
+REFRESH_DIGEST_LAST_PUSHED_CUTOFF = timedelta(days=182)
+JOB_EXECUTION_MAX_AGE = timedelta(days=90)
+DB_WRITER_BATCH_SIZE = 100  # ImageUpdates written by the scraper in one transaction share their scraped_at value
+TAGS_PER_IMAGE = 10
+ENDPOINTS = ["index.docker.io"] * 14 + ["ghcr.io"] * 3 + ["quay.io"] * 2 + ["registry.k8s.io"]
+# Pareto distribution of the number of updates per image (alpha = 1.16 is the "80/20 rule")
+UPDATE_COUNT_PARETO_ALPHA = 1.16
+# Each ImageUpdate references a pseudo-random one of the (half as many) digests, i.e., tags share digests
+DIGEST_ID_MULTIPLIER = 7_919
+RUNS_PER_SEED_WINDOW = 200
+RANDOM_SEED = 4711
+
+
+@dataclass
+class BenchmarkQuery:
+    name: str
+    query: object  # a SQLAlchemy statement
+    params: dict = field(default_factory=dict)
+    # Tables that the query is expected to read completely (e.g. because it processes all rows), for which a
+    # sequential scan is no regression
+    allowed_seq_scans: frozenset[str] = frozenset()
+    is_write: bool = False
+
+
+def format_timestamp(timestamp: datetime) -> str:
+    return f"{timestamp:%Y-%m-%d %H:%M:%S}+00"
+
+
+def generate_update_probabilities(image_count: int, image_update_count: int, run_count: int) -> list[float]:
+    """
+    Returns the probability (per scraper run) that each image changes, such that the expected total number of image
+    updates is image_update_count.
+    """
+    rng = random.Random(RANDOM_SEED)
+    weights = [rng.paretovariate(UPDATE_COUNT_PARETO_ALPHA) for _ in range(image_count)]
+    # An image can change at most once per scraper run, so we re-scale until the capped counts add up
+    scale = image_update_count / sum(weights)
+    for _ in range(10):
+        scale *= image_update_count / sum(min(run_count, weight * scale) for weight in weights)
+    return [min(1.0, weight * scale / run_count) for weight in weights]
+
+
+def next_update_run(rng: random.Random, probability: float, run: int, run_count: int) -> int:
+    """
+    Returns the index of the next scraper run after the given run in which an image with the given probability changes
+    (geometric distribution), or run_count if it does not change anymore.
+    """
+    if probability <= 0:
+        return run_count
+    if probability >= 1:
+        return run + 1
+    return min(run_count, run + 1 + int(math.log(1.0 - rng.random()) / math.log(1.0 - probability)))
+
+
+def generate_images(image_count: int, now: datetime) -> Iterator[str]:
+    """
+    Yields the COPY rows of the image_to_scrape table (with a placeholder update count, which is fixed afterward).
+    """
+    rng = random.Random(RANDOM_SEED)
+    for image_id in range(1, image_count + 1):
+        image_group, tag_index = divmod(image_id - 1, TAGS_PER_IMAGE)
+        endpoint = ENDPOINTS[image_group % len(ENDPOINTS)]
+        image = f"org{image_group % 4999}/service-{image_group}"
+        if tag_index == 0:
+            tag = "latest"
+        elif image_id % 10_000 == 0:
+            # Signature tag, which clean_digest_tags() deletes
+            tag = f"sha256-{hashlib.sha256(str(image_id).encode()).hexdigest()}.sig"
+        else:
+            tag = f"1.{tag_index}"
+        added_at = now - IMAGE_LAST_ACCESSED_MAX_AGE - timedelta(days=rng.random() * 365)
+        if image_id % 1000 == 0:
+            last_viewed = now - IMAGE_LAST_ACCESSED_MAX_AGE - timedelta(days=1)  # deleted by delete_old_images()
+        else:
+            last_viewed = now - timedelta(days=rng.random() * 365)
+        last_pushed = "\\N" if image_id % 50 == 0 else format_timestamp(now - timedelta(days=rng.random() * 365))
+        yield (f"{image_id}\t{endpoint}\t{image}\t{tag}\t{format_timestamp(added_at)}\t"
+               f"{format_timestamp(last_viewed)}\t{last_pushed}\t0\n")
+
+
+def generate_image_updates(update_probabilities: list[float], first_run_start: datetime,
+                           run_count: int, digest_count: int) -> Iterator[str]:
+    """
+    Yields chunks of COPY rows of the image_update table, in the order of the scraper runs.
+    """
+    rng = random.Random(RANDOM_SEED)
+    next_runs = array("l", (next_update_run(rng, probability, -1, run_count) for probability in update_probabilities))
+    image_update_id = 0
+    for window_start in range(0, run_count, RUNS_PER_SEED_WINDOW):
+        window_end = min(run_count, window_start + RUNS_PER_SEED_WINDOW)
+        image_ids_per_run: list[list[int]] = [[] for _ in range(window_end - window_start)]
+        for image_index, probability in enumerate(update_probabilities):
+            run = next_runs[image_index]
+            while run < window_end:
+                image_ids_per_run[run - window_start].append(image_index + 1)
+                run = next_update_run(rng, probability, run, run_count)
+            next_runs[image_index] = run
+
+        for run_offset, image_ids in enumerate(image_ids_per_run):
+            run_start = first_run_start + SCRAPE_INTERVAL * (window_start + run_offset)
+            rows = []
+            for batch_start in range(0, len(image_ids), DB_WRITER_BATCH_SIZE):
+                scraped_at = format_timestamp(run_start + timedelta(seconds=batch_start // DB_WRITER_BATCH_SIZE))
+                for image_id in image_ids[batch_start:batch_start + DB_WRITER_BATCH_SIZE]:
+                    image_update_id += 1
+                    digest_id = image_update_id * DIGEST_ID_MULTIPLIER % digest_count + 1
+                    rows.append(f"{image_update_id}\t{image_id}\t{digest_id}\t{scraped_at}\n")
+            yield "".join(rows)
+
+
+def copy_rows(connection: Connection, table: str, columns: str, chunks: Iterator[str]):
+    cursor = connection.connection.driver_connection.cursor()
+    with cursor.copy(f"COPY {SCHEMA}.{table} ({columns}) FROM STDIN") as copy:
+        for chunk in chunks:
+            copy.write(chunk)
+
+
+def chunked(rows: Iterator[str], chunk_size: int = 10_000) -> Iterator[str]:
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+
+def clone_schema(connection: Connection, now: datetime):
+    """
+    Creates the (empty) benchmark tables with the columns and defaults of the real tables, using separate id sequences
+    (so that the benchmark does not advance the sequences of the real tables).
+    """
+    connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    connection.exec_driver_sql(f"CREATE SCHEMA {SCHEMA}")
+    # Lets --reuse derive the parameters (e.g. the retention cutoff dates) from the time of seeding
+    connection.exec_driver_sql(f"COMMENT ON SCHEMA {SCHEMA} IS '{now.isoformat()}'")
+    for table in TABLES:
+        connection.exec_driver_sql(f"CREATE TABLE {SCHEMA}.{table} (LIKE public.{table} INCLUDING DEFAULTS)")
+    for table in TABLES_WITH_ID:
+        connection.exec_driver_sql(f"CREATE SEQUENCE {SCHEMA}.{table}_id_seq OWNED BY {SCHEMA}.{table}.id")
+        connection.exec_driver_sql(f"ALTER TABLE {SCHEMA}.{table} "
+                                   f"ALTER COLUMN id SET DEFAULT nextval('{SCHEMA}.{table}_id_seq')")
+
+
+def clone_constraints_and_indexes(connection: Connection):
+    """
+    Adds the constraints (primary keys, unique and foreign key constraints) and indexes of the real tables to the
+    (filled) benchmark tables. Creating them after loading the data is much faster than maintaining them during COPY.
+    """
+    # Note: pg_get_constraintdef() omits the schema of the referenced tables (which are on the default search_path),
+    # so the foreign keys reference the benchmark tables once we set the search_path
+    constraints = connection.execute(text("""SELECT t.relname, c.conname, pg_get_constraintdef(c.oid), c.contype
+                                             FROM pg_constraint c
+                                                      JOIN pg_class t ON t.oid = c.conrelid
+                                                      JOIN pg_namespace n ON n.oid = t.relnamespace
+                                             WHERE n.nspname = 'public'
+                                               AND t.relname = ANY (:tables)
+                                               AND c.contype IN ('p', 'u', 'f')"""),
+                                     {"tables": TABLES}).all()
+    indexes = connection.execute(text("""SELECT pg_get_indexdef(i.indexrelid)
+                                         FROM pg_index i
+                                                  JOIN pg_class t ON t.oid = i.indrelid
+                                                  JOIN pg_namespace n ON n.oid = t.relnamespace
+                                         WHERE n.nspname = 'public'
+                                           AND t.relname = ANY (:tables)
+                                           AND NOT EXISTS (SELECT FROM pg_constraint c
+                                                           WHERE c.conindid = i.indexrelid)"""),
+                                 {"tables": TABLES}).scalars().all()
+
+    connection.exec_driver_sql(f"SET search_path TO {SCHEMA}, public")
+    # Primary keys and unique constraints first, because the foreign keys need them
+    for table, constraint_name, definition, _ in sorted(constraints, key=lambda row: row[3] == "f"):
+        connection.exec_driver_sql(f"ALTER TABLE {SCHEMA}.{table} ADD CONSTRAINT {constraint_name} {definition}")
+    for index_definition in indexes:
+        connection.exec_driver_sql(index_definition.replace(" ON public.", f" ON {SCHEMA}.", 1))
+    connection.exec_driver_sql("RESET search_path")
+
+
+def seed(engine, image_count: int, image_update_count: int, now: datetime):
+    run_count = int(IMAGE_UPDATE_MAX_AGE / SCRAPE_INTERVAL) + 1
+    # The oldest run is just older than the retention period, so PRUNE_IMAGE_UPDATES_QUERY deletes it
+    first_run_start = now - SCRAPE_INTERVAL * run_count
+    digest_count = max(1, image_update_count // 2)
+
+    with engine.connect() as connection:
+        start = time.perf_counter()
+        clone_schema(connection, now)
+
+        print(f"  Copying {image_count} images...")
+        copy_rows(connection, "image_to_scrape",
+                  "id, endpoint, image, tag, added_at, last_viewed, last_pushed, image_update_count",
+                  chunked(generate_images(image_count, now)))
+
+        print(f"  Copying about {image_update_count} image updates ({run_count} scraper runs)...")
+        update_probabilities = generate_update_probabilities(image_count, image_update_count, run_count)
+        copy_rows(connection, "image_update", "id, image_id, digest_id, scraped_at",
+                  generate_image_updates(update_probabilities, first_run_start, run_count, digest_count))
+
+        # The remaining tables are derived from the copied ones, so we fill them with SQL
+        print("  Deriving digests, counters, rollups, scraped images and job executions...")
+        connection.exec_driver_sql(f"""INSERT INTO {SCHEMA}.digest (id, algorithm, hash)
+                                       SELECT i, 'sha256', sha256(int8send(i))
+                                       FROM generate_series(1, {digest_count}) AS i""")
+        connection.exec_driver_sql(f"""UPDATE {SCHEMA}.image_to_scrape AS i
+                                       SET image_update_count = counts.count
+                                       FROM (SELECT image_id, COUNT(*) AS count
+                                             FROM {SCHEMA}.image_update
+                                             GROUP BY image_id) AS counts
+                                       WHERE i.id = counts.image_id""")
+        connection.exec_driver_sql(f"""INSERT INTO {SCHEMA}.image_update_rollup
+                                           (image_id, granularity, bucket_start, count)
+                                       SELECT image_id, granularity, DATE_TRUNC(granularity, scraped_at), COUNT(*)
+                                       FROM {SCHEMA}.image_update
+                                                CROSS JOIN (VALUES ('week'), ('month')) AS granularities(granularity)
+                                       GROUP BY 1, 2, 3""")
+        connection.exec_driver_sql(f"""INSERT INTO {SCHEMA}.scraped_image (endpoint, image, known_tags,
+                                                                           known_tags_updated_at)
+                                       SELECT endpoint, image, array_agg(tag ORDER BY tag), now()
+                                       FROM {SCHEMA}.image_to_scrape
+                                       GROUP BY endpoint, image""")
+        connection.exec_driver_sql(f"""INSERT INTO {SCHEMA}.background_job_execution
+                                           (started, completed, successful_queries, failed_queries)
+                                       SELECT started, started + INTERVAL '40 minutes', {image_count}, 0
+                                       FROM generate_series(now() - INTERVAL '{JOB_EXECUTION_MAX_AGE.days + 1} days',
+                                                            now(), INTERVAL '{SCRAPE_INTERVAL.seconds} seconds')
+                                                AS started""")
+        connection.exec_driver_sql(f"""INSERT INTO {SCHEMA}.job_execution_daily
+                                           (day, successful_scans, failed_scans, total_duration_seconds)
+                                       SELECT day, 11, 1, 12 * 2400
+                                       FROM generate_series(CURRENT_DATE - 2 * 365, CURRENT_DATE, INTERVAL '1 day')
+                                                AS day""")
+
+        print("  Creating constraints and indexes...")
+        clone_constraints_and_indexes(connection)
+        for table in TABLES_WITH_ID:
+            connection.exec_driver_sql(f"SELECT setval('{SCHEMA}.{table}_id_seq', "
+                                       f"(SELECT COALESCE(MAX(id), 0) + 1 FROM {SCHEMA}.{table}), false)")
+        connection.commit()
+
+    # Like autovacuum in production, sets the visibility map (needed for index-only scans) and the statistics
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        for table in TABLES:
+            connection.exec_driver_sql(f"VACUUM ANALYZE {SCHEMA}.{table}")
+    print(f"  Seeding took {time.perf_counter() - start:.0f}s")
+
+
+def build_benchmark_queries(connection: Connection, now: datetime) -> list[BenchmarkQuery]:
+    """
+    Returns the production queries, with parameters chosen from the seeded data (e.g. the image with the most updates).
+    """
+    def image_with_update_count(order_by: str):
+        return connection.exec_driver_sql(f"SELECT id, endpoint, image, tag, image_update_count FROM image_to_scrape "
+                                          f"WHERE image_update_count > 0 ORDER BY {order_by} LIMIT 1").one()
+
+    hot_image = image_with_update_count("image_update_count DESC, id")
+    cold_image = image_with_update_count("image_update_count, id")
+    image_count = connection.exec_driver_sql("SELECT COUNT(*) FROM image_to_scrape").scalar_one()
+    # Keys in the middle of the overview table and of the hot image's digest table, for the "next"/"prev" pages
+    overview_key = tuple(connection.exec_driver_sql(
+        f"SELECT image_update_count, id FROM image_to_scrape ORDER BY image_update_count DESC, id "
+        f"OFFSET {image_count // 2} LIMIT 1").one())
+    digest_table_key = tuple(connection.exec_driver_sql(
+        f"SELECT scraped_at, id FROM image_update WHERE image_id = {hot_image.id} ORDER BY scraped_at DESC, id DESC "
+        f"OFFSET {hot_image.image_update_count // 2} LIMIT 1").one())
+    batch_image_ids = [hot_image.id, cold_image.id] + random.Random(RANDOM_SEED).sample(range(1, image_count + 1), 98)
+    bulk_images = connection.execute(text("SELECT endpoint, image, tag FROM image_to_scrape WHERE id = ANY (:ids)"),
+                                     {"ids": random.Random(RANDOM_SEED).sample(range(1, image_count + 1), 500)}).all()
+    # Half of the digests exist already (see seed())
+    hashes = [hashlib.sha256(struct.pack(">q", i)).digest() for i in range(1, 51)] + \
+             [hashlib.sha256(f"new-{i}".encode()).digest() for i in range(50)]
+
+    queries = [
+        # Web backend
+        BenchmarkQuery("overview total items", select(func.count(ImageToScrape.id)),
+                       allowed_seq_scans=frozenset({"image_to_scrape"})),  # cached, see get_overview_total_items()
+    ]
+    for direction, first_item_key, last_item_key in [("first", None, None), ("next", None, overview_key),
+                                                     ("prev", overview_key, None), ("last", None, None)]:
+        query, params, _ = build_overview_page_query(direction, first_item_key, last_item_key, 12, image_count)
+        queries.append(BenchmarkQuery(f"overview {direction} page", query, params))
+    queries.append(BenchmarkQuery("details image lookup", select(ImageToScrape).where(
+        ImageToScrape.endpoint == hot_image.endpoint, ImageToScrape.image == hot_image.image,
+        ImageToScrape.tag == hot_image.tag)))
+    for label, image in [("hot", hot_image), ("cold", cold_image)]:
+        queries.append(BenchmarkQuery(f"update buckets ({label} image)", UPDATE_BUCKETS_QUERY, {"image_id": image.id}))
+        for direction, first_item_key, last_item_key in [("first", None, None), ("next", None, digest_table_key),
+                                                         ("prev", digest_table_key, None), ("last", None, None)]:
+            if label == "cold" and direction in ["next", "prev"]:
+                continue
+            query, _ = build_digest_table_page_query(image.id, direction, first_item_key, last_item_key,
+                                                     DIGEST_TABLE_ITEMS_PER_PAGE, image.image_update_count)
+            queries.append(BenchmarkQuery(f"digest table {direction} page ({label} image)", query))
+    queries.append(BenchmarkQuery("details last_viewed update", update(ImageToScrape).where(
+        ImageToScrape.id == hot_image.id).values(last_viewed=now), is_write=True))
+    for search_term in [f"{hot_image.endpoint}/{hot_image.image}:{hot_image.tag}", "service-4711",
+                        "ghcr.io/org1/serv", "1.2", "does-not-exist"]:
+        queries.append(BenchmarkQuery(f"search {search_term!r}",
+                                      build_image_search_query(ImageName.parse(search_term))))
+    queries.append(BenchmarkQuery("known image tags", KNOWN_IMAGE_TAGS_QUERY, {
+        "endpoint": hot_image.endpoint, "image": hot_image.image, "cutoff_date": now - KNOWN_TAGS_MAX_AGE}))
+    queries.append(BenchmarkQuery("bulk image stats (500 images)", IMAGE_STATS_QUERY, {
+        "endpoints": [row.endpoint for row in bulk_images], "images": [row.image for row in bulk_images],
+        "tags": [row.tag for row in bulk_images]}))
+    queries.append(BenchmarkQuery("status daily scan summary", DAILY_SCAN_SUMMARY_QUERY,
+                                  {"limit": MAX_DAILY_SCAN_ENTRIES_IN_GRAPH}))
+
+    # Scraper
+    queries += [
+        BenchmarkQuery("images to refresh", build_images_to_refresh_query(now - REFRESH_DIGEST_LAST_PUSHED_CUTOFF),
+                       allowed_seq_scans=frozenset({"image_to_scrape"})),  # returns a large part of the table
+        BenchmarkQuery("intern digests (batch of 100)", INTERN_DIGESTS_QUERY,
+                       {"algorithms": ["sha256"] * len(hashes), "hashes": hashes}, is_write=True),
+        BenchmarkQuery("last digest ids (batch of 100)", build_last_digest_ids_query(batch_image_ids)),
+        BenchmarkQuery("rollup increment (batch of 100)", ROLLUP_INCREMENT_QUERY, {"image_ids": batch_image_ids},
+                       is_write=True),
+        BenchmarkQuery("images without last_pushed", select(ImageToScrape).where(
+            ImageToScrape.last_pushed.is_(None)).limit(FILL_LAST_PUSH_DATE_BATCH_SIZE)),
+        BenchmarkQuery("newest image update", select(ImageUpdate).where(ImageUpdate.image_id == hot_image.id).order_by(
+            ImageUpdate.scraped_at.desc()).limit(1)),
+        # monitor_new_tags() processes all (distinct) images
+        BenchmarkQuery("fill scraped images", FILL_SCRAPED_IMAGES_QUERY, is_write=True,
+                       allowed_seq_scans=frozenset({"image_to_scrape", "scraped_image"})),
+        BenchmarkQuery("all scraped images", select(ScrapedImage), allowed_seq_scans=frozenset({"scraped_image"})),
+        BenchmarkQuery("delete outdated images", delete(ImageToScrape).where(
+            ImageToScrape.last_viewed < now - IMAGE_LAST_ACCESSED_MAX_AGE).returning(ImageToScrape.id), is_write=True),
+        BenchmarkQuery("prune image updates", PRUNE_IMAGE_UPDATES_QUERY,
+                       {"cutoff_date": now - IMAGE_UPDATE_MAX_AGE}, is_write=True),
+        # A full anti-join of both tables is the cheapest way to find all unreferenced digests
+        BenchmarkQuery("delete unreferenced digests", DELETE_UNREFERENCED_DIGESTS_QUERY, is_write=True,
+                       allowed_seq_scans=frozenset({"digest", "image_update"})),
+        BenchmarkQuery("digest-like tags", select(ImageToScrape).where(func.length(ImageToScrape.tag) > 64),
+                       allowed_seq_scans=frozenset({"image_to_scrape"})),
+        BenchmarkQuery("compact job executions", delete(BackgroundJobExecution).where(
+            BackgroundJobExecution.started < now - JOB_EXECUTION_MAX_AGE), is_write=True),
+        BenchmarkQuery("compact daily job executions", delete(JobExecutionDaily).where(
+            JobExecutionDaily.day < (now - IMAGE_LAST_ACCESSED_MAX_AGE).date()), is_write=True),
+    ]
+    return queries
+
+
+def describe_plan(node: dict, depth: int = 0) -> Iterator[str]:
+    """
+    Yields one line per plan node (its type, relation and index), indented by its depth.
+    """
+    description = node["Node Type"]
+    if node.get("Parallel Aware"):
+        description = f"Parallel {description}"
+    if "Relation Name" in node:
+        description += f" on {node['Relation Name']}"
+    if "Index Name" in node:
+        description += f" using {node['Index Name']}"
+    if "CTE Name" in node:
+        description += f" ({node['CTE Name']})"
+    yield "  " * depth + description
+    for child in node.get("Plans", []):
+        yield from describe_plan(child, depth + 1)
+
+
+def find_seq_scans(node: dict) -> Iterator[str]:
+    if node["Node Type"] == "Seq Scan":
+        yield node["Relation Name"]
+    for child in node.get("Plans", []):
+        yield from find_seq_scans(child)
+
+
+def run_benchmark_query(connection: Connection, benchmark_query: BenchmarkQuery, table_sizes: dict[str, float]) -> dict:
+    compiled = benchmark_query.query.compile(dialect=connection.dialect, compile_kwargs={"render_postcompile": True})
+    sql = str(compiled)
+    params = compiled.construct_params(benchmark_query.params)
+
+    # Writes are rolled back after each run, so that all runs see the same data
+    connection.exec_driver_sql(sql, params)  # warm-up
+    connection.rollback()
+    durations_ms = []
+    for _ in range(RUNS_PER_WRITE_QUERY if benchmark_query.is_write else RUNS_PER_QUERY):
+        start = time.perf_counter()
+        result = connection.exec_driver_sql(sql, params)
+        if result.returns_rows:
+            result.all()
+        durations_ms.append((time.perf_counter() - start) * 1000)
+        connection.rollback()
+    durations_ms.sort()
+
+    explain = connection.exec_driver_sql(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", params).scalar_one()
+    connection.rollback()
+    if isinstance(explain, str):
+        explain = json.loads(explain)
+    explain = explain[0]
+    plan = explain["Plan"]
+    seq_scans = sorted(set(find_seq_scans(plan)))
+    return {
+        "median_ms": round(statistics.median(durations_ms), 2),
+        "p95_ms": round(durations_ms[max(0, math.ceil(len(durations_ms) * 0.95) - 1)], 2),
+        "planning_ms": round(explain["Planning Time"], 2),
+        "execution_ms": round(explain["Execution Time"], 2),
+        "shared_hit_blocks": plan.get("Shared Hit Blocks", 0),
+        "shared_read_blocks": plan.get("Shared Read Blocks", 0),
+        "plan": list(describe_plan(plan)),
+        "seq_scans": seq_scans,
+        "seq_scan_regressions": [table for table in seq_scans if table_sizes.get(table, 0) >= SEQ_SCAN_MIN_ROWS
+                                 and table not in benchmark_query.allowed_seq_scans],
+    }
+
+
+def compare_with_baseline(name: str, result: dict, baseline: dict):
+    baseline_result = baseline.get(name)
+    if baseline_result is None:
+        return
+    if baseline_result["plan"] != result["plan"]:
+        print("    Plan changed, was:")
+        for line in baseline_result["plan"]:
+            print(f"      {line}")
+    if baseline_result["median_ms"] > 0:
+        print(f"    Median latency: {result['median_ms'] / baseline_result['median_ms']:.2f}x the baseline "
+              f"({baseline_result['median_ms']}ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", type=int, default=DEFAULT_IMAGE_COUNT, help="number of monitored tags to seed")
+    parser.add_argument("--image-updates", type=int, default=DEFAULT_IMAGE_UPDATE_COUNT,
+                        help="(approximate) number of image updates to seed")
+    parser.add_argument("--reuse", action="store_true", help="reuse the dataset of a previous run (see --keep)")
+    parser.add_argument("--keep", action="store_true", help="do not drop the seeded schema afterward")
+    parser.add_argument("--output", default="query_benchmark_results.json",
+                        help="file to which the results (latencies and plan shapes) are written")
+    parser.add_argument("--baseline", help="results file of a previous run, to compare the plans and latencies with")
+    args = parser.parse_args()
+
+    engine = create_engine(os.environ["REFLEX_DB_URL"])
+    now = datetime.now(timezone.utc)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)["queries"]
+
+    try:
+        with engine.connect() as connection:
+            seeded_at = connection.exec_driver_sql(f"SELECT obj_description(oid, 'pg_namespace') FROM pg_namespace "
+                                                   f"WHERE nspname = '{SCHEMA}'").scalar_one_or_none()
+        if args.reuse and seeded_at:
+            now = datetime.fromisoformat(seeded_at)
+            print(f"Reusing the dataset seeded at {now}")
+        else:
+            print(f"Seeding {args.images} monitored tags and about {args.image_updates} image updates...")
+            seed(engine, args.images, args.image_updates, now)
+
+        with engine.connect() as connection:
+            # Ensures that the (unqualified) production queries use the benchmark tables
+            connection.exec_driver_sql(f"SET search_path TO {SCHEMA}, public")
+            connection.commit()
+            table_sizes = dict(connection.execute(text("""SELECT c.relname, c.reltuples
+                                                          FROM pg_class c
+                                                                   JOIN pg_namespace n ON n.oid = c.relnamespace
+                                                          WHERE n.nspname = :schema
+                                                            AND c.relkind = 'r'"""), {"schema": SCHEMA}).all())
+            print("Table sizes: " + ", ".join(f"{table}={int(rows)}" for table, rows in table_sizes.items()))
+
+            results = {}
+            for benchmark_query in build_benchmark_queries(connection, now):
+                result = run_benchmark_query(connection, benchmark_query, table_sizes)
+                results[benchmark_query.name] = result
+                status = "SEQ SCAN REGRESSION" if result["seq_scan_regressions"] else "ok"
+                print(f"{benchmark_query.name}: median={result['median_ms']}ms, p95={result['p95_ms']}ms, "
+                      f"execution={result['execution_ms']}ms, buffers: hit={result['shared_hit_blocks']} "
+                      f"read={result['shared_read_blocks']} [{status}]")
+                for line in result["plan"]:
+                    print(f"    {line}")
+                compare_with_baseline(benchmark_query.name, result, baseline)
+    finally:
+        if not args.keep:
+            with engine.connect() as connection:
+                connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+                connection.commit()
+
+    with open(args.output, "w") as output_file:
+        json.dump({"created_at": now.isoformat(), "table_sizes": table_sizes, "queries": results}, output_file,
+                  indent=2)
+    print(f"Results written to {args.output}")
+
+    regressions = {name: result["seq_scan_regressions"] for name, result in results.items()
+                   if result["seq_scan_regressions"]}
+    if regressions:
+        print(f"Queries with sequential scans of tables with at least {SEQ_SCAN_MIN_ROWS} rows:")
+        for name, tables in regressions.items():
+            print(f"  {name}: {', '.join(tables)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
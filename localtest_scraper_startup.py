@@ -0,0 +1,43 @@
+"""
+Helper script that measures the startup time and memory usage (max. RSS) of the scraper process, comparing the lean
+entry point (update_database.py, which no longer imports Reflex) with the previous approach of importing all of Reflex.
+The script only imports the modules (it does not run the scraper), so no database is needed.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+VARIANTS = {
+    "with Reflex (previous entry point)": "import reflex, reflex.model; import update_database",
+    "lean entry point": "import update_database",
+}
+
+RUNS = 5
+
+
+def measure(code: str) -> tuple[float, float]:
+    """
+    Returns the wall time (seconds) and max. RSS (MiB) of a fresh Python process running the given code.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)))
+    _, status, rusage = os.wait4(process.pid, 0)
+    duration = time.perf_counter() - start
+    if status != 0:
+        raise RuntimeError(f"Process failed with status {status}: {code}")
+    max_rss_mib = rusage.ru_maxrss / 1024  # ru_maxrss is given in KiB on Linux
+    return duration, max_rss_mib
+
+
+def main():
+    for name, code in VARIANTS.items():
+        measure(code)  # warm up the file system cache and the .pyc files
+        durations, max_rss_values = zip(*[measure(code) for _ in range(RUNS)])
+        print(f"{name}: startup median={statistics.median(durations):.2f}s, "
+              f"max RSS median={statistics.median(max_rss_values):.0f} MiB ({RUNS} runs)")
+
+
+if __name__ == "__main__":
+    main()
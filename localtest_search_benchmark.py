@@ -0,0 +1,81 @@
+"""
+Helper script that measures the latency of the image/tag search (see build_image_search_query()) for catalogs of 100k
+and 1M monitored tags. It seeds a separate "search_benchmark" schema (so it does not touch the real tables) of the
+PostgreSQL database given in the REFLEX_DB_URL environment variable, and drops that schema afterward.
+"""
+import os
+import statistics
+import time
+
+from docker_registry_client_async import ImageName
+from sqlalchemy import create_engine, text
+from sqlmodel import Session
+
+from docker_tag_monitor.state import build_image_search_query
+
+SCHEMA = "search_benchmark"
+CATALOG_SIZES = [100_000, 1_000_000]
+SEARCH_TERMS = [
+    "service-4711",  # image substring, several matching tags
+    "org53/service-1050:1.7",  # exact match
+    "ghcr.io/org1/serv",  # prefix match on a different registry
+    "1.2",  # short term, matches many images
+    "does-not-exist",  # no match at all
+]
+RUNS_PER_TERM = 20
+
+# Tags per image in the seeded catalog. All generated (endpoint, image, tag) combinations are unique
+TAGS_PER_IMAGE = 25
+
+
+def seed(session: Session, catalog_size: int):
+    session.exec(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+    session.exec(text(f"CREATE SCHEMA {SCHEMA}"))
+    session.exec(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    # Clone the structure (including the indexes) of the real table. We set the ids explicitly, because the cloned
+    # id column default would otherwise advance the sequence of the real table
+    session.exec(text(f"CREATE TABLE {SCHEMA}.image_to_scrape (LIKE public.image_to_scrape INCLUDING ALL)"))
+    session.exec(text(f"""INSERT INTO {SCHEMA}.image_to_scrape (id, endpoint, image, tag, image_update_count)
+                          SELECT i,
+                                 (ARRAY ['index.docker.io', 'ghcr.io', 'quay.io', 'registry.k8s.io'])[i % 4 + 1],
+                                 'org' || (i / {TAGS_PER_IMAGE} % 997) || '/service-' || (i / {TAGS_PER_IMAGE}),
+                                 '1.' || (i % {TAGS_PER_IMAGE}),
+                                 i % 100
+                          FROM generate_series(1, :catalog_size) AS i"""),
+                 params={"catalog_size": catalog_size})
+    session.exec(text(f"ANALYZE {SCHEMA}.image_to_scrape"))
+    session.commit()
+
+
+def benchmark(session: Session):
+    # Ensures that the (unqualified) queries of build_image_search_query() use the benchmark table
+    session.exec(text(f"SET search_path TO {SCHEMA}, public"))
+    for search_term in SEARCH_TERMS:
+        query = build_image_search_query(ImageName.parse(search_term))
+        durations_ms = []
+        for _ in range(RUNS_PER_TERM):
+            start = time.perf_counter()
+            session.exec(query).all()
+            durations_ms.append((time.perf_counter() - start) * 1000)
+        durations_ms.sort()
+        p95_ms = durations_ms[int(len(durations_ms) * 0.95) - 1]
+        print(f"  {search_term!r}: median={statistics.median(durations_ms):.1f}ms, p95={p95_ms:.1f}ms")
+
+
+def main():
+    engine = create_engine(os.environ["REFLEX_DB_URL"])
+    try:
+        for catalog_size in CATALOG_SIZES:
+            with Session(engine) as session:
+                print(f"Seeding {catalog_size} monitored tags...")
+                seed(session, catalog_size)
+                print(f"Search latency for {catalog_size} monitored tags ({RUNS_PER_TERM} runs per term):")
+                benchmark(session)
+    finally:
+        with Session(engine) as session:
+            session.exec(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+            session.commit()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,121 @@
 import asyncio
 import logging
 import os
-import sys
 import time
 from datetime import timedelta, datetime
-from pydantic.v1.datetime_parse import parse_datetime
-import json
 from typing import Optional, Tuple
 from zoneinfo import ZoneInfo
 
 import aiohttp
 import durationpy
-import reflex as rx
 from asynciolimiter import Limiter
 from docker_registry_client_async import ImageName, DockerRegistryClientAsync, Indices
 from docker_registry_client_async.typing import DockerRegistryClientAsyncHeadManifest
 from sqlalchemy.sql import text
-from sqlmodel import delete, select, func
+from sqlmodel import delete, select, func, col, update, exists
 
 import database_update.dockerhub_scraper as dockerhub_scraper
+from database_update.batch_writer import BatchWriter
+from database_update.database import async_session, intern_digests
+from database_update.event_loop_lag import EventLoopLagMonitor
+from database_update.runtime import run
+from docker_tag_monitor.cache import invalidate_search_cache_async
 from docker_tag_monitor.constants import FILL_LAST_PUSH_DATE_BATCH_SIZE
-from docker_tag_monitor.models import ImageToScrape, ImageUpdate, BackgroundJobExecution, ScrapedImage
-from docker_tag_monitor.utils import get_all_image_tags, configure_and_reset_client, contains_digest
+from docker_tag_monitor.details_snapshot import refresh_details_snapshots_async, delete_details_snapshots_async
+from docker_tag_monitor.edge_cache import purge_edge_cache_async, set_scraper_next_run_async
+from docker_tag_monitor.invalidation_bus import notify_image_changes_async, CHANGE_TYPE_CREATED, \
+    CHANGE_TYPE_UPDATED, CHANGE_TYPE_PRUNED, CHANGE_TYPE_DELETED
+from docker_tag_monitor.models import ImageToScrape, ImageUpdate, BackgroundJobExecution, ScrapedImage, Digest, \
+    ImageUpdateRollup, JobExecutionDaily
+from docker_tag_monitor.parsing import parse_datetime, json_loads
+from docker_tag_monitor.registry import get_all_image_tags, configure_and_reset_client, contains_digest
+from docker_tag_monitor.registry_traffic import create_registry_client, create_client_session
 
 logger = logging.getLogger("DatabaseUpdater")
 
 http_request_limiter = Limiter(10)  # Note: the value is overwritten in main()
 
 
+def build_last_digest_ids_query(image_ids: list[int]):
+    """
+    Returns the query for the most recent digest of each of the given images, i.e., (image_id, digest_id) tuples.
+    """
+    return select(ImageUpdate.image_id, ImageUpdate.digest_id).where(col(ImageUpdate.image_id).in_(image_ids)).distinct(
+        ImageUpdate.image_id).order_by(ImageUpdate.image_id, ImageUpdate.scraped_at.desc())
+
+
+def build_images_to_refresh_query(last_pushed_cutoff_date: datetime):
+    """
+    Returns the query for the images whose digests are refreshed, i.e., "latest" tags and tags with a recent (or
+    unknown) last_pushed date.
+    """
+    return select(ImageToScrape).where(
+        (ImageToScrape.tag == "latest") |
+        (ImageToScrape.last_pushed >= last_pushed_cutoff_date) |
+        (ImageToScrape.last_pushed.is_(None))
+    )
+
+
+# Counts the new ImageUpdates of the given images in their weekly/monthly rollup buckets. Note: now() returns the
+# start time of the transaction, which is also the scraped_at value of the new ImageUpdates
+ROLLUP_INCREMENT_QUERY = text("""INSERT INTO image_update_rollup (image_id, granularity, bucket_start, count)
+                                 SELECT image_id, granularity, DATE_TRUNC(granularity, now()), COUNT(*)
+                                 FROM unnest(CAST(:image_ids AS integer[])) AS image_id
+                                          CROSS JOIN (VALUES ('week'), ('month')) AS granularities(granularity)
+                                 GROUP BY image_id, granularity
+                                 ON CONFLICT (image_id, granularity, bucket_start)
+                                     DO UPDATE SET count = image_update_rollup.count + EXCLUDED.count""")
+
+# Fills the scraped_image table with missing rows (each row is a unique (endpoint, image) pair from the image_to_scrape
+# table, with an additional known_tags string-array column)
+FILL_SCRAPED_IMAGES_QUERY = text("""INSERT INTO scraped_image (endpoint, image)
+                                    SELECT DISTINCT its.endpoint, its.image
+                                    FROM image_to_scrape its
+                                             LEFT JOIN scraped_image si
+                                                       ON its.endpoint = si.endpoint AND its.image = si.image
+                                    WHERE si.endpoint IS NULL
+                                      AND si.image IS NULL;
+                                 """)
+
+# Deletes the outdated ImageUpdates and decrements the update counters of the affected images (and their rollup
+# buckets) accordingly, returning the affected images along with their number of deleted ImageUpdates
+PRUNE_IMAGE_UPDATES_QUERY = text("""WITH deleted_image_update AS (DELETE FROM image_update
+                                                                  WHERE scraped_at < :cutoff_date
+                                                                  RETURNING image_id, scraped_at),
+                                         deleted_count AS (SELECT image_id, COUNT(*) AS count
+                                                           FROM deleted_image_update
+                                                           GROUP BY image_id),
+                                         deleted_bucket_count AS (
+                                             SELECT image_id,
+                                                    granularity,
+                                                    DATE_TRUNC(granularity, scraped_at) AS bucket_start,
+                                                    COUNT(*)                            AS count
+                                             FROM deleted_image_update
+                                                      CROSS JOIN (VALUES ('week'), ('month'))
+                                                 AS granularities(granularity)
+                                             GROUP BY image_id, granularity, bucket_start),
+                                         updated_rollup AS (
+                                             UPDATE image_update_rollup AS rollup
+                                                 SET count = rollup.count - deleted_bucket_count.count
+                                                 FROM deleted_bucket_count
+                                                 WHERE rollup.image_id = deleted_bucket_count.image_id
+                                                     AND rollup.granularity = deleted_bucket_count.granularity
+                                                     AND rollup.bucket_start = deleted_bucket_count.bucket_start),
+                                         updated_image AS (
+                                             UPDATE image_to_scrape
+                                                 SET image_update_count = image_update_count - deleted_count.count
+                                                 FROM deleted_count
+                                                 WHERE image_to_scrape.id = deleted_count.image_id
+                                                 RETURNING image_to_scrape.id, endpoint, image, tag)
+                                    SELECT updated_image.id, updated_image.endpoint, updated_image.image,
+                                           updated_image.tag, deleted_count.count
+                                    FROM deleted_count
+                                             JOIN updated_image ON updated_image.id = deleted_count.image_id""")
+
+# Removes digests that are no longer referenced by any ImageUpdate (uses the index on image_update.digest_id)
+DELETE_UNREFERENCED_DIGESTS_QUERY = delete(Digest).where(~exists().where(ImageUpdate.digest_id == Digest.id))
+
+
 async def update_popular_images_to_scrape():
     popular_images = await dockerhub_scraper.get_popular_images()
     if not popular_images:
@@ -37,23 +125,29 @@ async def update_popular_images_to_scrape():
     if not images_to_scrape:
         return
 
-    new_images = 0
+    new_images: list[ImageToScrape] = []
 
-    with rx.session() as session:
+    async with async_session() as session:
         for image_to_scrape in images_to_scrape:
             query = select(ImageToScrape).where(ImageToScrape.endpoint == image_to_scrape.endpoint,
                                                 ImageToScrape.image == image_to_scrape.image,
                                                 ImageToScrape.tag == image_to_scrape.tag)
-            database_object = session.exec(query).first()
+            database_object = (await session.exec(query)).first()
             if database_object is None:
                 try:
                     session.add(image_to_scrape)
-                    session.commit()
-                    new_images += 1
+                    await session.commit()
+                    new_images.append(image_to_scrape)
                 except Exception as e:
+                    await session.rollback()
                     logger.warning(f"Failed to add image to scrape: {e}")
 
-    logger.info(f"Added {new_images} NEW images to scrape to the database")
+        if new_images:
+            await invalidate_search_cache_async()
+            await notify_image_changes_async(session, CHANGE_TYPE_CREATED,
+                                             [(img.id, img.endpoint, img.image, img.tag) for img in new_images])
+
+    logger.info(f"Added {len(new_images)} NEW images to scrape to the database")
 
 
 async def get_image_build_date_from_registry(image: ImageToScrape,
@@ -84,7 +178,7 @@ async def get_image_build_date_from_registry(image: ImageToScrape,
 
     config_digest = image_manifest_result.manifest.json["config"]["digest"]
     image_config_result = await registry_client.get_blob(image_name, config_digest)
-    image_config_json = json.loads(image_config_result.blob.decode("utf-8"))
+    image_config_json = json_loads(image_config_result.blob)
     build_date: datetime = parse_datetime(image_config_json["created"])
 
     if build_date.year <= 1970:
@@ -96,18 +190,18 @@ async def get_image_build_date_from_registry(image: ImageToScrape,
 async def fill_image_last_pushed_date():
     logger.info("Filling last_pushed date for all images that don't have it yet")
     has_more_data = True
-    async with DockerRegistryClientAsync() as registry_client:
+    async with create_registry_client() as registry_client:
         while has_more_data:
             await configure_and_reset_client(registry_client)
-            async with aiohttp.ClientSession() as http_session:
+            async with create_client_session() as http_session:
                 docker_hub_auth_header = await dockerhub_scraper.get_dockerhub_auth_header()
                 http_session.headers.update(docker_hub_auth_header)
-                with rx.session() as session:
+                async with async_session() as session:
                     has_more_data = False
                     image_update_counter = 0
                     query = select(ImageToScrape).where(ImageToScrape.last_pushed.is_(None)).limit(
                         FILL_LAST_PUSH_DATE_BATCH_SIZE)
-                    for image in session.exec(query):
+                    for image in (await session.exec(query)).all():
                         has_more_data = True
                         last_push_date: Optional[datetime] = None
                         if image.endpoint == Indices.DOCKERHUB:
@@ -121,7 +215,7 @@ async def fill_image_last_pushed_date():
                                     query_newest_scrape = select(ImageUpdate).where(
                                         ImageUpdate.image_id == image.id
                                     ).order_by(ImageUpdate.scraped_at.desc()).limit(1)
-                                    newest_scrape = session.exec(query_newest_scrape).first()
+                                    newest_scrape = (await session.exec(query_newest_scrape)).first()
                                     if newest_scrape:
                                         last_push_date = newest_scrape.scraped_at
                                         # logger.debug(f"Using newest scrape date for image "
@@ -144,7 +238,7 @@ async def fill_image_last_pushed_date():
                             #             f"'{image.endpoint}/{image.image}:{image.tag}'")
 
                     try:
-                        session.commit()
+                        await session.commit()
                         if image_update_counter:
                             logger.info(f"Updated last_pushed date for {image_update_counter} images in the database")
                     except Exception as e:
@@ -161,17 +255,20 @@ def get_gcr_mirror_image_if_possible(img_to_scrape: ImageToScrape, retry_count:
 
 
 async def refresh_digests(digest_refresh_cooldown_interval: timedelta, max_retries_on_rate_limit: int,
-                          sleep_interval_on_rate_limit: timedelta, refresh_digest_last_pushed_cutoff: timedelta):
+                          sleep_interval_on_rate_limit: timedelta, refresh_digest_last_pushed_cutoff: timedelta,
+                          fetch_batch_size: int, db_writer_queue_size: int, db_writer_batch_size: int,
+                          db_writer_max_batch_delay: timedelta):
     """
     Iterates over all ImageToScrape entries and refreshes the digest for each one. Uses batching to speed up the
-    process.
+    process: digests are fetched concurrently in batches of fetch_batch_size images, and the results are persisted by
+    a separate writer coroutine, which coalesces up to db_writer_batch_size results into one transaction.
     """
     logger.info("Refreshing digests for all images")
     job_execution = BackgroundJobExecution(started=datetime.now(ZoneInfo('UTC')), successful_queries=0,
                                            failed_queries=0)
-    async with DockerRegistryClientAsync() as registry_client:
+    async with create_registry_client() as registry_client:
         await configure_and_reset_client(registry_client)
-        with rx.session() as session:
+        async with async_session() as session:
             images_to_scrape = []
 
             async def reset_registry_tokens_if_tokens_expired(
@@ -243,45 +340,48 @@ async def refresh_digests(digest_refresh_cooldown_interval: timedelta, max_retri
                         logger.warning(f"Failed to retrieve digest for image '{image_name}' (ClientError): {e}")
                     return img_to_scrape, None
 
-            async def update_database_entries(
-                    results: list[Tuple[ImageToScrape, Optional[DockerRegistryClientAsyncHeadManifest]]]):
+            async def stage_results(
+                    results: list[Tuple[ImageToScrape, Optional[DockerRegistryClientAsyncHeadManifest]]]) \
+                    -> Tuple[int, int, list[ImageToScrape], list[ImageToScrape]]:
+                """
+                Adds the database changes for the given results to the session (without committing them), returning
+                the number of successful and failed queries, the ImageToScrape objects whose digest changed, and the
+                ImageToScrape objects that are deleted.
+                """
+                successful_queries = 0
+                failed_queries = 0
+                changed_images: list[ImageToScrape] = []
+                deleted_images: list[ImageToScrape] = []
+
+                found_results = [(img, res) for img, res in results if res is not None and res.result]
+                digest_ids = await intern_digests(session, {str(res.digest) for _, res in found_results})
+                last_digest_ids: dict[int, int] = {}
+                if found_results:
+                    # Retrieve the most recent digest of all images of the batch with a single query
+                    query = build_last_digest_ids_query([img.id for img, _ in found_results])
+                    last_digest_ids = dict((await session.exec(query)).all())
+
                 for img_to_scrape, result in results:
                     if result is None:
-                        job_execution.failed_queries += 1
+                        failed_queries += 1
                         continue
 
                     digest_was_found_in_registry = result.result
                     if digest_was_found_in_registry:
-                        query = select(ImageUpdate).where(ImageUpdate.image_id == img_to_scrape.id).order_by(
-                            ImageUpdate.scraped_at.desc())
-                        last_update = session.exec(query).first()
-                        if last_update is None or last_update.digest != result.digest:
-                            image_update = ImageUpdate(image_id=img_to_scrape.id, digest=result.digest)
-                            try:
-                                session.add(image_update)
-                                img_to_scrape.last_pushed = datetime.now(ZoneInfo('UTC'))
-                                session.add(img_to_scrape)
-                                session.commit()
-                                job_execution.successful_queries += 1
-                            except Exception as e:
-                                job_execution.failed_queries += 1
-                                logger.warning(f"Failed to add image scrape update for {image_update}: {e}")
-                        else:
-                            job_execution.successful_queries += 1
+                        digest_id = digest_ids[str(result.digest)]
+                        if last_digest_ids.get(img_to_scrape.id) != digest_id:
+                            session.add(ImageUpdate(image_id=img_to_scrape.id, digest_id=digest_id))
+                            await session.exec(update(ImageToScrape).where(ImageToScrape.id == img_to_scrape.id)
+                                               .values(last_pushed=datetime.now(ZoneInfo('UTC')),
+                                                       image_update_count=ImageToScrape.image_update_count + 1))
+                            changed_images.append(img_to_scrape)
+                        successful_queries += 1
                     else:
-                        job_execution.failed_queries += 1
+                        failed_queries += 1
                         image_not_found_in_registry = result.client_response.status == 404
                         if image_not_found_in_registry:
-                            try:
-                                session.delete(img_to_scrape)
-                                session.commit()
-                                logger.info(f"Deleted ImageToScrape "
-                                            f"'{img_to_scrape.endpoint}/{img_to_scrape.image}:{img_to_scrape.tag}' "
-                                            f"because it is no longer found in the registry")
-                            except Exception as e:
-                                logger.warning(f"Unable to delete ImageToScrape "
-                                               f"'{img_to_scrape.endpoint}/{img_to_scrape.image}:{img_to_scrape.tag}' "
-                                               f"from the registry (image is no longer found in the registry): {e}")
+                            await session.exec(delete(ImageToScrape).where(ImageToScrape.id == img_to_scrape.id))
+                            deleted_images.append(img_to_scrape)
                         else:
                             logger.warning(
                                 f"Failed to retrieve digest for image "
@@ -289,34 +389,115 @@ async def refresh_digests(digest_refresh_cooldown_interval: timedelta, max_retri
                                 f"Unexpected status code={result.client_response.status}; "
                                 f"headers={result.client_response.headers}")
 
-            batch_size = 10
+                if changed_images:
+                    await session.exec(ROLLUP_INCREMENT_QUERY,
+                                       params={"image_ids": [img.id for img in changed_images]})
+
+                return successful_queries, failed_queries, changed_images, deleted_images
+
+            # Task of publish_changes() for the last written batch. The batches are published one after the other
+            publish_task: Optional[asyncio.Task] = None
+
+            async def publish_changes(previous_task: Optional[asyncio.Task], changed_images: list[ImageToScrape],
+                                      deleted_images: list[ImageToScrape]):
+                """
+                Updates the caches and notifies the web workers about the (already committed) changes of a batch.
+                Runs in its own task and session, so that it does not delay the writer.
+                """
+                if previous_task is not None:
+                    await previous_task
+                try:
+                    async with async_session() as publish_session:
+                        await refresh_details_snapshots_async(publish_session, changed_images)
+                        await delete_details_snapshots_async([(img.endpoint, img.image, img.tag)
+                                                              for img in deleted_images])
+                        await purge_edge_cache_async([(img.endpoint, img.image, img.tag)
+                                                      for img in changed_images + deleted_images])
+                        await notify_image_changes_async(publish_session, CHANGE_TYPE_UPDATED,
+                                                         [(img.id, img.endpoint, img.image, img.tag)
+                                                          for img in changed_images])
+                        await notify_image_changes_async(publish_session, CHANGE_TYPE_DELETED,
+                                                         [(img.id, img.endpoint, img.image, img.tag)
+                                                          for img in deleted_images])
+                except Exception as e:
+                    logger.warning(f"Failed to update the caches and notify the web workers about "
+                                   f"{len(changed_images)} changed and {len(deleted_images)} deleted images "
+                                   f"(the changes are stored): {e}")
+
+            async def write_results_to_database(
+                    results: list[Tuple[ImageToScrape, Optional[DockerRegistryClientAsyncHeadManifest]]]):
+                """
+                Persists a batch of results in a single transaction. If the transaction fails, the results are
+                written one by one, so that one problematic result does not discard the entire batch.
+                """
+                nonlocal publish_task
+                try:
+                    successful_queries, failed_queries, changed_images, deleted_images = await stage_results(results)
+                    await session.commit()
+                except Exception as e:
+                    await session.rollback()
+                    if len(results) == 1:
+                        img_to_scrape, _ = results[0]
+                        job_execution.failed_queries += 1
+                        logger.warning(f"Failed to store the digest refresh result for image "
+                                       f"'{img_to_scrape.endpoint}/{img_to_scrape.image}:{img_to_scrape.tag}': {e}")
+                    else:
+                        logger.warning(f"Failed to store a batch of {len(results)} digest refresh results, "
+                                       f"storing them one by one: {e}")
+                        for result in results:
+                            await write_results_to_database([result])
+                    return
+
+                job_execution.successful_queries += successful_queries
+                job_execution.failed_queries += failed_queries
+                if changed_images or deleted_images:
+                    publish_task = asyncio.create_task(publish_changes(publish_task, changed_images, deleted_images))
+                for img_to_scrape in deleted_images:
+                    logger.info(f"Deleted ImageToScrape "
+                                f"'{img_to_scrape.endpoint}/{img_to_scrape.image}:{img_to_scrape.tag}' "
+                                f"because it is no longer found in the registry")
+
             # Only refresh digests for images with a recent last_pushed date or for "latest" tags
             cutoff_date = datetime.now(ZoneInfo('UTC')) - refresh_digest_last_pushed_cutoff
-            query = select(ImageToScrape).where(
-                (ImageToScrape.tag == "latest") |
-                (ImageToScrape.last_pushed >= cutoff_date) |
-                (ImageToScrape.last_pushed.is_(None))
-            )
-            for image_to_scrape in session.exec(query):
-                images_to_scrape.append(image_to_scrape)
-                if len(images_to_scrape) == batch_size:
-                    results = await asyncio.gather(*(fetch_digest(image) for image in images_to_scrape))
-                    await reset_registry_tokens_if_tokens_expired(results)
-                    await repeat_query_on_hitting_rate_limit_or_server_error_or_auth_issue(results)
-                    await update_database_entries(results)
-                    images_to_scrape = []
-
-            if images_to_scrape:  # batch size has not been reached, but there are still some images left to process
-                results = await asyncio.gather(*(fetch_digest(image) for image in images_to_scrape))
+            all_images_to_scrape = (await session.exec(build_images_to_refresh_query(cutoff_date))).all()
+            # Detach the objects, so that a rollback of a failed write (which expires all objects attached to the
+            # session) does not force us to re-load them
+            session.expunge_all()
+
+            # The fetching of digests (below) and the persistence of the results (done by the writer) run
+            # concurrently, decoupled by a bounded queue
+            writer = BatchWriter(write_results_to_database, max_queue_size=db_writer_queue_size,
+                                 max_batch_size=db_writer_batch_size, max_batch_delay=db_writer_max_batch_delay)
+            writer.start()
+
+            async def process_batch(batch: list[ImageToScrape]):
+                results = await asyncio.gather(*(fetch_digest(image) for image in batch))
                 await reset_registry_tokens_if_tokens_expired(results)
                 await repeat_query_on_hitting_rate_limit_or_server_error_or_auth_issue(results)
-                await update_database_entries(results)
+                for result in results:
+                    await writer.put(result)
+
+            try:
+                for image_to_scrape in all_images_to_scrape:
+                    images_to_scrape.append(image_to_scrape)
+                    if len(images_to_scrape) == fetch_batch_size:
+                        await process_batch(images_to_scrape)
+                        images_to_scrape = []
+
+                if images_to_scrape:  # batch size has not been reached, but there are still some images left to process
+                    await process_batch(images_to_scrape)
+            finally:
+                # Also writes the already queued results (and stops the writer's task) if fetching failed
+                await writer.close()
+                if publish_task is not None:
+                    await publish_task
 
             job_execution.completed = datetime.now(ZoneInfo('UTC'))
             try:
                 session.add(job_execution)
-                session.commit()
-                session.refresh(job_execution)  # necessary to be able to access the query counts in the log call below
+                await add_job_execution_to_daily_rollup(session, job_execution)
+                await session.commit()
+                await session.refresh(job_execution)  # necessary to be able to access the query counts in the log call below
             except Exception as e:
                 logger.warning(f"Failed to add job execution to database: {e}")
 
@@ -324,6 +505,40 @@ async def refresh_digests(digest_refresh_cooldown_interval: timedelta, max_retri
                 f"{job_execution.failed_queries} failed queries")
 
 
+async def add_job_execution_to_daily_rollup(session, job_execution: BackgroundJobExecution):
+    """
+    Adds the (finished) job execution to its day's JobExecutionDaily row, without committing.
+    """
+    successful = job_execution.failed_queries == 0 and job_execution.successful_queries > 0
+    query = text("""INSERT INTO job_execution_daily (day, successful_scans, failed_scans, total_duration_seconds)
+                    VALUES (DATE(CAST(:started AS timestamptz)), :successful_scans, :failed_scans, :duration_seconds)
+                    ON CONFLICT (day) DO UPDATE
+                        SET successful_scans       = job_execution_daily.successful_scans + EXCLUDED.successful_scans,
+                            failed_scans           = job_execution_daily.failed_scans + EXCLUDED.failed_scans,
+                            total_duration_seconds = job_execution_daily.total_duration_seconds +
+                                                     EXCLUDED.total_duration_seconds""")
+    await session.exec(query, params={
+        "started": job_execution.started,
+        "successful_scans": 1 if successful else 0,
+        "failed_scans": 0 if successful else 1,
+        "duration_seconds": (job_execution.completed - job_execution.started).total_seconds(),
+    })
+
+
+async def compact_job_executions(job_execution_max_age: timedelta, job_execution_daily_max_age: timedelta):
+    """
+    Deletes raw BackgroundJobExecution rows (which are already contained in the JobExecutionDaily rollup) and
+    JobExecutionDaily rows that are older than the respective max. age.
+    """
+    now = datetime.now(ZoneInfo('UTC'))
+    async with async_session() as session:
+        await session.exec(delete(BackgroundJobExecution).where(
+            BackgroundJobExecution.started < now - job_execution_max_age))
+        await session.exec(delete(JobExecutionDaily).where(
+            JobExecutionDaily.day < (now - job_execution_daily_max_age).date()))
+        await session.commit()
+
+
 async def monitor_new_tags():
     """
     Determines whether new tags exist for each unique image, compared to the last digest refresh run.
@@ -337,26 +552,16 @@ async def monitor_new_tags():
       information about all known tags for an image.
     """
     logger.info("Checking whether we need to monitor new tags")
-    async with DockerRegistryClientAsync() as registry_client:
+    async with create_registry_client() as registry_client:
         await configure_and_reset_client(registry_client)
-        with rx.session() as session:
-            # Fill the scraped_image table with missing rows (each row is a unique (endpoint, image) pair from the
-            # image_to_scrape table, with an additional known_tags string-array column)
-            query = text("""INSERT INTO scraped_image (endpoint, image)
-                            SELECT DISTINCT its.endpoint, its.image
-                            FROM image_to_scrape its
-                                     LEFT JOIN scraped_image si
-                                               ON its.endpoint = si.endpoint AND its.image = si.image
-                            WHERE si.endpoint IS NULL
-                              AND si.image IS NULL;
-                         """)
-            session.exec(query)
-            session.commit()
+        async with async_session() as session:
+            await session.exec(FILL_SCRAPED_IMAGES_QUERY)
+            await session.commit()
 
             updated_images = 0
-            updated_tags = 0
+            new_images: list[ImageToScrape] = []
 
-            for scraped_image in session.exec(select(ScrapedImage)):
+            for scraped_image in (await session.exec(select(ScrapedImage))).all():
                 image_name = ImageName.parse(f"{scraped_image.endpoint}/{scraped_image.image}")
                 try:
                     all_tags = await http_request_limiter.wrap(get_all_image_tags(image_name, client=registry_client))
@@ -371,41 +576,64 @@ async def monitor_new_tags():
                         existing_query = select(ImageToScrape).where(ImageToScrape.endpoint == scraped_image.endpoint,
                                                                      ImageToScrape.image == scraped_image.image,
                                                                      ImageToScrape.tag == tag_to_monitor)
-                        existing_image_to_scrape = session.exec(existing_query).first()
+                        existing_image_to_scrape = (await session.exec(existing_query)).first()
                         if existing_image_to_scrape is None:
                             image_to_scrape = ImageToScrape(endpoint=scraped_image.endpoint, image=scraped_image.image,
                                                             tag=tag_to_monitor)
                             session.add(image_to_scrape)
-                            updated_tags += 1
+                            new_images.append(image_to_scrape)
 
                 if scraped_image.known_tags != all_tags:
                     scraped_image.known_tags = all_tags
-                    session.add(scraped_image)
                     updated_images += 1
-
-            session.commit()
+                # Lets the web backend know whether known_tags is fresh enough to be shown instead of querying the
+                # registry
+                scraped_image.known_tags_updated_at = datetime.now(ZoneInfo('UTC'))
+                session.add(scraped_image)
+
+            await session.commit()
+            if new_images:
+                await invalidate_search_cache_async()
+                await notify_image_changes_async(session, CHANGE_TYPE_CREATED,
+                                                 [(img.id, img.endpoint, img.image, img.tag) for img in new_images])
             logger.info(
-                f"Added a total of {updated_tags} new tags for {updated_images} images to the monitoring database")
+                f"Added a total of {len(new_images)} new tags for {updated_images} images to the monitoring database")
 
 
 async def delete_old_images(image_update_max_age: timedelta, image_last_accessed_max_age: timedelta):
     image_update_cutoff_date = datetime.now(ZoneInfo('UTC')) - image_update_max_age
     image_cutoff_date = datetime.now(ZoneInfo('UTC')) - image_last_accessed_max_age
-    with rx.session() as session:
-        outdated_images_count = session.exec(
-            select(func.count()).select_from(ImageToScrape).where(ImageToScrape.last_viewed < image_cutoff_date)).one()
-        session.exec(delete(ImageToScrape).where(ImageToScrape.last_viewed < image_cutoff_date))
+    async with async_session() as session:
+        outdated_images = (await session.exec(
+            delete(ImageToScrape).where(ImageToScrape.last_viewed < image_cutoff_date).returning(
+                ImageToScrape.id, ImageToScrape.endpoint, ImageToScrape.image, ImageToScrape.tag))).all()
+        outdated_images_count = len(outdated_images)
+
+        affected_images = (await session.exec(PRUNE_IMAGE_UPDATES_QUERY,
+                                              params={"cutoff_date": image_update_cutoff_date})).all()
+        outdated_image_updates_count = sum(count for _, _, _, _, count in affected_images)
+        if outdated_image_updates_count:
+            await session.exec(delete(ImageUpdateRollup).where(ImageUpdateRollup.count <= 0))
 
-        outdated_image_updates_count = session.exec(
-            select(func.count()).select_from(ImageUpdate).where(
-                ImageUpdate.scraped_at < image_update_cutoff_date)).one()
-        session.exec(delete(ImageUpdate).where(ImageUpdate.scraped_at < image_update_cutoff_date))
+        await session.exec(DELETE_UNREFERENCED_DIGESTS_QUERY)
 
         if outdated_images_count or outdated_image_updates_count:
             logger.info(f"Deleted {outdated_images_count} outdated ImageToScrape entries and "
                         f"{outdated_image_updates_count} outdated ImageUpdate entries")
 
-        session.commit()
+        await session.commit()
+
+    # The snapshots of the affected images are rebuilt on demand by the details page, those of the deleted images must
+    # not be served anymore
+    await delete_details_snapshots_async([(endpoint, image, tag) for _, endpoint, image, tag in outdated_images] +
+                                         [(endpoint, image, tag) for _, endpoint, image, tag, _ in affected_images])
+    await purge_edge_cache_async([(endpoint, image, tag) for _, endpoint, image, tag in outdated_images] +
+                                 [(endpoint, image, tag) for _, endpoint, image, tag, _ in affected_images])
+    async with async_session() as session:
+        await notify_image_changes_async(session, CHANGE_TYPE_DELETED, [tuple(row) for row in outdated_images])
+        await notify_image_changes_async(session, CHANGE_TYPE_PRUNED,
+                                         [(image_id, endpoint, image, tag)
+                                          for image_id, endpoint, image, tag, _ in affected_images])
 
 
 async def clean_digest_tags():
@@ -416,36 +644,42 @@ async def clean_digest_tags():
     or other digest-based tags that should not be monitored.
     """
     logger.info("Cleaning up ImageToScrape entries with digest-like tags")
-    with rx.session() as session:
+    async with async_session() as session:
         query = select(ImageToScrape).where(func.length(ImageToScrape.tag) > 64)
-        images_to_check = session.exec(query).all()
+        images_to_check = (await session.exec(query)).all()
 
-        deleted_count = 0
+        deleted_images: list[ImageToScrape] = []
         for image in images_to_check:
             if contains_digest(image.tag):
                 try:
-                    session.delete(image)
-                    deleted_count += 1
+                    await session.delete(image)
+                    deleted_images.append(image)
                 except Exception as e:
                     logger.warning(f"Failed to delete ImageToScrape entry "
                                    f"'{image.endpoint}/{image.image}:{image.tag}': {e}")
 
-        if deleted_count > 0:
-            logger.info(f"Deleted {deleted_count} ImageToScrape entries with digest-like tags")
+        if deleted_images:
+            logger.info(f"Deleted {len(deleted_images)} ImageToScrape entries with digest-like tags")
 
         try:
-            session.commit()
+            await session.commit()
         except Exception as e:
             logger.warning(f"Failed to commit deletions of digest-like tags: {e}")
+            return
+
+        await delete_details_snapshots_async([(img.endpoint, img.image, img.tag) for img in deleted_images])
+        await purge_edge_cache_async([(img.endpoint, img.image, img.tag) for img in deleted_images])
+        await notify_image_changes_async(session, CHANGE_TYPE_DELETED,
+                                         [(img.id, img.endpoint, img.image, img.tag) for img in deleted_images])
 
 
-def verify_database_connection():
-    with rx.session() as session:
-        session.exec(text("SELECT 1"))  # raises in case the connection to the DB cannot be established
+async def verify_database_connection():
+    async with async_session() as session:
+        await session.exec(text("SELECT 1"))  # raises in case the connection to the DB cannot be established
 
 
 async def main():
-    verify_database_connection()
+    await verify_database_connection()
     last_image_refresh_timestamp = -999999999
     last_scrape_timestamp = -999999999
 
@@ -466,6 +700,14 @@ async def main():
     Retention period of ImageToScrape entries: entries whose last access is older than this configured interval 
     will be automatically deleted.
     """
+    job_execution_max_age = durationpy.from_str(os.getenv("JOB_EXECUTION_MAX_AGE", "90d"))
+    """
+    Retention period of the raw BackgroundJobExecution entries (the status page only uses the daily rollup).
+    """
+    job_execution_daily_max_age = durationpy.from_str(os.getenv("JOB_EXECUTION_DAILY_MAX_AGE", "2y"))
+    """
+    Retention period of the daily rollup (JobExecutionDaily entries) of the background job executions.
+    """
     auto_monitor_new_tags = os.getenv("AUTO_MONITOR_NEW_TAGS", "true").lower() in ["true", "1", "yes"]
     """
     Whether to cache all known tags in the database, such that when refreshing digests, we also check whether the
@@ -494,10 +736,31 @@ async def main():
     """
     We only refresh digests for "latest" tags and for tags whose last_pushed date is within this interval.
     """
+    digest_refresh_batch_size = int(os.getenv("DIGEST_REFRESH_BATCH_SIZE", "10"))
+    """
+    Number of digests that are fetched concurrently (the overall request rate is still limited by
+    MAX_REQUESTS_PER_SECOND).
+    """
+    db_writer_queue_size = int(os.getenv("DB_WRITER_QUEUE_SIZE", "500"))
+    """
+    Maximum number of digest refresh results that may wait to be written to the database. When the queue is full,
+    fetching new digests pauses until the database writer has caught up.
+    """
+    db_writer_batch_size = int(os.getenv("DB_WRITER_BATCH_SIZE", "100"))
+    """
+    Maximum number of digest refresh results that are written to the database in one transaction.
+    """
+    db_writer_max_batch_delay = durationpy.from_str(os.getenv("DB_WRITER_MAX_BATCH_DELAY", "500ms"))
+    """
+    Maximum time the database writer waits for more results to arrive before it writes an incomplete batch.
+    """
 
     global http_request_limiter
     http_request_limiter = Limiter(max_requests_per_second)
 
+    # Lets us verify that no (synchronous) code blocks the event loop and thus stalls in-flight registry requests
+    event_loop_lag_monitor = EventLoopLagMonitor()
+
     while True:
         now = time.monotonic()
         if (now - last_image_refresh_timestamp) > image_refresh_interval.total_seconds():
@@ -507,9 +770,13 @@ async def main():
         now = time.monotonic()
         if (now - last_scrape_timestamp) > scrape_interval.total_seconds():
             last_scrape_timestamp = time.monotonic()
+            await set_scraper_next_run_async(datetime.now(ZoneInfo('UTC')) + scrape_interval)
+            event_loop_lag_monitor.start()
 
             await delete_old_images(image_update_max_age, image_last_accessed_max_age)
 
+            await compact_job_executions(job_execution_max_age, job_execution_daily_max_age)
+
             if auto_monitor_new_tags:
                 await monitor_new_tags()
 
@@ -520,9 +787,14 @@ async def main():
             digest_refresh_start = time.monotonic()
             await refresh_digests(digest_refresh_cooldown_interval, max_retries_on_rate_limit=max_retries_on_rate_limit,
                                   sleep_interval_on_rate_limit=sleep_interval_on_rate_limit,
-                                  refresh_digest_last_pushed_cutoff=refresh_digest_last_pushed_cutoff)
+                                  refresh_digest_last_pushed_cutoff=refresh_digest_last_pushed_cutoff,
+                                  fetch_batch_size=digest_refresh_batch_size,
+                                  db_writer_queue_size=db_writer_queue_size,
+                                  db_writer_batch_size=db_writer_batch_size,
+                                  db_writer_max_batch_delay=db_writer_max_batch_delay)
             digest_refresh_end = time.monotonic()
             digest_refresh_duration = timedelta(seconds=digest_refresh_end - digest_refresh_start)
+            logger.info(f"Event loop lag during the scrape: {event_loop_lag_monitor.stop()}")
             scrape_duration = time.monotonic() - last_scrape_timestamp
             if scrape_duration > scrape_interval.total_seconds():
                 logger.warning(f"Scrape took longer than the interval - some optimizations are required "
@@ -534,10 +806,7 @@ async def main():
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    if sys.platform == 'win32':
-        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-
     try:
-        asyncio.run(main())
+        run(main())
     except KeyboardInterrupt:
         logger.info("SIGINT detected, exiting...")